@@ -0,0 +1,273 @@
+from collections import defaultdict
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest, Now
+from django.utils import timezone
+from .archive import archived_messages_for_conversation
+from .models import Conversation, ConversationParticipant
+from .sharding import messages_for_conversation
+
+PREVIEW_LENGTH = Conversation._meta.get_field('last_message_preview').max_length
+
+# User fields embedded in conversation lists and messages (UserSerializer)
+PROFILE_FIELDS = frozenset(['username', 'email', 'first_name', 'last_name', 'phone_number'])
+
+
+def preview(body):
+    """
+    Return the inbox preview for a message body.
+    """
+    return body[:PREVIEW_LENGTH]
+
+
+def _if_newer(condition, value, field, output_field):
+    """
+    Return `value` when `condition` holds, otherwise keep the column as is.
+    """
+    return Case(
+        When(condition, then=Value(value, output_field=output_field)),
+        default=F(field),
+        output_field=output_field
+    )
+
+
+def record_new_messages(messages):
+    """
+    Apply freshly inserted messages to their conversations' activity columns.
+
+    Each conversation is updated with one UPDATE statement that increments
+    `message_count` and, only if the newest message is at least as recent as
+    the stored one, replaces the last-message columns. Doing the comparison
+    in SQL keeps concurrent senders from overwriting a newer message.
+    Unread counts are updated too (see record_unread).
+    """
+    by_conversation = defaultdict(list)
+    for message in messages:
+        by_conversation[message.conversation_id].append(message)
+
+    for conversation_id, batch in by_conversation.items():
+        newest = max(batch, key=lambda message: (message.sent_at, str(message.message_id)))
+        newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=newest.sent_at)
+        Conversation.objects.filter(pk=conversation_id).update(
+            message_count=F('message_count') + len(batch),
+            last_message_id=_if_newer(
+                newer, newest.message_id, 'last_message_id', models.UUIDField()
+            ),
+            last_message_at=_if_newer(
+                newer, newest.sent_at, 'last_message_at', models.DateTimeField()
+            ),
+            last_message_preview=_if_newer(
+                newer, preview(newest.message_body), 'last_message_preview', models.CharField()
+            ),
+            last_message_sender_id=_if_newer(
+                newer, newest.sender_id, 'last_message_sender_id', models.UUIDField()
+            ),
+            updated_at=Greatest(
+                F('updated_at'),
+                Value(newest.sent_at, output_field=models.DateTimeField())
+            )
+        )
+        record_unread(conversation_id, batch)
+
+
+def _message_key(message):
+    return (message.sent_at, str(message.message_id))
+
+
+def record_unread(conversation_id, batch):
+    """
+    Add a conversation's new messages to its participants' unread counts.
+
+    Participants who sent none of them get one UPDATE adding the batch
+    size. Each sender has read up to their own newest message, so their
+    cursor moves there and their count becomes the messages from others
+    sent after it.
+    """
+    senders = {message.sender_id for message in batch}
+    ConversationParticipant.objects.filter(
+        conversation_id=conversation_id
+    ).exclude(
+        user_id__in=senders
+    ).update(unread_count=F('unread_count') + len(batch))
+
+    for sender_id in senders:
+        own = max((message for message in batch if message.sender_id == sender_id), key=_message_key)
+        unread = sum(
+            1 for message in batch
+            if message.sender_id != sender_id and _message_key(message) > _message_key(own)
+        )
+        ConversationParticipant.objects.filter(
+            conversation_id=conversation_id,
+            user_id=sender_id,
+            last_read_at__lte=own.sent_at
+        ).update(
+            last_read_message_id=own.message_id,
+            last_read_at=own.sent_at,
+            unread_count=unread
+        )
+
+
+def mark_conversation_read(conversation_id, user_id):
+    """
+    Move a participant's read cursor to the conversation's latest message
+    and clear their unread count, in a single UPDATE that reads the latest
+    message from the activity columns. Returns False if the user is not a
+    participant.
+    """
+    conversation = Conversation.objects.filter(pk=OuterRef('conversation_id'))
+    return bool(ConversationParticipant.objects.filter(
+        conversation_id=conversation_id,
+        user_id=user_id
+    ).update(
+        last_read_message_id=Subquery(conversation.values('last_message_id')[:1]),
+        last_read_at=Coalesce(Subquery(conversation.values('last_message_at')[:1]), Now()),
+        unread_count=0
+    ))
+
+
+def mark_read_up_to(message, user_id):
+    """
+    Move a participant's read cursor forward to `message`. Reading the
+    latest message is mark_conversation_read; an older one counts the
+    messages from others sent after it. Cursors never move backwards.
+    """
+    latest = Conversation.objects.filter(
+        pk=message.conversation_id
+    ).values_list('last_message_id', flat=True).first()
+    if latest == message.message_id:
+        return mark_conversation_read(message.conversation_id, user_id)
+
+    unread = messages_for_conversation(message.conversation_id).filter(
+        sent_at__gt=message.sent_at
+    ).exclude(sender_id=user_id).count()
+    return bool(ConversationParticipant.objects.filter(
+        conversation_id=message.conversation_id,
+        user_id=user_id,
+        last_read_at__lt=message.sent_at
+    ).update(
+        last_read_message_id=message.message_id,
+        last_read_at=message.sent_at,
+        unread_count=unread
+    ))
+
+
+def record_message_edited(message):
+    """
+    Refresh the preview if the edited message is the conversation's latest,
+    and bump `revision` so conditional GETs see the edit. `updated_at` is
+    left alone: editing an old message does not move the conversation up
+    the inbox.
+    """
+    Conversation.objects.filter(pk=message.conversation_id).update(
+        last_message_preview=Case(
+            When(
+                last_message_id=message.message_id,
+                then=Value(preview(message.message_body))
+            ),
+            default=F('last_message_preview'),
+            output_field=models.CharField()
+        ),
+        revision=F('revision') + 1
+    )
+
+
+def record_profile_changed(user_ids):
+    """
+    Bump `revision` on every conversation the users are in, since lists
+    and messages embed their participants' and senders' profiles.
+    """
+    Conversation.objects.filter(
+        pk__in=ConversationParticipant.objects.filter(
+            user_id__in=user_ids
+        ).values('conversation_id')
+    ).update(revision=F('revision') + 1)
+
+
+def participant_count_subquery():
+    """
+    Return a correlated subquery counting a conversation's participants.
+    """
+    return Coalesce(Subquery(
+        ConversationParticipant.objects.filter(
+            conversation_id=OuterRef('pk')
+        ).order_by().values('conversation_id').annotate(
+            total=Count('*')
+        ).values('total')
+    ), 0)
+
+
+def touch_conversations(conversation_ids):
+    """
+    Bump `updated_at` on conversations whose participants changed and
+    recount their `participant_count`, in one UPDATE. Counting from the
+    membership index rather than adding the change's size stays exact
+    when add() or remove() is given users who were already (or never)
+    participants.
+    """
+    Conversation.objects.filter(pk__in=conversation_ids).update(
+        updated_at=timezone.now(),
+        participant_count=participant_count_subquery()
+    )
+
+
+def record_message_deleted(message):
+    """
+    Decrement the message count (and the unread count of participants who
+    had not read it) and, if the deleted message was the latest, promote
+    the next most recent message.
+    """
+    with transaction.atomic():
+        Conversation.objects.filter(pk=message.conversation_id).update(
+            message_count=Case(
+                When(message_count__gt=0, then=F('message_count') - 1),
+                default=Value(0)
+            )
+        )
+        ConversationParticipant.objects.filter(
+            conversation_id=message.conversation_id,
+            last_read_at__lt=message.sent_at,
+            unread_count__gt=0
+        ).exclude(
+            user_id=message.sender_id
+        ).update(unread_count=F('unread_count') - 1)
+        refresh_last_message(message.conversation_id, replacing=message.message_id)
+
+
+def refresh_last_message(conversation_id, replacing=None):
+    """
+    Recompute the last-message columns of one conversation from its messages.
+
+    When `replacing` is given the update only applies while that message is
+    still recorded as the latest, so a concurrent insert is never undone.
+    """
+    newest = None
+    # The archive only matters once no hot message is left
+    tiers = (
+        messages_for_conversation(conversation_id),
+        archived_messages_for_conversation(conversation_id),
+    )
+    for messages in tiers:
+        newest = messages.order_by('-sent_at', '-message_id').values(
+            'message_id', 'sent_at', 'message_body', 'sender_id'
+        ).first()
+        if newest is not None:
+            break
+
+    conversations = Conversation.objects.filter(pk=conversation_id)
+    if replacing is not None:
+        conversations = conversations.filter(last_message_id=replacing)
+
+    if newest is None:
+        conversations.update(
+            last_message_id=None,
+            last_message_at=None,
+            last_message_preview='',
+            last_message_sender_id=None
+        )
+    else:
+        conversations.update(
+            last_message_id=newest['message_id'],
+            last_message_at=newest['sent_at'],
+            last_message_preview=preview(newest['message_body']),
+            last_message_sender_id=newest['sender_id']
+        )
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ChatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chats'
+
+    def ready(self):
+        """
+        Import signals when the app is ready so handlers are registered.
+        """
+        from . import signals  # noqa: F401
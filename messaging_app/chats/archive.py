@@ -0,0 +1,139 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import ArchivedMessage, Conversation, Message
+from .search import get_search_backend
+from .sharding import ShardedQuerySet, get_shards, is_sharded, messages_for_conversation, shard_for
+
+ARCHIVED_FIELDS = ('message_id', 'sender_id', 'conversation_id', 'message_body', 'sent_at')
+
+
+def archive_databases():
+    """
+    Return the database aliases holding messages.
+    """
+    return get_shards() or [DEFAULT_DB_ALIAS]
+
+
+def archive_cutoff(days=None):
+    """
+    Return the time before which messages are archived.
+    """
+    if days is None:
+        days = settings.MESSAGE_ARCHIVE_AFTER_DAYS
+    return timezone.now() - timedelta(days=days)
+
+
+def archive_batch(using, cutoff, batch_size):
+    """
+    Move up to `batch_size` of the oldest messages sent before `cutoff` on
+    database `using` into the archive, in one transaction, and return how
+    many were moved.
+
+    Oldest messages go first, so the archive only ever holds the start of
+    a conversation's history and an interrupted run simply resumes. Moved
+    messages leave the search index. Activity columns are unchanged since
+    the messages still exist, but each affected conversation's `revision`
+    is bumped: the inbox-wide message list reads hot messages only, so its
+    ETag must change.
+    """
+    with transaction.atomic(using=using):
+        rows = list(
+            Message.objects.using(using).select_for_update().filter(
+                sent_at__lt=cutoff
+            ).order_by('sent_at', 'message_id').values(*ARCHIVED_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0
+        message_ids = [row['message_id'] for row in rows]
+        ArchivedMessage.objects.using(using).bulk_create(
+            [ArchivedMessage(**row) for row in rows],
+            ignore_conflicts=True
+        )
+        # No signals: the messages are moved, not deleted
+        Message.objects.using(using).filter(pk__in=message_ids)._raw_delete(using)
+        get_search_backend(using).remove_messages(message_ids)
+        Conversation.objects.filter(
+            pk__in={row['conversation_id'] for row in rows}
+        ).update(revision=F('revision') + 1)
+    return len(rows)
+
+
+def archived_messages_for_conversation(conversation_id):
+    """
+    Return a queryset of one conversation's archived messages.
+    """
+    archived = ArchivedMessage.objects.filter(conversation_id=conversation_id)
+    return archived.using(shard_for(conversation_id)) if is_sharded() else archived
+
+
+class MessageHistory(ShardedQuerySet):
+    """
+    A conversation's hot and archived messages used as one ordered queryset.
+
+    Because the archive holds only the oldest messages, a slice ordered by
+    `sent_at` is read from the tier that ordering starts in and falls
+    through to the other only when that tier runs out: newest-first pages
+    never touch the archive until a cursor walks past the hot messages.
+    Each tier is sliced with its own OFFSET, using the per-tier counts the
+    paginator already fetched. Other orderings merge both tiers like any
+    ShardedQuerySet; without sharding both tiers can join users, so rows
+    from `values()` may also be ordered by the sender's columns.
+    """
+
+    def __init__(self, model, querysets, transform=None):
+        super().__init__(model, querysets, transform)
+        self.counts = {}
+
+    def check_ordering(self, fields):
+        if is_sharded():
+            super().check_ordering(fields)
+
+    def count(self):
+        self.counts = {alias: queryset.count() for alias, queryset in self.querysets.items()}
+        return sum(self.counts.values())
+
+    def tier_count(self, alias):
+        if alias not in self.counts:
+            self.counts[alias] = self.querysets[alias].count()
+        return self.counts[alias]
+
+    def tiers(self):
+        ordering = self.ordering()
+        if not ordering or ordering[0] not in ('sent_at', '-sent_at'):
+            return None
+        return ['hot', 'archive'] if ordering[0] == '-sent_at' else ['archive', 'hot']
+
+    def __getitem__(self, index):
+        tiers = self.tiers()
+        if tiers is None or not isinstance(index, slice):
+            return super().__getitem__(index)
+        start, stop = index.start or 0, index.stop
+        # Rows still to skip in the current tier, and rows wanted in total
+        offset, limit = start, None if stop is None else stop - start
+        results = []
+        for alias in tiers:
+            if limit is not None and len(results) >= limit:
+                break
+            end = None if limit is None else offset + limit - len(results)
+            rows = list(self.querysets[alias][offset:end])
+            if rows:
+                offset = 0
+            elif offset:
+                # The whole tier lies before the slice
+                offset = max(0, offset - self.tier_count(alias))
+            results.extend(rows)
+        return self.transform(results) if self.transform else results
+
+
+def conversation_history(conversation_id):
+    """
+    Return every message of a conversation, hot or archived, as a
+    MessageHistory.
+    """
+    return MessageHistory(Message, {
+        'hot': messages_for_conversation(conversation_id),
+        'archive': archived_messages_for_conversation(conversation_id),
+    })
@@ -1,6 +1,6 @@
 from rest_framework import serializers, status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
@@ -8,6 +8,8 @@ from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from .models import User
+from . import metrics
+from .revocation import IndexedRefreshToken
 from .serializers import UserSerializer
 
 
@@ -143,7 +145,7 @@ def logout_user(request):
     try:
         refresh_token = request.data.get('refresh')
         if refresh_token:
-            token = RefreshToken(refresh_token)
+            token = IndexedRefreshToken(refresh_token)
             token.blacklist()
             return Response({
                 'message': 'Logout successful'
@@ -220,4 +222,46 @@ def change_password(request):
     
     return Response({
         'message': 'Password changed successfully'
-    }, status=status.HTTP_200_OK)
\ No newline at end of file
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def auth_metrics(request):
+    """
+    Report authentication cache effectiveness for this worker process.
+    Every JWT user-cache hit is one User query saved; every Basic auth
+    credential-cache hit is one password hash saved. For the revoked-token
+    index, `filter_negatives` counts tokens its Bloom filter cleared
+    without a JTI lookup and `exact_checks` those it had to look up.
+    """
+    counters = metrics.snapshot('auth.')
+    hits = counters.get('auth.jwt.user_cache.hit', 0)
+    misses = counters.get('auth.jwt.user_cache.miss', 0)
+    lookups = hits + misses
+    basic_hits = counters.get('auth.basic.credential_cache.hit', 0)
+    basic_misses = counters.get('auth.basic.credential_cache.miss', 0)
+    basic_lookups = basic_hits + basic_misses
+    revocation_skipped = counters.get('auth.revoked_tokens.skipped', 0)
+    revocation_checked = counters.get('auth.revoked_tokens.checked', 0)
+    return Response({
+        'jwt_user_cache': {
+            'requests': lookups,
+            'hits': hits,
+            'misses': misses,
+            'queries_saved': hits,
+            'queries_saved_per_request': hits / lookups if lookups else None,
+        },
+        'basic_credential_cache': {
+            'requests': basic_lookups,
+            'hits': basic_hits,
+            'misses': basic_misses,
+            'hashes_saved': basic_hits,
+            'hit_rate': basic_hits / basic_lookups if basic_lookups else None,
+        },
+        'revoked_token_index': {
+            'lookups': revocation_skipped + revocation_checked,
+            'filter_negatives': revocation_skipped,
+            'exact_checks': revocation_checked,
+        }
+    })
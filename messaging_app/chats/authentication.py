@@ -0,0 +1,159 @@
+from functools import lru_cache
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import BasicAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+from . import metrics
+
+
+def _user_cache_key(user_id):
+    return f'chats:auth-user:{user_id}'
+
+
+def _credentials_cache_key(userid, password):
+    # Keyed with SECRET_KEY, so the cache never holds anything a password
+    # could be recovered or brute-forced from
+    digest = salted_hmac('chats.basic-auth.credentials', f'{userid}\0{password}', algorithm='sha256')
+    return f'chats:basic-auth:{digest.hexdigest()}'
+
+
+def _password_fingerprint(user):
+    return salted_hmac('chats.basic-auth.password', user.password, algorithm='sha256').hexdigest()
+
+
+def invalidate_users(user_ids):
+    """
+    Drop cached users, immediately and again once the surrounding
+    transaction commits.
+    """
+    keys = [_user_cache_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the token's user through a short-TTL
+    cache instead of a primary-key query on every request.
+
+    Entries live for AUTH_USER_CACHE_TIMEOUT seconds and are dropped when
+    the user is saved or deleted (see chats.signals), so profile updates,
+    password changes and deactivation take effect on the next request.
+    Misses are filled from the primary database. Cache hits and misses are
+    counted in chats.metrics.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        key = _user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            metrics.increment('auth.jwt.user_cache.miss')
+            user = self.user_model.objects.using(DEFAULT_DB_ALIAS).filter(
+                **{api_settings.USER_ID_FIELD: user_id}
+            ).first()
+            if user is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+        else:
+            metrics.increment('auth.jwt.user_cache.hit')
+
+        # The checks JWTAuthentication applies to a freshly loaded user
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    _("The user's password has been changed."), code="password_changed"
+                )
+        return user
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    BasicAuthentication that verifies each distinct set of credentials with
+    the password hasher once per BASIC_AUTH_CACHE_TIMEOUT seconds.
+
+    A verified login is cached under a keyed digest of the credentials,
+    mapped to the user's ID and a fingerprint of their password hash. The
+    user is resolved through the same cache as CachedJWTAuthentication;
+    a password change alters the hash, so the entry stops matching and the
+    next request is verified in full. Failed logins are never cached.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        key = _credentials_cache_key(userid, password)
+        entry = cache.get(key)
+        if entry is not None:
+            user_id, fingerprint = entry
+            user = self.get_cached_user(user_id)
+            if user is not None and constant_time_compare(fingerprint, _password_fingerprint(user)):
+                metrics.increment('auth.basic.credential_cache.hit')
+                if not user.is_active:
+                    raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+                return (user, None)
+            cache.delete(key)
+
+        metrics.increment('auth.basic.credential_cache.miss')
+        user, auth = super().authenticate_credentials(userid, password, request)
+        cache.set(key, (user.pk, _password_fingerprint(user)), settings.BASIC_AUTH_CACHE_TIMEOUT)
+        cache.set(_user_cache_key(user.pk), user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return (user, auth)
+
+    def get_cached_user(self, user_id):
+        key = _user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = get_user_model().objects.using(DEFAULT_DB_ALIAS).filter(pk=user_id).first()
+            if user is not None:
+                cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user
+
+
+@lru_cache(maxsize=None)
+def _import_classes(paths):
+    return [import_string(path) for path in paths]
+
+
+def get_authentication_classes(endpoint, default):
+    """
+    Return the authentication classes API_AUTHENTICATION_CLASSES configures
+    for `endpoint`, or `default` when it has no entry.
+    """
+    paths = settings.API_AUTHENTICATION_CLASSES.get(endpoint)
+    if paths is None:
+        return default
+    return _import_classes(tuple(paths))
+
+
+class EndpointAuthenticationMixin:
+    """
+    Let API_AUTHENTICATION_CLASSES override a viewset's authentication
+    classes per action, keyed "<basename>.<action>" (e.g. "message.list").
+    Hot read endpoints can then skip schemes their clients never use.
+    """
+
+    def get_authenticators(self):
+        # Runs before `self.action` is set; resolve the action the same way
+        request = getattr(self, 'request', None)
+        action_map = getattr(self, 'action_map', None) or {}
+        action = action_map.get(request.method.lower()) if request is not None else None
+        classes = self.authentication_classes
+        if action is not None:
+            classes = get_authentication_classes(f'{self.basename}.{action}', classes)
+        return [auth() for auth in classes]
@@ -0,0 +1,88 @@
+import hashlib
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags
+from .models import Conversation, ConversationParticipant
+
+
+def inbox_version(user):
+    """
+    Return a version token for everything in the user's inbox.
+
+    Built from one aggregate over the user's participant rows: the newest
+    `updated_at` (new messages move it forward through chats.activity, and
+    participant changes bump it), the number of conversations, the total
+    message count (which catches deletes), the total `revision` (which
+    catches edits and participants' profile changes), and the user's
+    unread total and latest read cursor (which catch mark-as-read). Nothing is
+    serialized. Versions are read from the primary, so a lagging replica
+    cannot hand back a version older than what the client has seen.
+    """
+    summary = ConversationParticipant.objects.using(DEFAULT_DB_ALIAS).filter(
+        user_id=user.pk
+    ).aggregate(
+        latest=Max('conversation__updated_at'),
+        conversations=Count('pk'),
+        messages=Sum('conversation__message_count'),
+        revisions=Sum('conversation__revision'),
+        unread=Sum('unread_count'),
+        read=Max('last_read_at')
+    )
+    return '{latest}:{conversations}:{messages}:{revisions}:{unread}:{read}'.format(**summary)
+
+
+def conversation_version(conversation_id):
+    """
+    Return a version token for one conversation's messages, or None if the
+    conversation does not exist.
+    """
+    row = Conversation.objects.using(DEFAULT_DB_ALIAS).filter(pk=conversation_id).values_list(
+        'updated_at', 'message_count', 'revision'
+    ).first()
+    if row is None:
+        return None
+    return '{}:{}:{}'.format(*row)
+
+
+def make_etag(request, version):
+    """
+    Return a weak ETag for a list response.
+
+    The user, the full path (page, filters, ordering) and the Accept header
+    are mixed in, so different views of the same data never share a tag.
+    """
+    key = '|'.join([
+        str(request.user.pk),
+        version,
+        request.get_full_path(),
+        request.META.get('HTTP_ACCEPT', ''),
+    ])
+    return 'W/"{}"'.format(hashlib.sha1(key.encode()).hexdigest())
+
+
+def not_modified(request, etag):
+    """
+    Return a 304 response if the request's If-None-Match matches `etag`,
+    otherwise None. Comparison is weak, as RFC 9110 requires for GET.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    client_etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if '*' in client_etags or _strip_weak(etag) in map(_strip_weak, client_etags):
+        return set_etag(HttpResponseNotModified(), etag)
+    return None
+
+
+def set_etag(response, etag):
+    """
+    Attach the ETag and ask clients to revalidate instead of reusing the
+    response blindly.
+    """
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
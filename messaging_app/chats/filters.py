@@ -1,7 +1,11 @@
 import django_filters
 from django.db.models import Q
 from django_filters import rest_framework as filters
-from .models import Message, Conversation, User
+from rest_framework.filters import SearchFilter
+from .models import ArchivedMessage, Message, Conversation, ConversationParticipant, User, UserSearchToken
+from .search import search_messages
+from .sharding import lookup_ids
+from .user_search import filter_users, matching_tokens
 
 
 class MessageFilter(django_filters.FilterSet):
@@ -20,33 +24,21 @@ class MessageFilter(django_filters.FilterSet):
     date_to = django_filters.DateTimeFilter(field_name='sent_at', lookup_expr='lte')
     
     # Conversation filtering
-    conversation_id = django_filters.UUIDFilter(field_name='conversation__conversation_id')
+    conversation_id = django_filters.UUIDFilter(method='filter_conversation')
     
     # Sender filtering
     sender_id = django_filters.UUIDFilter(field_name='sender__user_id')
-    sender_email = django_filters.CharFilter(field_name='sender__email', lookup_expr='icontains')
+    sender_email = django_filters.CharFilter(method='filter_by_sender_email')
     sender_name = django_filters.CharFilter(method='filter_by_sender_name')
     
     # Message content filtering
-    message_content = django_filters.CharFilter(field_name='message_body', lookup_expr='icontains')
+    message_content = django_filters.CharFilter(method='filter_message_content')
     
     # Participants filtering (messages from conversations with specific users)
     with_user = django_filters.UUIDFilter(method='filter_conversations_with_user')
     with_user_email = django_filters.CharFilter(method='filter_conversations_with_user_email')
-    
-    # Ordering
-    ordering = django_filters.OrderingFilter(
-        fields=(
-            ('sent_at', 'sent_at'),
-            ('sender__first_name', 'sender_name'),
-            ('conversation__updated_at', 'conversation_updated'),
-        ),
-        field_labels={
-            'sent_at': 'Date Sent',
-            'sender_name': 'Sender Name',
-            'conversation_updated': 'Conversation Updated',
-        }
-    )
+
+    # `?ordering=` is left to the view's OrderingFilter and its ordering_fields
 
     class Meta:
         model = Message
@@ -57,30 +49,125 @@ class MessageFilter(django_filters.FilterSet):
             'message_body': ['icontains'],
         }
 
+    def filter_conversation(self, queryset, name, value):
+        """
+        Filter messages to one conversation. Views that already scoped the
+        queryset to it (see MessageViewSet.get_conversation_id) skip the
+        repeated condition.
+        """
+        view = getattr(self.request, 'parser_context', {}).get('view')
+        if view is not None and hasattr(view, 'get_conversation_id') and view.get_conversation_id():
+            return queryset
+        return queryset.filter(conversation_id=value)
+
     def filter_by_sender_name(self, queryset, name, value):
         """
         Filter messages by sender's first name or last name.
         """
-        return queryset.filter(
-            Q(sender__first_name__icontains=value) |
-            Q(sender__last_name__icontains=value)
-        )
+        senders = User.objects.filter(
+            Q(first_name__icontains=value) |
+            Q(last_name__icontains=value)
+        ).values_list('user_id', flat=True)
+        return queryset.filter(sender_id__in=lookup_ids(senders))
+
+    def filter_by_sender_email(self, queryset, name, value):
+        """
+        Filter messages by a substring of the sender's email.
+        """
+        senders = User.objects.filter(email__icontains=value).values_list('user_id', flat=True)
+        return queryset.filter(sender_id__in=lookup_ids(senders))
+
+    def filter_message_content(self, queryset, name, value):
+        """
+        Full-text search on the message body, ranked by relevance.
+        """
+        return search_messages(queryset, value)
 
     def filter_conversations_with_user(self, queryset, name, value):
         """
         Filter messages from conversations that include a specific user.
         """
-        return queryset.filter(
-            conversation__participants__user_id=value
-        ).distinct()
+        conversations = ConversationParticipant.objects.filter(
+            user_id=value
+        ).values_list('conversation_id', flat=True)
+        return queryset.filter(conversation_id__in=lookup_ids(conversations))
 
     def filter_conversations_with_user_email(self, queryset, name, value):
         """
         Filter messages from conversations that include a user with specific email.
         """
-        return queryset.filter(
-            conversation__participants__email__icontains=value
-        ).distinct()
+        conversations = ConversationParticipant.objects.filter(
+            user__email__icontains=value
+        ).values_list('conversation_id', flat=True)
+        return queryset.filter(conversation_id__in=lookup_ids(conversations))
+
+
+class ArchivedMessageFilter(MessageFilter):
+    """
+    MessageFilter for the archive tier of a conversation's history (see
+    chats.archive.MessageHistory). Archived bodies are compressed and not
+    indexed, so body filters match nothing there.
+    """
+    message_body__icontains = django_filters.CharFilter(method='match_nothing')
+
+    class Meta:
+        model = ArchivedMessage
+        fields = {
+            'sent_at': ['exact', 'gte', 'lte', 'year', 'month', 'day'],
+            'sender': ['exact'],
+            'conversation': ['exact'],
+        }
+
+    def match_nothing(self, queryset, name, value):
+        return queryset.none()
+
+
+class MessageFilterBackend(filters.DjangoFilterBackend):
+    """
+    DjangoFilterBackend that filters archived messages with
+    ArchivedMessageFilter instead of the view's MessageFilter.
+    """
+
+    def get_filterset_class(self, view, queryset=None):
+        if queryset is not None and queryset.model is ArchivedMessage:
+            return ArchivedMessageFilter
+        return super().get_filterset_class(view, queryset)
+
+
+class MessageSearchFilter(SearchFilter):
+    """
+    `?search=` for messages, served by the configured full-text backend
+    instead of an icontains scan over `search_fields`. Messages whose
+    sender's name, username or email matches every word, looked up in the
+    user search token index, are found too. The queryset is already
+    scoped to the caller's conversations.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        query = ' '.join(terms)
+        senders = matching_tokens(query)
+        if senders is None or not senders.exists():
+            # Body matches only, in relevance order
+            return search_messages(queryset, query)
+        sender_ids = lookup_ids(senders.values_list('user_id', flat=True))
+        return search_messages(queryset, query, sender_ids)
+
+
+class UserSearchFilter(SearchFilter):
+    """
+    `?search=` for users, answered from the user search token index: every
+    word of the query must start a word of the user's name, username or
+    email, instead of an icontains scan over `search_fields`.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return filter_users(queryset, ' '.join(terms))
 
 
 class ConversationFilter(django_filters.FilterSet):
@@ -100,18 +187,22 @@ class ConversationFilter(django_filters.FilterSet):
     participant_name = django_filters.CharFilter(method='filter_by_participant_name')
     
     # Conversation size filtering
-    min_participants = django_filters.NumberFilter(method='filter_min_participants')
-    max_participants = django_filters.NumberFilter(method='filter_max_participants')
+    min_participants = django_filters.NumberFilter(field_name='participant_count', lookup_expr='gte')
+    max_participants = django_filters.NumberFilter(field_name='participant_count', lookup_expr='lte')
     
     # Ordering
     ordering = django_filters.OrderingFilter(
         fields=(
             ('created_at', 'created_at'),
             ('updated_at', 'updated_at'),
+            ('last_message_at', 'last_message_at'),
+            ('message_count', 'message_count'),
         ),
         field_labels={
             'created_at': 'Date Created',
             'updated_at': 'Last Updated',
+            'last_message_at': 'Last Message',
+            'message_count': 'Message Count',
         }
     )
 
@@ -132,22 +223,6 @@ class ConversationFilter(django_filters.FilterSet):
             Q(participants__last_name__icontains=value)
         ).distinct()
 
-    def filter_min_participants(self, queryset, name, value):
-        """
-        Filter conversations with at least the specified number of participants.
-        """
-        return queryset.annotate(
-            participant_count=django_filters.Count('participants')
-        ).filter(participant_count__gte=value)
-
-    def filter_max_participants(self, queryset, name, value):
-        """
-        Filter conversations with at most the specified number of participants.
-        """
-        return queryset.annotate(
-            participant_count=django_filters.Count('participants')
-        ).filter(participant_count__lte=value)
-
 
 class UserFilter(django_filters.FilterSet):
     """
@@ -197,9 +272,6 @@ class UserFilter(django_filters.FilterSet):
 
     def filter_by_name(self, queryset, name, value):
         """
-        Filter users by first name or last name.
+        Filter users by words starting their first or last name.
         """
-        return queryset.filter(
-            Q(first_name__icontains=value) |
-            Q(last_name__icontains=value)
-        )
\ No newline at end of file
+        return filter_users(queryset, value, field=UserSearchToken.NAME)
\ No newline at end of file
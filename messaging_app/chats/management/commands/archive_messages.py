@@ -0,0 +1,64 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from chats.archive import archive_batch, archive_cutoff, archive_databases
+
+
+class Command(BaseCommand):
+    """
+    Move messages older than MESSAGE_ARCHIVE_AFTER_DAYS (or --days) from
+    chats_message to the compressed archive table, oldest first, one
+    transaction per batch on each message database. Safe to stop and
+    rerun: every batch commits on its own and the next run carries on
+    from the oldest message left.
+    """
+    help = 'Archive old messages in chunked, resumable batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.MESSAGE_ARCHIVE_AFTER_DAYS,
+            help='Archive messages sent more than this many days ago'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.MESSAGE_ARCHIVE_BATCH_SIZE,
+            help='Number of messages moved per transaction'
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            default=0,
+            help='Stop after this many batches per database (0 for no limit)'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Seconds to sleep between batches to spread the load'
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--days and --batch-size must be positive')
+
+        # A fixed cutoff keeps a long run from chasing messages as they age
+        cutoff = archive_cutoff(options['days'])
+        total = 0
+        for using in archive_databases():
+            archived = 0
+            batches = 0
+            while not options['max_batches'] or batches < options['max_batches']:
+                moved = archive_batch(using, cutoff, options['batch_size'])
+                if not moved:
+                    break
+                archived += moved
+                batches += 1
+                self.stdout.write(f'Archived {archived} messages on {using}...')
+                if options['pause']:
+                    time.sleep(options['pause'])
+            total += archived
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} messages sent before {cutoff.isoformat()}'))
@@ -0,0 +1,113 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from chats.activity import preview
+from chats.models import Conversation, Message
+from chats.sharding import group_by_shard, is_sharded
+
+
+class Command(BaseCommand):
+    """
+    Recompute the denormalized last-message and message-count columns on
+    every conversation, in primary-key batches. `updated_at` is moved
+    forward to the last message so inbox ordering reflects activity.
+    Messages written while a batch is being computed can be overwritten,
+    so run this during a quiet period. With MESSAGE_SHARDS set, each batch
+    reads its messages from the shards instead of through subqueries.
+    """
+    help = 'Backfill last_message_* and message_count on conversations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of conversations updated per transaction'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        newest = Message.objects.filter(
+            conversation_id=OuterRef('pk')
+        ).order_by('-sent_at', '-message_id')
+        message_count = Message.objects.filter(
+            conversation_id=OuterRef('pk')
+        ).order_by().values('conversation_id').annotate(
+            total=Count('*')
+        ).values('total')
+
+        fields = [
+            'last_message_id',
+            'last_message_at',
+            'last_message_preview',
+            'last_message_sender',
+            'message_count',
+            'updated_at',
+        ]
+        updated = 0
+        last_pk = None
+        while True:
+            conversations = Conversation.objects.order_by('pk')
+            if last_pk is not None:
+                conversations = conversations.filter(pk__gt=last_pk)
+            if is_sharded():
+                batch = self.annotate_from_shards(list(conversations.only('pk', 'updated_at')[:batch_size]))
+            else:
+                batch = list(conversations.annotate(
+                    actual_count=Coalesce(Subquery(message_count), 0),
+                    newest_id=Subquery(newest.values('message_id')[:1]),
+                    newest_at=Subquery(newest.values('sent_at')[:1]),
+                    newest_body=Subquery(newest.values('message_body')[:1]),
+                    newest_sender_id=Subquery(newest.values('sender_id')[:1]),
+                ).only('pk', 'updated_at')[:batch_size])
+            if not batch:
+                break
+
+            for conversation in batch:
+                conversation.message_count = conversation.actual_count
+                conversation.last_message_id = conversation.newest_id
+                conversation.last_message_at = conversation.newest_at
+                conversation.last_message_preview = preview(conversation.newest_body or '')
+                conversation.last_message_sender_id = conversation.newest_sender_id
+                if conversation.newest_at and conversation.newest_at > conversation.updated_at:
+                    conversation.updated_at = conversation.newest_at
+
+            with transaction.atomic():
+                Conversation.objects.bulk_update(batch, fields)
+
+            updated += len(batch)
+            last_pk = batch[-1].pk
+            self.stdout.write(f'Backfilled {updated} conversations...')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {updated} conversations'))
+
+    def annotate_from_shards(self, batch):
+        """
+        Set the same attributes as the subquery annotations, reading each
+        conversation's messages from its shard.
+        """
+        counts = {}
+        newest = {}
+        for alias, conversation_ids in group_by_shard([conversation.pk for conversation in batch]).items():
+            messages = Message.objects.using(alias)
+            counts.update(messages.filter(
+                conversation_id__in=conversation_ids
+            ).order_by().values('conversation_id').annotate(
+                total=Count('*')
+            ).values_list('conversation_id', 'total'))
+            for conversation_id in conversation_ids:
+                newest[conversation_id] = messages.filter(
+                    conversation_id=conversation_id
+                ).order_by('-sent_at', '-message_id').values(
+                    'message_id', 'sent_at', 'message_body', 'sender_id'
+                ).first() or {}
+
+        for conversation in batch:
+            latest = newest.get(conversation.pk, {})
+            conversation.actual_count = counts.get(conversation.pk, 0)
+            conversation.newest_id = latest.get('message_id')
+            conversation.newest_at = latest.get('sent_at')
+            conversation.newest_body = latest.get('message_body')
+            conversation.newest_sender_id = latest.get('sender_id')
+        return batch
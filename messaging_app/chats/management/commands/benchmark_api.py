@@ -0,0 +1,244 @@
+import json
+import math
+import platform
+import random
+import subprocess
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from chats.metrics import RequestMetrics
+from chats.models import ConversationParticipant, User
+from .seed_load_data import LOAD_USER_PREFIX, WORDS
+
+
+def percentile(ordered, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+# Each scenario turns (user's conversation IDs, random generator) into
+# (method, path, data). Names follow API_AUTHENTICATION_CLASSES keys.
+SCENARIOS = {
+    'conversation.list': lambda ids, rng: ('get', '/api/conversations/', None),
+    'conversation.unread': lambda ids, rng: ('get', '/api/conversations/unread/', None),
+    'conversation.messages': lambda ids, rng: ('get', f'/api/conversations/{rng.choice(ids)}/messages/', None),
+    'message.list': lambda ids, rng: ('get', '/api/messages/', None),
+    'message.search': lambda ids, rng: ('get', '/api/messages/', {'search': rng.choice(WORDS)}),
+    'user.autocomplete': lambda ids, rng: ('get', '/api/users/autocomplete/', {'q': rng.choice(WORDS)[:3]}),
+    'message.send_message': lambda ids, rng: ('post', '/api/messages/send_message/', {
+        'conversation_id': str(rng.choice(ids)),
+        'message_body': ' '.join(rng.choices(WORDS, k=8)),
+    }),
+    'conversation.mark_read': lambda ids, rng: ('post', f'/api/conversations/{rng.choice(ids)}/mark_read/', None),
+}
+WRITE_SCENARIOS = {'message.send_message', 'conversation.mark_read'}
+
+
+class Command(BaseCommand):
+    """
+    Drive the chats API routes in-process with APIClient from concurrent
+    worker threads, against the data seeded by seed_load_data, and report
+    p50/p95/p99 latency, throughput and database queries per request for
+    every endpoint. Each request authenticates with a real JWT as a random
+    seeded user. Results are written to a JSON file (--output) tagged with
+    the git commit, and --compare reports changes against an earlier file,
+    failing past --max-regression. Write scenarios add messages and move
+    read cursors; --read-only skips them.
+    """
+    help = 'Benchmark the chats API endpoints under concurrent synthetic load'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent worker threads')
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per endpoint first')
+        parser.add_argument(
+            '--endpoints',
+            nargs='+',
+            choices=sorted(SCENARIOS),
+            help='Endpoints to run (default: all)'
+        )
+        parser.add_argument('--read-only', action='store_true', help='Skip endpoints that write')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for users and requests')
+        parser.add_argument(
+            '--output',
+            default='api-benchmark.json',
+            help='JSON file the results are written to'
+        )
+        parser.add_argument('--compare', help='Earlier results file to compare with')
+        parser.add_argument(
+            '--max-regression',
+            type=float,
+            help='Fail if any p95 grows by more than this fraction over --compare, e.g. 0.2'
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['requests'] < 1:
+            raise CommandError('--workers and --requests must be positive')
+        memberships = defaultdict(list)
+        for user_id, conversation_id in ConversationParticipant.objects.filter(
+            user__username__startswith=LOAD_USER_PREFIX
+        ).values_list('user_id', 'conversation_id'):
+            memberships[user_id].append(conversation_id)
+        if not memberships:
+            raise CommandError('No load data found; run seed_load_data first')
+
+        users = {user.pk: user for user in User.objects.filter(pk__in=list(memberships))}
+        tokens = {user_id: str(AccessToken.for_user(user)) for user_id, user in users.items()}
+        user_ids = sorted(memberships)
+
+        names = options['endpoints'] or list(SCENARIOS)
+        if options['read_only']:
+            names = [name for name in names if name not in WRITE_SCENARIOS]
+
+        results = {}
+        for name in names:
+            results[name] = self.run(name, user_ids, memberships, tokens, options)
+            self.report(name, results[name])
+
+        document = {
+            'commit': self.git_commit(),
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'options': {key: options[key] for key in ('workers', 'requests', 'warmup', 'seed', 'read_only')},
+            'dataset': {'users': len(users), 'memberships': sum(len(ids) for ids in memberships.values())},
+            'endpoints': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(document, output, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options['compare']:
+            self.compare(results, options)
+
+    def run(self, name, user_ids, memberships, tokens, options):
+        """
+        Run one endpoint's warmup and timed requests spread over the
+        workers, and summarize them.
+        """
+        scenario = SCENARIOS[name]
+        workers = options['workers']
+        shares = [options['requests'] // workers + (index < options['requests'] % workers) for index in range(workers)]
+
+        def work(index, count, warmup):
+            rng = random.Random(f"{options['seed']}-{name}-{index}-{warmup}")
+            client = APIClient()
+            samples = []
+            try:
+                for _ in range(count):
+                    user_id = rng.choice(user_ids)
+                    method, path, data = scenario(memberships[user_id], rng)
+                    client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens[user_id]}')
+                    samples.append(self.request(client, method, path, data))
+            finally:
+                if workers > 1:
+                    # Each thread opened its own connections
+                    connections.close_all()
+            return samples
+
+        self.spread(work, [math.ceil(options['warmup'] / workers)] * workers, True)
+        start = time.perf_counter()
+        samples = self.spread(work, shares, False)
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(sample[0] for sample in samples)
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for sample in samples if sample[2] >= 400),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'queries_per_request': round(sum(sample[1] for sample in samples) / len(samples), 2),
+        }
+
+    def spread(self, work, shares, warmup):
+        """
+        Run `work` once per worker and return all their samples. A single
+        worker runs in this thread, on this thread's connections.
+        """
+        if len(shares) == 1:
+            return work(0, shares[0], warmup)
+        with ThreadPoolExecutor(max_workers=len(shares)) as pool:
+            futures = [pool.submit(work, index, count, warmup) for index, count in enumerate(shares)]
+            return [sample for future in futures for sample in future.result()]
+
+    def request(self, client, method, path, data):
+        """
+        Make one request and return (seconds, queries, status code).
+        """
+        metrics = RequestMetrics()
+        wrapped = [connections[alias] for alias in connections]
+        for database in wrapped:
+            database.execute_wrappers.append(metrics)
+        try:
+            start = time.perf_counter()
+            if method == 'get':
+                response = client.get(path, data)
+            else:
+                response = client.post(path, data, format='json')
+            if response.streaming:
+                # Time the whole body, as a client would receive it
+                b''.join(response.streaming_content)
+            seconds = time.perf_counter() - start
+        finally:
+            for database in wrapped:
+                database.execute_wrappers.remove(metrics)
+        return seconds, metrics.queries, response.status_code
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:<24} p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+            f"p99 {result['p99_ms']:8.2f} ms  {result['throughput_rps']:8.1f} req/s  "
+            f"{result['queries_per_request']:5.1f} queries  {result['errors']} errors"
+        )
+
+    def compare(self, results, options):
+        """
+        Print p95 and throughput changes against an earlier results file,
+        and fail past --max-regression.
+        """
+        with open(options['compare']) as baseline_file:
+            baseline = json.load(baseline_file)
+        self.stdout.write(f"Compared with {options['compare']} (commit {baseline.get('commit') or 'unknown'}):")
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get('endpoints', {}).get(name)
+            if not before:
+                continue
+            p95_change = result['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0.0
+            throughput_change = (
+                result['throughput_rps'] / before['throughput_rps'] - 1 if before['throughput_rps'] else 0.0
+            )
+            self.stdout.write(
+                f'{name:<24} p95 {p95_change:+7.1%}  throughput {throughput_change:+7.1%}  '
+                f"queries {before['queries_per_request']:.1f} -> {result['queries_per_request']:.1f}"
+            )
+            if options['max_regression'] is not None and p95_change > options['max_regression']:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f"p95 regressed by more than {options['max_regression']:.0%}: {', '.join(regressions)}")
+
+    def git_commit(self):
+        try:
+            result = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+                check=True
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return result.stdout.strip()
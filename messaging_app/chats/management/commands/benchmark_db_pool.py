@@ -0,0 +1,91 @@
+import time
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.test import Client
+from rest_framework_simplejwt.tokens import AccessToken
+from chats.models import Conversation, Message, User
+from messaging_app.db.pool import close_pools, pool_stats
+
+
+class Command(BaseCommand):
+    """
+    Measure API requests per second with and without the database
+    connection pool. Requests run through the full Django handler
+    in-process and end as a real request does, by closing the connection,
+    which the pool turns into a return. The default database must use one
+    of the messaging_app.db.backends engines. Seeded rows are deleted
+    afterwards.
+    """
+    help = 'Benchmark API throughput with and without database connection pooling'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Number of timed requests per configuration'
+        )
+        parser.add_argument(
+            '--path',
+            default='/api/conversations/',
+            help='API path requested'
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if not hasattr(connection, 'pool_options'):
+            raise CommandError(
+                "DATABASES['default'] must use a messaging_app.db.backends engine to benchmark pooling"
+            )
+
+        tag = uuid.uuid4().hex[:8]
+        users = [
+            User.objects.create_user(
+                username=f'pool-{tag}-{i}',
+                email=f'pool-{tag}-{i}@example.com',
+                password='benchmark-password',
+                first_name='Pool',
+                last_name=str(i)
+            )
+            for i in range(2)
+        ]
+        conversation = Conversation.objects.create()
+        conversation.participants.add(*users)
+        Message.objects.create(sender=users[0], conversation=conversation, message_body='ping')
+        client = Client(headers={'Authorization': f'Bearer {AccessToken.for_user(users[0])}'})
+
+        pool_options = connection.settings_dict['OPTIONS']
+        configured = pool_options.get('pool')
+        try:
+            baseline = None
+            for label, pool in (('without pool', None), ('with pool', configured or True)):
+                pool_options['pool'] = pool
+                connection.close()
+                close_pools()
+                rate = self.run(client, options)
+                baseline = baseline or rate
+                self.stdout.write(f'{label:<14} {rate:8.1f} requests/s  {rate / baseline:5.2f}x')
+            for alias, stats in pool_stats().items():
+                self.stdout.write(f'pool {alias}: ' + ', '.join(f'{name}={value}' for name, value in stats.items()))
+        finally:
+            pool_options['pool'] = configured
+            connection.close()
+            close_pools()
+            Conversation.objects.filter(pk=conversation.pk).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def run(self, client, options):
+        for _ in range(10):
+            self.request(client, options['path'])
+        start = time.perf_counter()
+        for _ in range(options['requests']):
+            self.request(client, options['path'])
+        return options['requests'] / (time.perf_counter() - start)
+
+    def request(self, client, path):
+        response = client.get(path)
+        if response.status_code != 200:
+            raise CommandError(f'GET {path} returned {response.status_code}')
+        # What the request_finished signal does after a real request
+        close_old_connections()
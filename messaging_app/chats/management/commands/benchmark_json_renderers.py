@@ -0,0 +1,136 @@
+import json
+import resource
+import time
+import tracemalloc
+from contextlib import ExitStack
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.text import compress_sequence
+from rest_framework.renderers import JSONRenderer
+from chats.models import Conversation, Message, User
+from chats.serializers import MessageSerializer
+from chats.sharding import get_shards, messages_for_conversation, with_senders
+from chats.streaming import StreamingJSONRenderer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Compare DRF's JSONRenderer with StreamingJSONRenderer on paginated
+    message pages: throughput (best of several rounds) and the peak memory
+    allocated while encoding one page, measured with tracemalloc since the
+    process RSS high-water mark only ever grows. Streaming bodies are
+    consumed chunk by chunk, as a WSGI server would. Seeds a throwaway
+    conversation inside transactions that are rolled back afterwards, and
+    checks every path produces the same JSON.
+    """
+    help = 'Benchmark the streaming JSON renderer against JSONRenderer'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=100,
+            help='Number of messages in the rendered page'
+        )
+        parser.add_argument(
+            '--body-size',
+            type=int,
+            default=500,
+            help='Characters per message body'
+        )
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=20,
+            help='Number of timed rounds per renderer'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with ExitStack() as stack:
+                for alias in {DEFAULT_DB_ALIAS, *get_shards()}:
+                    stack.enter_context(transaction.atomic(using=alias))
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        page_size = options['page_size']
+        senders = [
+            User.objects.create_user(
+                username=f'bench{i}',
+                email=f'bench{i}@example.com',
+                password='benchmark-password',
+                first_name=f'Bench{i}',
+                last_name='Sender'
+            )
+            for i in range(5)
+        ]
+        conversation = Conversation.objects.create()
+        conversation.participants.add(*senders)
+        Message.objects.bulk_create([
+            Message(
+                sender=senders[i % len(senders)],
+                conversation=conversation,
+                message_body=f'Benchmark message {i} '.ljust(options['body_size'], 'x')
+            )
+            for i in range(page_size)
+        ])
+        messages = with_senders(messages_for_conversation(conversation.pk)).order_by('sent_at', 'message_id')
+        page = {
+            'count': page_size,
+            'next': None,
+            'previous': None,
+            'results': MessageSerializer(list(messages), many=True).data,
+        }
+        streaming = StreamingJSONRenderer()
+        renderers = (
+            ('JSONRenderer', lambda: [JSONRenderer().render(page)]),
+            ('streaming', lambda: streaming.render_chunks(page)),
+            ('streaming + gzip', lambda: compress_sequence(streaming.render_chunks(page), max_random_bytes=100)),
+        )
+
+        if json.loads(JSONRenderer().render(page)) != json.loads(b''.join(streaming.render_chunks(page))):
+            raise CommandError('StreamingJSONRenderer output differs from JSONRenderer')
+
+        # Throughput is of the JSON encoded, whatever is sent on the wire
+        encoded = self.consume(renderers[0][1])
+        baseline = None
+        for name, render in renderers:
+            best = min(self.time(render) for _ in range(options['rounds']))
+            peak = self.peak(render)
+            size = self.consume(render)
+            baseline = baseline or best
+            self.stdout.write(
+                f'{name:<18} {best * 1000:8.2f} ms  {encoded / best / 2 ** 20:8.1f} MB/s  '
+                f'peak {peak / 1024:8.1f} KiB  {size:>9} bytes  {baseline / best:5.2f}x'
+            )
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stdout.write(f'Process peak RSS: {maxrss} KiB')
+
+    def consume(self, render):
+        """
+        Read a body chunk by chunk, as a WSGI server would, and return its size.
+        """
+        return sum(len(chunk) for chunk in render())
+
+    def time(self, render):
+        start = time.perf_counter()
+        self.consume(render)
+        return time.perf_counter() - start
+
+    def peak(self, render):
+        """
+        Return the most memory allocated at once while producing a body.
+        """
+        tracemalloc.start()
+        try:
+            self.consume(render)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
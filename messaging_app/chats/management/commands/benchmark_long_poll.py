@@ -0,0 +1,126 @@
+import asyncio
+import resource
+import time
+import uuid
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient
+from rest_framework_simplejwt.tokens import AccessToken
+from chats.models import ChangeEvent, Conversation, Message, User
+from chats.updates import hub, latest_cursor, record_messages
+
+
+class Command(BaseCommand):
+    """
+    Park thousands of concurrent long-poll requests on /api/updates/ in one
+    process, send one message to every conversation, and measure how long
+    the waiters take to register and to be woken. Requests go through the
+    full ASGI handler in-process, so no server is needed. Seeded users and
+    conversations are deleted afterwards.
+    """
+    help = 'Benchmark the long-poll updates feed with many concurrent pollers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pollers',
+            type=int,
+            default=5000,
+            help='Number of concurrent long-poll requests'
+        )
+        parser.add_argument(
+            '--conversations',
+            type=int,
+            default=100,
+            help='Number of two-user conversations the pollers are spread over'
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=60,
+            help='Long-poll timeout passed by every poller, in seconds'
+        )
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        users, conversations = self.seed(tag, options['conversations'])
+        start = latest_cursor()
+        try:
+            async_to_sync(self.run)(users, conversations, start, options)
+        finally:
+            # The benchmark's events stay in the log (prune_change_events
+            # removes them) so the feed's cursor never moves backwards
+            Conversation.objects.filter(pk__in=[c.pk for c in conversations]).delete()
+            User.objects.filter(pk__in=[u.pk for u in users]).delete()
+
+    def seed(self, tag, count):
+        users = []
+        for i in range(count * 2):
+            user = User(
+                username=f'poll-{tag}-{i}',
+                email=f'poll-{tag}-{i}@example.com',
+                first_name='Poll',
+                last_name=str(i)
+            )
+            user.set_unusable_password()
+            users.append(user)
+        User.objects.bulk_create(users)
+
+        conversations = Conversation.objects.bulk_create([Conversation() for _ in range(count)])
+        Conversation.participants.through.objects.bulk_create([
+            Conversation.participants.through(conversation=conversation, user=user)
+            for i, conversation in enumerate(conversations)
+            for user in users[i * 2:i * 2 + 2]
+        ])
+        return users, conversations
+
+    async def run(self, users, conversations, cursor, options):
+        client = AsyncClient()
+        headers = [{'Authorization': f'Bearer {AccessToken.for_user(user)}'} for user in users]
+        pollers = options['pollers']
+        woken_at = {}
+
+        async def poll(i):
+            response = await client.get(
+                '/api/updates/',
+                {'cursor': cursor, 'timeout': options['timeout']},
+                headers=headers[i % len(headers)]
+            )
+            woken_at[i] = time.perf_counter()
+            return response
+
+        # Start this process's hub, as any earlier request would have
+        await client.get('/api/updates/', {'cursor': cursor, 'timeout': 0}, headers=headers[0])
+        while hub.head is None:
+            await asyncio.sleep(0.01)
+
+        started = time.perf_counter()
+        tasks = [asyncio.ensure_future(poll(i)) for i in range(pollers)]
+        while len(hub) < pollers:
+            if any(task.done() for task in tasks):
+                raise CommandError('A poller returned before any change was published')
+            if time.perf_counter() - started > options['timeout']:
+                raise CommandError(f'Only {len(hub)} of {pollers} pollers registered')
+            await asyncio.sleep(0.05)
+        registered = time.perf_counter() - started
+        self.stdout.write(f'{pollers} pollers parked in {registered:.2f} s')
+
+        sent = time.perf_counter()
+        messages = await sync_to_async(Message.objects.bulk_create)([
+            Message(sender=users[i * 2], conversation=conversation, message_body='ping')
+            for i, conversation in enumerate(conversations)
+        ])
+        # Outside a transaction the on-commit insert runs straight away
+        await sync_to_async(record_messages)(ChangeEvent.MESSAGE_CREATED, messages)
+        responses = await asyncio.gather(*tasks)
+        finished = time.perf_counter() - sent
+
+        statuses = {response.status_code for response in responses}
+        latencies = sorted(at - sent for at in woken_at.values())
+        self.stdout.write(
+            f'all pollers answered in {finished:.2f} s after the messages were sent '
+            f'(statuses {sorted(statuses)})'
+        )
+        for label, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            latency = latencies[int(fraction * (len(latencies) - 1))]
+            self.stdout.write(f'  wake latency {label}: {latency * 1000:.1f} ms')
+        self.stdout.write(f'  max resident memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB')
@@ -0,0 +1,110 @@
+import json
+import time
+from contextlib import ExitStack
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework.renderers import JSONRenderer
+from chats.models import Conversation, Message, User
+from chats.serializers import MessageRowSerializer, MessageSerializer
+from chats.sharding import get_shards, messages_for_conversation, with_senders
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Compare MessageSerializer with the MessageRowSerializer fast path on a
+    page of messages: query plus serialization plus JSON rendering, best
+    of several rounds. Seeds a throwaway conversation inside transactions
+    (on every message shard too) that are rolled back afterwards, and
+    checks both paths render identical JSON.
+    """
+    help = 'Benchmark the message list serializers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=100,
+            help='Number of messages serialized per round'
+        )
+        parser.add_argument(
+            '--senders',
+            type=int,
+            default=5,
+            help='Number of distinct senders in the page'
+        )
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=20,
+            help='Number of timed rounds per serializer'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with ExitStack() as stack:
+                for alias in {DEFAULT_DB_ALIAS, *get_shards()}:
+                    stack.enter_context(transaction.atomic(using=alias))
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def run(self, options):
+        page_size = options['page_size']
+        senders = [
+            User.objects.create_user(
+                username=f'bench{i}',
+                email=f'bench{i}@example.com',
+                password='benchmark-password',
+                first_name=f'Bench{i}',
+                last_name='Sender'
+            )
+            for i in range(options['senders'])
+        ]
+        conversation = Conversation.objects.create()
+        conversation.participants.add(*senders)
+        Message.objects.bulk_create([
+            Message(
+                sender=senders[i % len(senders)],
+                conversation=conversation,
+                message_body=f'Benchmark message {i}'
+            )
+            for i in range(page_size)
+        ])
+        messages = with_senders(messages_for_conversation(conversation.pk)).order_by('sent_at', 'message_id')
+        renderer = JSONRenderer()
+
+        def full():
+            return renderer.render(MessageSerializer(list(messages.all()), many=True).data)
+
+        def fast():
+            return renderer.render(MessageRowSerializer(list(MessageRowSerializer.values(messages)), many=True).data)
+
+        def compact():
+            serializer = MessageRowSerializer(
+                list(MessageRowSerializer.values(messages)),
+                many=True,
+                context={'sender_format': 'compact'}
+            )
+            return renderer.render({'results': serializer.data, 'senders': serializer.child.senders})
+
+        if json.loads(full()) != json.loads(fast()):
+            raise CommandError('MessageRowSerializer output differs from MessageSerializer')
+
+        baseline = None
+        for name, render in (('MessageSerializer', full), ('MessageRowSerializer', fast), ('compact senders', compact)):
+            best = min(self.time(render) for _ in range(options['rounds']))
+            size = len(render())
+            baseline = baseline or best
+            self.stdout.write(
+                f'{name:<22} {best * 1000:8.2f} ms  {size:>8} bytes  {baseline / best:5.1f}x'
+            )
+
+    def time(self, render):
+        start = time.perf_counter()
+        render()
+        return time.perf_counter() - start
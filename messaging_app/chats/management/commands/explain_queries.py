@@ -0,0 +1,201 @@
+import json
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django_filters import filters as filter_types
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from chats.filters import ConversationFilter, MessageFilter, UserFilter
+from chats.models import Conversation, Message, User
+from chats.sharding import is_sharded
+from chats.views import ConversationViewSet, MessageViewSet, UserViewSet
+
+
+class Command(BaseCommand):
+    """
+    Index advisor for the chats schema.
+
+    Runs the API's representative queries (viewset querysets and every
+    filter declared in chats/filters.py) through EXPLAIN and flags full
+    table scans and filesorts / temporary sort B-trees. Supports SQLite
+    and MySQL.
+    """
+    help = 'EXPLAIN the chats API queries and flag full scans and filesorts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default='default',
+            help='Database alias to explain against'
+        )
+        parser.add_argument(
+            '--user',
+            help='Email of the user whose view of the data is explained (defaults to any user)'
+        )
+        parser.add_argument(
+            '--only-problems',
+            action='store_true',
+            help='Only print queries with findings'
+        )
+        parser.add_argument(
+            '--strict',
+            action='store_true',
+            help='Exit with an error if any query has findings'
+        )
+
+    def handle(self, *args, **options):
+        if is_sharded():
+            # Message querysets span several databases and cannot be explained as one
+            raise CommandError('explain_queries does not support MESSAGE_SHARDS; run it against an unsharded database')
+        self.using = options['database']
+        self.vendor = connections[self.using].vendor
+        if self.vendor not in ('sqlite', 'mysql'):
+            raise CommandError(f'Unsupported database vendor: {self.vendor}')
+
+        users = User.objects.using(self.using)
+        user = users.filter(email=options['user']).first() if options['user'] else users.first()
+        if user is None:
+            raise CommandError('No user found; seed some data first')
+
+        flagged = 0
+        total = 0
+        for name, queryset in self.representative_queries(user):
+            total += 1
+            findings = self.explain(queryset.using(self.using))
+            if findings:
+                flagged += 1
+            elif options['only_problems']:
+                continue
+
+            style = self.style.WARNING if findings else self.style.SUCCESS
+            self.stdout.write(style(f"{'FLAG' if findings else 'ok  '}  {name}"))
+            for finding in findings:
+                self.stdout.write(f'        {finding}')
+
+        summary = f'{flagged} of {total} queries flagged on {self.vendor}'
+        if flagged and options['strict']:
+            raise CommandError(summary)
+        self.stdout.write(summary)
+
+    def representative_queries(self, user):
+        """
+        Yield (label, queryset) pairs for the queries the API actually runs.
+        """
+        conversation = Conversation.objects.using(self.using).filter(participants=user).first()
+        samples = {
+            'user': user.pk,
+            'conversation': conversation.pk if conversation else uuid.uuid4(),
+        }
+
+        conversations = self.viewset_queryset(ConversationViewSet, user, 'list')
+        messages = self.viewset_queryset(MessageViewSet, user, 'list')
+        users = self.viewset_queryset(UserViewSet, user, 'list')
+
+        yield 'ConversationViewSet.list', conversations[:10]
+        yield 'ConversationViewSet.messages', Message.objects.filter(
+            conversation_id=samples['conversation']
+        ).select_related('sender').order_by('sent_at', 'message_id')[:20]
+        yield 'MessageViewSet.list', messages[:20]
+        yield 'MessageViewSet.list?conversation_id', messages.filter(
+            conversation_id=samples['conversation']
+        )[:20]
+        yield 'UserViewSet.list', users[:15]
+
+        for filterset_class, queryset in (
+            (MessageFilter, messages),
+            (ConversationFilter, conversations),
+            (UserFilter, User.objects.all()),
+        ):
+            for name, filter_ in filterset_class.base_filters.items():
+                for value in self.sample_values(filter_, samples):
+                    filterset = filterset_class(data={name: value}, queryset=queryset)
+                    if not filterset.is_valid():
+                        self.stderr.write(
+                            f'skipped {filterset_class.__name__}.{name}={value}: {dict(filterset.errors)}'
+                        )
+                        continue
+                    try:
+                        queryset_for_filter = filterset.qs[:20]
+                    except Exception as exc:
+                        # A broken filter should not stop the rest of the report
+                        self.stderr.write(f'error in {filterset_class.__name__}.{name}={value}: {exc!r}')
+                        continue
+                    yield f'{filterset_class.__name__}.{name}={value}', queryset_for_filter
+
+    def viewset_queryset(self, viewset_class, user, action):
+        """
+        Build a viewset's queryset exactly as it would be for a request by `user`.
+        """
+        request = Request(APIRequestFactory().get('/'))
+        request.user = user
+        view = viewset_class()
+        view.request = request
+        view.action = action
+        view.kwargs = {}
+        view.format_kwarg = None
+        return view.get_queryset()
+
+    def sample_values(self, filter_, samples):
+        """
+        Return plausible query-string values for a filter.
+        """
+        if isinstance(filter_, filter_types.OrderingFilter):
+            return [value for value, _ in filter_.field.choices if value]
+        if isinstance(filter_, (filter_types.DateTimeFilter, filter_types.IsoDateTimeFilter)):
+            return [timezone.now().isoformat()]
+        if isinstance(filter_, filter_types.DateFilter):
+            return [timezone.now().date().isoformat()]
+        if isinstance(filter_, filter_types.ModelMultipleChoiceFilter):
+            target = 'conversation' if 'conversation' in filter_.field_name else 'user'
+            return [[str(samples[target])]]
+        if isinstance(filter_, (filter_types.UUIDFilter, filter_types.ModelChoiceFilter)):
+            target = 'conversation' if 'conversation' in filter_.field_name else 'user'
+            return [str(samples[target])]
+        if isinstance(filter_, filter_types.BooleanFilter):
+            return ['true']
+        if isinstance(filter_, filter_types.NumberFilter):
+            return ['2']
+        return ['a']
+
+    def explain(self, queryset):
+        """
+        Return a list of human-readable findings for a queryset's plan.
+        """
+        if self.vendor == 'mysql':
+            plan = json.loads(queryset.explain(format='json'))
+            return self.mysql_findings(plan)
+        return self.sqlite_findings(queryset.explain())
+
+    def sqlite_findings(self, plan):
+        findings = []
+        for line in plan.splitlines():
+            detail = line.split(' ', 3)[-1] if line[:1].isdigit() else line.strip()
+            if detail.startswith('SCAN ') and ' USING ' not in detail and 'CONSTANT ROW' not in detail:
+                findings.append(f'full scan: {detail}')
+            elif 'USE TEMP B-TREE' in detail:
+                findings.append(f'filesort: {detail}')
+        return findings
+
+    def mysql_findings(self, plan):
+        findings = []
+
+        def walk(node):
+            if isinstance(node, dict):
+                table = node.get('table_name')
+                if table and node.get('access_type') == 'ALL':
+                    findings.append(f"full scan: {table} (rows={node.get('rows_examined_per_scan')})")
+                elif table and node.get('access_type') == 'index':
+                    findings.append(f"full index scan: {table} via {node.get('key')}")
+                if node.get('using_filesort'):
+                    findings.append('filesort')
+                if node.get('using_temporary_table'):
+                    findings.append('temporary table')
+                for value in node.values():
+                    walk(value)
+            elif isinstance(node, list):
+                for value in node:
+                    walk(value)
+
+        walk(plan)
+        return findings
@@ -0,0 +1,57 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from chats.models import ChangeEvent
+
+
+class Command(BaseCommand):
+    """
+    Trim the updates feed's event log. Clients whose cursor falls before
+    the oldest remaining event get 410 Gone and re-sync. The newest event
+    is always kept, so the current cursor stays readable.
+    """
+    help = 'Delete old change events from the updates feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help='Delete events older than this many days'
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            help='Instead of an age, keep only this many of the newest events'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of events deleted per statement'
+        )
+
+    def handle(self, *args, **options):
+        newest = ChangeEvent.objects.order_by('-id').values_list('id', flat=True)
+        if options['keep'] is not None:
+            keep = max(options['keep'], 1)
+            boundary = newest[keep:keep + 1].first()
+            # Delete everything up to and including the first event not kept
+            cutoff = boundary + 1 if boundary is not None else None
+        else:
+            cutoff = ChangeEvent.objects.filter(
+                created_at__gte=timezone.now() - timedelta(days=options['days'])
+            ).order_by('id').values_list('id', flat=True).first()
+            if cutoff is None:
+                cutoff = newest.first()
+
+        deleted = 0
+        while cutoff is not None:
+            batch = list(ChangeEvent.objects.filter(id__lt=cutoff).order_by('id').values_list(
+                'id', flat=True
+            )[:options['batch_size']])
+            if not batch:
+                break
+            deleted += ChangeEvent.objects.filter(id__lte=batch[-1], id__lt=cutoff).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} change events'))
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from chats.activity import participant_count_subquery
+from chats.models import Conversation
+
+
+class Command(BaseCommand):
+    """
+    Repair drifted `participant_count` columns, e.g. after participant rows
+    were written with raw SQL or a bulk delete that sends no signals.
+    Conversations are compared with their participant rows in primary-key
+    batches, and only the ones that differ are updated.
+    """
+    help = 'Recount participant_count on conversations where it has drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of conversations checked per transaction'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drifted conversations without updating them'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = repaired = 0
+        last_pk = None
+        while True:
+            conversations = Conversation.objects.order_by('pk')
+            if last_pk is not None:
+                conversations = conversations.filter(pk__gt=last_pk)
+            batch = list(conversations.annotate(
+                actual_count=participant_count_subquery()
+            ).values_list('pk', 'participant_count', 'actual_count')[:batch_size])
+            if not batch:
+                break
+
+            drifted = [
+                Conversation(pk=pk, participant_count=actual)
+                for pk, stored, actual in batch
+                if stored != actual
+            ]
+            if drifted and not options['dry_run']:
+                with transaction.atomic():
+                    Conversation.objects.bulk_update(drifted, ['participant_count'])
+
+            checked += len(batch)
+            repaired += len(drifted)
+            last_pk = batch[-1][0]
+            self.stdout.write(f'Checked {checked} conversations...')
+
+        verb = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {repaired} drifted participant counts in {checked} conversations'
+        ))
@@ -0,0 +1,169 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from chats.models import Conversation, ConversationParticipant, Message, User
+from chats.search import index_messages
+from chats.user_search import index_users
+
+LOAD_USER_PREFIX = 'load-'
+LOAD_PASSWORD = 'load-test-password'
+
+WORDS = (
+    'hello', 'thanks', 'meeting', 'tomorrow', 'lunch', 'project', 'deadline', 'report',
+    'coffee', 'weekend', 'invoice', 'release', 'review', 'call', 'photo', 'travel',
+    'budget', 'design', 'launch', 'question', 'update', 'schedule', 'ticket', 'party',
+)
+
+
+@contextmanager
+def explicit_sent_at():
+    """
+    Let bulk_create keep the `sent_at` values given, which auto_now_add
+    would otherwise replace with the current time.
+    """
+    field = Message._meta.get_field('sent_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    """
+    Seed a synthetic data set for benchmark_api: users, conversations
+    whose sizes follow a long tail (mostly pairs, a few large groups) and
+    messages spread over them with a Zipf-like skew, so a handful of
+    conversations are very busy. Everything is bulk inserted in batches;
+    activity columns and participant counts are then rebuilt with
+    backfill_conversation_activity and reconcile_participant_counts.
+    Unread counts are left at zero. Seeded users are named "load-<n>".
+    """
+    help = 'Seed synthetic users, conversations and messages for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of users')
+        parser.add_argument('--conversations', type=int, default=2000, help='Number of conversations')
+        parser.add_argument('--messages', type=int, default=1000000, help='Number of messages')
+        parser.add_argument(
+            '--max-participants',
+            type=int,
+            default=50,
+            help='Largest group conversation'
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=365,
+            help='Spread messages over this many days up to now'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Rows inserted per transaction'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable data sets')
+        parser.add_argument(
+            '--replace',
+            action='store_true',
+            help='Delete a previously seeded data set first'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 2 or options['conversations'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--users must be at least 2, --conversations and --batch-size positive')
+        existing = User.objects.filter(username__startswith=LOAD_USER_PREFIX)
+        if existing.exists():
+            if not options['replace']:
+                raise CommandError('Load data already exists; pass --replace to seed it again')
+            self.stdout.write('Deleting the previous load data...')
+            Conversation.objects.filter(participants__in=existing).distinct().delete()
+            existing.delete()
+
+        rng = random.Random(options['seed'])
+        users = self.seed_users(options)
+        conversations, members = self.seed_conversations(rng, users, options)
+        self.seed_messages(rng, conversations, members, options)
+
+        call_command('backfill_conversation_activity', batch_size=500, stdout=self.stdout)
+        call_command('reconcile_participant_counts', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} users, {len(conversations)} conversations and {options['messages']} messages"
+        ))
+
+    def seed_users(self, options):
+        # One hash shared by every user: hashing per row would dominate seeding
+        password = make_password(LOAD_PASSWORD)
+        users = [
+            User(
+                username=f'{LOAD_USER_PREFIX}{i}',
+                email=f'{LOAD_USER_PREFIX}{i}@example.com',
+                password=password,
+                first_name=WORDS[i % len(WORDS)].title(),
+                last_name=f'Load{i}'
+            )
+            for i in range(options['users'])
+        ]
+        for start in range(0, len(users), options['batch_size']):
+            batch = users[start:start + options['batch_size']]
+            with transaction.atomic():
+                User.objects.bulk_create(batch)
+                index_users(batch)
+        self.stdout.write(f'Seeded {len(users)} users...')
+        return users
+
+    def seed_conversations(self, rng, users, options):
+        """
+        Create conversations sized 2 plus a Pareto-distributed tail, and
+        return them with each one's participant IDs.
+        """
+        conversations = [Conversation() for _ in range(options['conversations'])]
+        members = {}
+        rows = []
+        for conversation in conversations:
+            size = min(1 + int(rng.paretovariate(1.5)), options['max_participants'], len(users))
+            participants = rng.sample(users, size)
+            members[conversation.pk] = [user.pk for user in participants]
+            rows.extend(
+                ConversationParticipant(conversation=conversation, user=user)
+                for user in participants
+            )
+        with transaction.atomic():
+            Conversation.objects.bulk_create(conversations, batch_size=options['batch_size'])
+            ConversationParticipant.objects.bulk_create(rows, batch_size=options['batch_size'])
+        self.stdout.write(f'Seeded {len(conversations)} conversations with {len(rows)} participants...')
+        return conversations, members
+
+    def seed_messages(self, rng, conversations, members, options):
+        """
+        Insert messages in batches, picking each one's conversation with a
+        Zipf-like weight (1 / rank) and its sender among the participants.
+        """
+        weights = [1 / rank for rank in range(1, len(conversations) + 1)]
+        now = timezone.now()
+        span = timedelta(days=options['days']).total_seconds()
+        remaining = options['messages']
+        inserted = 0
+        with explicit_sent_at():
+            while remaining > 0:
+                size = min(remaining, options['batch_size'])
+                batch = []
+                for conversation in rng.choices(conversations, weights=weights, k=size):
+                    batch.append(Message(
+                        sender_id=rng.choice(members[conversation.pk]),
+                        conversation=conversation,
+                        message_body=' '.join(rng.choices(WORDS, k=rng.randint(3, 20))),
+                        sent_at=now - timedelta(seconds=rng.random() * span)
+                    ))
+                with transaction.atomic():
+                    Message.objects.bulk_create(batch)
+                    index_messages(batch)
+                remaining -= size
+                inserted += size
+                self.stdout.write(f'Seeded {inserted} messages...')
@@ -0,0 +1,74 @@
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from .models import Conversation
+
+
+def _cache_key(user_id):
+    return f'chats:membership:{user_id}'
+
+
+def _normalize(conversation_id):
+    """
+    Return the canonical string form of a conversation ID, or None.
+    """
+    try:
+        return str(uuid.UUID(str(conversation_id)))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def get_conversation_ids(user):
+    """
+    Return the set of conversation IDs (as strings) the user participates in.
+
+    The set is read from the cache and filled from the participants table
+    on first use, so repeated permission checks cost one cache lookup
+    instead of one query each. The fill always reads the primary: a
+    lagging replica's answer would otherwise be cached for
+    MEMBERSHIP_CACHE_TIMEOUT seconds after the write committed.
+    """
+    key = _cache_key(user.pk)
+    conversation_ids = cache.get(key)
+    if conversation_ids is None:
+        conversation_ids = frozenset(
+            str(conversation_id) for conversation_id in
+            Conversation.participants.through.objects.using(DEFAULT_DB_ALIAS).filter(
+                user_id=user.pk
+            ).values_list('conversation_id', flat=True)
+        )
+        cache.set(key, conversation_ids, settings.MEMBERSHIP_CACHE_TIMEOUT)
+    return conversation_ids
+
+
+def is_participant(user, conversation):
+    """
+    Check whether the user participates in a conversation.
+
+    Args:
+        user: The user to check
+        conversation: A Conversation instance or a conversation ID
+
+    Returns:
+        bool: True if the user is a participant, False otherwise
+    """
+    if not user or not user.is_authenticated:
+        return False
+    conversation_id = _normalize(getattr(conversation, 'pk', conversation))
+    return conversation_id is not None and conversation_id in get_conversation_ids(user)
+
+
+def invalidate(user_ids):
+    """
+    Drop the cached membership sets for the given users.
+
+    The entries are dropped immediately and again once the surrounding
+    transaction commits, so a concurrent request cannot re-cache the
+    pre-commit membership.
+    """
+    keys = [_cache_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,451 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from time import perf_counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+_counters = Counter()
+_lock = threading.Lock()
+
+# This process's request metric store (see get_store) and the pid it was opened in
+_store = None
+_store_pid = None
+
+
+def increment(name, amount=1):
+    """
+    Add `amount` to a named counter. Counters are kept per process.
+    """
+    with _lock:
+        _counters[name] += amount
+
+
+def snapshot(prefix=''):
+    """
+    Return a copy of the counters whose names start with `prefix`.
+    """
+    with _lock:
+        return {name: value for name, value in _counters.items() if name.startswith(prefix)}
+
+
+def reset():
+    """
+    Zero every counter and forget the request metric store (used by tests).
+    """
+    global _store, _store_pid
+    with _lock:
+        _counters.clear()
+        _store = _store_pid = None
+
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+_header = struct.Struct('<Q')
+_length = struct.Struct('<I')
+_value = struct.Struct('<d')
+
+
+class MmapedValues:
+    """
+    Float values keyed by string in one process's memory-mapped file.
+
+    Records are appended as keys first appear: a length, the UTF-8 key
+    padded to 8 bytes, then the value. The header holds the bytes used and
+    is written after each record, so other processes reading the file only
+    ever see whole records. Only the owning process writes, so updates
+    need no locking across processes.
+    """
+    initial_size = 64 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a+b')
+        if os.fstat(self.file.fileno()).st_size < self.initial_size:
+            self.file.truncate(self.initial_size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.offsets = {}
+        used = _header.unpack_from(self.map, 0)[0]
+        if used == 0:
+            used = _header.size
+            _header.pack_into(self.map, 0, used)
+        self.used = used
+        for key, offset in iterate_records(self.map, used):
+            self.offsets[key] = offset
+
+    def add(self, key, amount):
+        offset = self.offsets.get(key)
+        if offset is None:
+            offset = self.append(key)
+        _value.pack_into(self.map, offset, _value.unpack_from(self.map, offset)[0] + amount)
+
+    def append(self, key):
+        encoded = key.encode()
+        padded = encoded + b' ' * (-(_length.size + len(encoded)) % 8)
+        size = _length.size + len(padded) + _value.size
+        capacity = len(self.map)
+        if self.used + size > capacity:
+            self.map.close()
+            self.file.truncate(max(capacity * 2, self.used + size))
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        _length.pack_into(self.map, self.used, len(padded))
+        self.map[self.used + _length.size:self.used + _length.size + len(padded)] = padded
+        offset = self.used + _length.size + len(padded)
+        _value.pack_into(self.map, offset, 0.0)
+        self.used += size
+        _header.pack_into(self.map, 0, self.used)
+        self.offsets[key] = offset
+        return offset
+
+
+def iterate_records(data, used):
+    """
+    Yield (key, value offset) for each record of an MmapedValues file.
+    """
+    position = _header.size
+    while position < used:
+        length = _length.unpack_from(data, position)[0]
+        start = position + _length.size
+        key = bytes(data[start:start + length]).decode().rstrip(' ')
+        yield key, start + length
+        position = start + length + _value.size
+
+
+class ProcessValues:
+    """
+    In-memory stand-in for MmapedValues when METRICS_DIR is not set.
+    """
+
+    def __init__(self):
+        self.values = defaultdict(float)
+
+    def add(self, key, amount):
+        self.values[key] += amount
+
+
+def get_store():
+    """
+    Return this process's value store, opening a new one after a fork so
+    every gunicorn worker writes its own file.
+    """
+    global _store, _store_pid
+    pid = os.getpid()
+    if _store_pid != pid:
+        with _lock:
+            if _store_pid != pid:
+                directory = settings.METRICS_DIR
+                _store = MmapedValues(os.path.join(directory, f'{pid}.db')) if directory else ProcessValues()
+                _store_pid = pid
+    return _store
+
+
+def collect():
+    """
+    Return every request metric value summed over all processes writing to
+    METRICS_DIR (this process only when it is not set). Files of workers
+    that have exited are still counted, keeping counters monotonic.
+    """
+    totals = defaultdict(float)
+    directory = settings.METRICS_DIR
+    if not directory:
+        store = get_store()
+        with _lock:
+            return dict(store.values)
+    for name in os.listdir(directory):
+        if not name.endswith('.db'):
+            continue
+        with open(os.path.join(directory, name), 'rb') as metrics_file:
+            data = metrics_file.read()
+        if len(data) < _header.size:
+            continue
+        used = min(_header.unpack_from(data, 0)[0], len(data))
+        for key, offset in iterate_records(data, used):
+            totals[key] += _value.unpack_from(data, offset)[0]
+    return totals
+
+
+class RequestMetrics:
+    """
+    Measurements of one request: a database execute wrapper counting
+    queries and their time, plus serializer time added by
+    TimedRepresentationMixin. `collected` is set once `collecting()` has
+    installed it, so requests whose view never did report no queries
+    rather than zero.
+    """
+    __slots__ = ('queries', 'query_seconds', 'serializer_seconds', 'serializing', 'collected')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializing = False
+        self.collected = False
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += perf_counter() - start
+
+
+_local = threading.local()
+
+
+def current_request():
+    """
+    Return the RequestMetrics of the request this thread is handling, if any.
+    """
+    return getattr(_local, 'request', None)
+
+
+@contextmanager
+def collecting(metrics):
+    """
+    Add the queries run on this thread's connections, and serializer
+    time, to `metrics` until the block exits. Does nothing when `metrics`
+    is None or already being collected on this thread.
+    """
+    previous = getattr(_local, 'request', None)
+    if metrics is None or previous is metrics:
+        yield
+        return
+    wrapped = [connections[alias] for alias in connections]
+    for connection in wrapped:
+        connection.execute_wrappers.append(metrics)
+    _local.request = metrics
+    metrics.collected = True
+    try:
+        yield
+    finally:
+        _local.request = previous
+        for connection in wrapped:
+            connection.execute_wrappers.remove(metrics)
+
+
+class RequestMetricsMixin:
+    """
+    View mixin collecting the request's metrics (see
+    RequestMetricsMiddleware) on the thread the view runs on. Under ASGI
+    a sync view runs on a worker thread with its own connections, out of
+    the middleware's reach; under WSGI the middleware already collects
+    on this thread and the mixin does nothing.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with collecting(getattr(request, '_metrics', None)):
+            return super().dispatch(request, *args, **kwargs)
+
+
+class TimedRepresentationMixin:
+    """
+    Serializer mixin adding the time spent in `to_representation` to the
+    current request's serializer time. Nested serializers run inside their
+    parent's call and are not counted twice.
+    """
+
+    def to_representation(self, instance):
+        request = getattr(_local, 'request', None)
+        if request is None or request.serializing:
+            return super().to_representation(instance)
+        request.serializing = True
+        start = perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            request.serializer_seconds += perf_counter() - start
+            request.serializing = False
+
+
+def endpoint_label(request, view_func):
+    """
+    Name a resolved view for metric labels: "<ViewSet>.<action>" for
+    viewsets (e.g. "ConversationViewSet.list"), the view's class or
+    function name otherwise (@api_view classes carry the function's name).
+    """
+    cls = getattr(view_func, 'cls', None)
+    name = cls.__name__ if cls is not None else getattr(view_func, '__name__', type(view_func).__name__)
+    action = (getattr(view_func, 'actions', None) or {}).get(request.method.lower())
+    return f'{name}.{action}' if action else name
+
+
+# Methods recorded under their own name; anything else a client sends is
+# recorded as OTHER, so it cannot add series to the fixed-size stores
+HTTP_METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE', 'CONNECT'))
+
+
+def method_label(method):
+    return method if method in HTTP_METHODS else 'OTHER'
+
+
+def metric_key(kind, *labels):
+    """
+    Return the store key of a metric: its kind and label values as a
+    JSON list, so label values may contain any character.
+    """
+    return json.dumps([kind, *labels], separators=(',', ':'))
+
+
+def record_request(endpoint, method, status, seconds, response_bytes, request=None):
+    """
+    Add one request's measurements to the shared store.
+    """
+    labels = (endpoint, method_label(method))
+    bucket = next(index for index, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound)
+    store = get_store()
+    with _lock:
+        store.add(metric_key('requests', *labels, str(status)), 1)
+        store.add(metric_key('latency_bucket', *labels, bucket), 1)
+        store.add(metric_key('latency_sum', *labels), seconds)
+        if response_bytes is not None:
+            store.add(metric_key('response_bytes', *labels), response_bytes)
+        if request is not None:
+            store.add(metric_key('queries', *labels), request.queries)
+            store.add(metric_key('query_seconds', *labels), request.query_seconds)
+            store.add(metric_key('serializer_seconds', *labels), request.serializer_seconds)
+
+
+def record_response_bytes(endpoint, method, response_bytes):
+    """
+    Add the size of a streamed body, known only once it has been sent.
+    """
+    store = get_store()
+    with _lock:
+        store.add(metric_key('response_bytes', endpoint, method_label(method)), response_bytes)
+
+
+def counting_stream(content, endpoint, method):
+    """
+    Pass a streaming body through, recording its size once it is sent.
+    """
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        record_response_bytes(endpoint, method, size)
+
+
+class RequestMetricsMiddleware:
+    """
+    Record per-endpoint latency, database queries and query time,
+    serializer time and response bytes for every request, in the store
+    shared by workers through METRICS_DIR.
+
+    The work added to a request is an execute wrapper per database alias
+    and a few in-place float updates. Queries and encoding done while a
+    streaming body is sent happen after the response leaves, so only its
+    bytes are counted then.
+
+    Under ASGI the middleware runs on the event loop while sync views run
+    on a worker thread, so queries and serializer time are collected by
+    RequestMetricsMixin on the API viewsets instead. Other views served
+    over ASGI, including the async long-poll feed, record latency,
+    status and bytes only.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_endpoint = endpoint_label(request, view_func)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics = request._metrics = RequestMetrics()
+        start = perf_counter()
+        with collecting(metrics):
+            response = self.get_response(request)
+        self.record(request, response, perf_counter() - start, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics = request._metrics = RequestMetrics()
+        start = perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, perf_counter() - start, metrics)
+        return response
+
+    def record(self, request, response, seconds, metrics):
+        endpoint = getattr(request, '_metrics_endpoint', 'unmatched')
+        if response.streaming:
+            response_bytes = None
+            if not response.is_async:
+                response.streaming_content = counting_stream(
+                    response.streaming_content, endpoint, request.method
+                )
+        else:
+            response_bytes = len(response.content)
+        if not metrics.collected:
+            metrics = None
+        record_request(endpoint, request.method, response.status_code, seconds, response_bytes, metrics)
+
+
+def render_prometheus(values):
+    """
+    Render collected values in the Prometheus text exposition format.
+    """
+    def labels(endpoint, method, **extra):
+        pairs = {'endpoint': endpoint, 'method': method, **extra}
+        return '{' + ','.join(f'{name}={json.dumps(value)}' for name, value in pairs.items()) + '}'
+
+    sums = {
+        'response_bytes': ('http_response_bytes_total', 'Response body bytes sent.'),
+        'queries': ('http_request_db_queries_total', 'Database queries run while handling requests.'),
+        'query_seconds': ('http_request_db_query_seconds_total', 'Time spent in database queries.'),
+        'serializer_seconds': ('http_request_serializer_seconds_total', 'Time spent serializing responses.'),
+    }
+    requests = defaultdict(float)
+    buckets = defaultdict(lambda: [0.0] * len(LATENCY_BUCKETS))
+    latency_sums = defaultdict(float)
+    totals = {kind: defaultdict(float) for kind in sums}
+    for key, value in values.items():
+        kind, *parts = json.loads(key)
+        if kind == 'requests':
+            requests[tuple(parts)] += value
+        elif kind == 'latency_bucket':
+            buckets[tuple(parts[:2])][int(parts[2])] += value
+        elif kind == 'latency_sum':
+            latency_sums[tuple(parts)] += value
+        elif kind in totals:
+            totals[kind][tuple(parts)] += value
+
+    lines = [
+        '# HELP http_requests_total Requests handled, by endpoint, method and status.',
+        '# TYPE http_requests_total counter',
+    ]
+    for (endpoint, method, status), value in sorted(requests.items()):
+        lines.append(f'http_requests_total{labels(endpoint, method, status=status)} {value:g}')
+
+    lines += [
+        '# HELP http_request_duration_seconds Request latency, by endpoint and method.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for (endpoint, method), counts in sorted(buckets.items()):
+        cumulative = 0.0
+        for bound, count in zip(LATENCY_BUCKETS, counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else f'{bound:g}'
+            lines.append(f'http_request_duration_seconds_bucket{labels(endpoint, method, le=le)} {cumulative:g}')
+        latency_sum = latency_sums[(endpoint, method)]
+        lines.append(f'http_request_duration_seconds_sum{labels(endpoint, method)} {latency_sum!r}')
+        lines.append(f'http_request_duration_seconds_count{labels(endpoint, method)} {cumulative:g}')
+
+    for kind, (name, description) in sums.items():
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+        for (endpoint, method), value in sorted(totals[kind].items()):
+            lines.append(f'{name}{labels(endpoint, method)} {value!r}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Create the vendor's full-text index over message bodies: an FTS5
+    virtual table on SQLite (filled from existing rows) or a FULLTEXT
+    index on MySQL. Other databases fall back to icontains searches.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+                return
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS chats_message_fts '
+            'USING fts5(message_id UNINDEXED, message_body)'
+        )
+        schema_editor.execute(
+            'INSERT INTO chats_message_fts (message_id, message_body) '
+            'SELECT message_id, message_body FROM chats_message'
+        )
+    elif vendor == 'mysql':
+        schema_editor.execute(
+            'ALTER TABLE chats_message ADD FULLTEXT INDEX chats_msg_body_ft (message_body)'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS chats_message_fts')
+    elif vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE chats_message DROP INDEX chats_msg_body_ft')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
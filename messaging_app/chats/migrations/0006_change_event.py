@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-18 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('message.created', 'Message created'), ('message.updated', 'Message updated'), ('message.deleted', 'Message deleted'), ('participant.added', 'Participant added'), ('participant.removed', 'Participant removed'), ('conversation.deleted', 'Conversation deleted')], max_length=32)),
+                ('conversation_id', models.UUIDField(help_text='Conversation the change belongs to')),
+                ('object_id', models.UUIDField(blank=True, help_text='Message affected, if any', null=True)),
+                ('user_id', models.UUIDField(blank=True, help_text='User added or removed; such events also reach that user directly', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'chats_change_event',
+                'indexes': [models.Index(fields=['conversation_id', 'id'], name='chats_event_conv_idx'), models.Index(fields=['user_id', 'id'], name='chats_event_user_idx')],
+            },
+        ),
+    ]
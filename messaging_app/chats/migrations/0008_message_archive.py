@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:16
+
+import chats.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0007_message_shardable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('message_id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('message_body', chats.models.CompressedTextField()),
+                ('sent_at', models.DateTimeField()),
+                ('conversation', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='chats.conversation')),
+                ('sender', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'chats_message_archive',
+                'ordering': ['sent_at'],
+                'indexes': [models.Index(fields=['conversation', 'sent_at', 'message_id'], name='chats_archive_conv_sent_idx')],
+            },
+        ),
+    ]
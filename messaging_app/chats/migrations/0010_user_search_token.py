@@ -0,0 +1,50 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def index_existing_users(apps, schema_editor):
+    """
+    Build search tokens for the users that already exist, in batches.
+    """
+    from chats.user_search import user_tokens
+
+    User = apps.get_model('chats', 'User')
+    UserSearchToken = apps.get_model('chats', 'UserSearchToken')
+    users = User.objects.only('user_id', 'first_name', 'last_name', 'username', 'email')
+    batch = []
+    for user in users.iterator(chunk_size=1000):
+        batch.extend(
+            UserSearchToken(user_id=user.pk, token=token, field=field)
+            for token, field in sorted(user_tokens(user))
+        )
+        if len(batch) >= 1000:
+            UserSearchToken.objects.bulk_create(batch)
+            batch = []
+    UserSearchToken.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0009_participant_read_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchToken',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=64)),
+                ('field', models.CharField(choices=[('name', 'Name'), ('username', 'Username'), ('email', 'Email')], max_length=8)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'chats_user_search_token',
+                'indexes': [models.Index(fields=['token', 'user'], name='chats_user_token_idx')],
+            },
+        ),
+        migrations.RunPython(index_existing_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:23
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_participants(apps, schema_editor):
+    """
+    Fill participant_count for existing conversations in one UPDATE.
+    """
+    Conversation = apps.get_model('chats', 'Conversation')
+    ConversationParticipant = apps.get_model('chats', 'ConversationParticipant')
+    total = ConversationParticipant.objects.filter(
+        conversation_id=OuterRef('pk')
+    ).order_by().values('conversation_id').annotate(total=Count('*')).values('total')
+    Conversation.objects.update(participant_count=Coalesce(Subquery(total), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0010_user_search_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='participant_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['participant_count'], name='chats_conv_participants_idx'),
+        ),
+        migrations.RunPython(count_participants, migrations.RunPython.noop),
+    ]
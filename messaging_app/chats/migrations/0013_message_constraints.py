@@ -0,0 +1,37 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Message foreign keys get database constraints unless messages are
+    # sharded; see MESSAGE_DB_CONSTRAINTS in settings.
+
+    dependencies = [
+        ('chats', '0012_conversation_revision'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedmessage',
+            name='conversation',
+            field=models.ForeignKey(db_constraint=settings.MESSAGE_DB_CONSTRAINTS, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_messages', to='chats.conversation'),
+        ),
+        migrations.AlterField(
+            model_name='archivedmessage',
+            name='sender',
+            field=models.ForeignKey(db_constraint=settings.MESSAGE_DB_CONSTRAINTS, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='conversation',
+            field=models.ForeignKey(db_constraint=settings.MESSAGE_DB_CONSTRAINTS, help_text='Conversation this message belongs to', on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chats.conversation'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='sender',
+            field=models.ForeignKey(db_constraint=settings.MESSAGE_DB_CONSTRAINTS, help_text='User who sent this message', on_delete=django.db.models.deletion.CASCADE, related_name='sent_messages', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+def create_rowid_table(apps, schema_editor):
+    """
+    Record the FTS5 rowid of each indexed message, so the search backend
+    can update and delete rows without scanning the UNINDEXED message_id
+    column. Only databases that got the FTS5 table in 0005 need it.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or 'chats_message_fts' not in connection.introspection.table_names():
+        return
+    schema_editor.execute(
+        'CREATE TABLE IF NOT EXISTS chats_message_fts_rowid ('
+        'fts_rowid integer NOT NULL PRIMARY KEY, '
+        'message_id char(32) NOT NULL UNIQUE)'
+    )
+    schema_editor.execute(
+        'INSERT INTO chats_message_fts_rowid (fts_rowid, message_id) '
+        'SELECT rowid, message_id FROM chats_message_fts'
+    )
+
+
+def drop_rowid_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS chats_message_fts_rowid')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0013_message_constraints'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_rowid_table, drop_rowid_table),
+    ]
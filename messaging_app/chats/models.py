@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth import get_user_model
 import uuid
+import zlib
+from .sharding import is_sharded, shard_for
 
 
 class User(AbstractUser):
@@ -28,6 +32,37 @@ class User(AbstractUser):
         return f"{self.first_name} {self.last_name} ({self.email})"
 
 
+class UserSearchToken(models.Model):
+    """
+    One normalized word of a user's name, username or email, maintained by
+    chats.user_search. Prefix searches become range scans of the
+    (token, user) index instead of leading-wildcard scans of chats_user.
+    """
+    NAME = 'name'
+    USERNAME = 'username'
+    EMAIL = 'email'
+    FIELD_CHOICES = [
+        (NAME, 'Name'),
+        (USERNAME, 'Username'),
+        (EMAIL, 'Email'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=64)
+    field = models.CharField(max_length=8, choices=FIELD_CHOICES)
+
+    class Meta:
+        db_table = 'chats_user_search_token'
+        indexes = [
+            # Prefix lookups scan this index in token order and stop at the limit
+            models.Index(fields=['token', 'user'], name='chats_user_token_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.token} -> {self.user_id}"
+
+
 class Conversation(models.Model):
     """
     Model to track conversations between users.
@@ -36,25 +71,110 @@ class Conversation(models.Model):
     conversation_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     participants = models.ManyToManyField(
         'User',
+        through='ConversationParticipant',
         related_name='conversations',
         help_text="Users participating in this conversation"
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Denormalized activity, maintained by chats.activity on message
+    # insert/update/delete so the inbox never has to scan messages
+    last_message_id = models.UUIDField(null=True, blank=True, editable=False)
+    last_message_at = models.DateTimeField(null=True, blank=True, editable=False)
+    last_message_preview = models.CharField(max_length=255, blank=True, default='', editable=False)
+    last_message_sender = models.ForeignKey(
+        'User',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='+',
+        help_text="Sender of the most recent message"
+    )
+    message_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # Bumped by changes that must reach conditional GETs without moving the
+    # conversation up the inbox: message edits, participants' profile
+    # changes (see chats.activity) and archiving (see chats.archive)
+    revision = models.PositiveIntegerField(default=0, editable=False)
+
+    # Denormalized membership size, recounted by chats.activity whenever the
+    # participants change so size filters and lists never aggregate the join
+    participant_count = models.PositiveIntegerField(default=0, editable=False)
+
     class Meta:
         db_table = 'chats_conversation'
         ordering = ['-updated_at']
+        indexes = [
+            # Inbox ordering and keyset pagination on (updated_at, conversation_id)
+            models.Index(fields=['updated_at', 'conversation_id'], name='chats_conv_updated_idx'),
+            # min_participants/max_participants range filters
+            models.Index(fields=['participant_count'], name='chats_conv_participants_idx'),
+        ]
 
     def __str__(self):
         participant_names = ", ".join([str(user) for user in self.participants.all()[:3]])
-        if self.participants.count() > 3:
-            participant_names += f" and {self.participants.count() - 3} others"
+        if self.participant_count > 3:
+            participant_names += f" and {self.participant_count - 3} others"
         return f"Conversation: {participant_names}"
 
     def get_participant_count(self):
         """Return the number of participants in the conversation."""
-        return self.participants.count()
+        return self.participant_count
+
+
+class ConversationParticipant(models.Model):
+    """
+    Membership row linking a user to a conversation.
+    Declared explicitly (on the table Django created for the many-to-many)
+    so the membership lookups can have their own composite index.
+    """
+    conversation = models.ForeignKey('Conversation', on_delete=models.CASCADE)
+    user = models.ForeignKey('User', on_delete=models.CASCADE)
+
+    # Read cursor: everything sent up to `last_read_at` counts as read, and
+    # `unread_count` is kept current by chats.activity so badges never
+    # count messages. Joining a conversation marks its history read.
+    last_read_message_id = models.UUIDField(null=True, blank=True, editable=False)
+    last_read_at = models.DateTimeField(default=timezone.now, editable=False)
+    unread_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        db_table = 'chats_conversation_participants'
+        unique_together = [('conversation', 'user')]
+        indexes = [
+            # "Which conversations is this user in?" answered from the index alone
+            models.Index(fields=['user', 'conversation'], name='chats_part_user_conv_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.conversation_id}"
+
+
+class MessageQuerySet(models.QuerySet):
+    """
+    Sends new messages to their conversation's shard when MESSAGE_SHARDS
+    is set; a queryset already bound with `using()` is left alone.
+    """
+
+    def create(self, **kwargs):
+        if self._db is not None or not is_sharded():
+            return super().create(**kwargs)
+        message = self.model(**kwargs)
+        message.save(force_insert=True, using=shard_for(message.conversation_id))
+        return message
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None or not is_sharded():
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        shards = {}
+        for message in objs:
+            shards.setdefault(shard_for(message.conversation_id), []).append(message)
+        for alias, messages in shards.items():
+            super(MessageQuerySet, self.using(alias)).bulk_create(messages, *args, **kwargs)
+        return objs
 
 
 class Message(models.Model):
@@ -67,24 +187,139 @@ class Message(models.Model):
         'User',
         on_delete=models.CASCADE,
         related_name='sent_messages',
+        # Off when messages may live on another database (see chats.sharding)
+        db_constraint=settings.MESSAGE_DB_CONSTRAINTS,
         help_text="User who sent this message"
     )
     conversation = models.ForeignKey(
         'Conversation',
         on_delete=models.CASCADE,
         related_name='messages',
+        db_constraint=settings.MESSAGE_DB_CONSTRAINTS,
         help_text="Conversation this message belongs to"
     )
     message_body = models.TextField(help_text="Content of the message")
     sent_at = models.DateTimeField(auto_now_add=True)
 
+    objects = MessageQuerySet.as_manager()
+
     class Meta:
         db_table = 'chats_message'
         ordering = ['sent_at']
+        indexes = [
+            # Per-conversation listing, the messages action and keyset pages
+            models.Index(fields=['conversation', 'sent_at', 'message_id'], name='chats_msg_conv_sent_idx'),
+            # Inbox-wide recency ordering
+            models.Index(fields=['sent_at', 'message_id'], name='chats_msg_sent_idx'),
+            # MessageFilter.sender_id combined with time ordering
+            models.Index(fields=['sender', 'sent_at'], name='chats_msg_sender_sent_idx'),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender.first_name} at {self.sent_at.strftime('%Y-%m-%d %H:%M')}"
 
     def get_sender_name(self):
         """Return the full name of the message sender."""
-        return f"{self.sender.first_name} {self.sender.last_name}"
\ No newline at end of file
+        return f"{self.sender.first_name} {self.sender.last_name}"
+
+
+class CompressedTextField(models.BinaryField):
+    """
+    Text stored zlib-compressed in a binary column. Reads, including
+    `values()`, return the text.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return zlib.decompress(value).decode('utf-8')
+
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+        return zlib.compress(value.encode('utf-8'))
+
+    def to_python(self, value):
+        return value
+
+
+class ArchivedMessage(models.Model):
+    """
+    A message moved out of chats_message by `manage.py archive_messages`.
+    Same columns as Message, with the body compressed and only the indexes
+    needed to read a conversation's history in order and to cascade user
+    deletions. Archived messages are
+    read-only and only reachable through the conversation message list
+    (see chats.archive).
+    """
+    message_id = models.UUIDField(primary_key=True, editable=False)
+    sender = models.ForeignKey(
+        'User',
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_constraint=settings.MESSAGE_DB_CONSTRAINTS
+    )
+    conversation = models.ForeignKey(
+        'Conversation',
+        on_delete=models.CASCADE,
+        related_name='archived_messages',
+        db_constraint=settings.MESSAGE_DB_CONSTRAINTS,
+        db_index=False
+    )
+    message_body = CompressedTextField()
+    sent_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'chats_message_archive'
+        ordering = ['sent_at']
+        indexes = [
+            models.Index(fields=['conversation', 'sent_at', 'message_id'], name='chats_archive_conv_sent_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived message {self.message_id} in {self.conversation_id}"
+
+
+class ChangeEvent(models.Model):
+    """
+    Append-only log of changes behind the long-poll updates feed.
+    The auto-increment `id` is the feed cursor. Conversations and messages
+    are referenced by ID only, so events outlive the rows they describe.
+    """
+    MESSAGE_CREATED = 'message.created'
+    MESSAGE_UPDATED = 'message.updated'
+    MESSAGE_DELETED = 'message.deleted'
+    PARTICIPANT_ADDED = 'participant.added'
+    PARTICIPANT_REMOVED = 'participant.removed'
+    CONVERSATION_DELETED = 'conversation.deleted'
+    KIND_CHOICES = [
+        (MESSAGE_CREATED, 'Message created'),
+        (MESSAGE_UPDATED, 'Message updated'),
+        (MESSAGE_DELETED, 'Message deleted'),
+        (PARTICIPANT_ADDED, 'Participant added'),
+        (PARTICIPANT_REMOVED, 'Participant removed'),
+        (CONVERSATION_DELETED, 'Conversation deleted'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    conversation_id = models.UUIDField(help_text="Conversation the change belongs to")
+    object_id = models.UUIDField(null=True, blank=True, help_text="Message affected, if any")
+    user_id = models.UUIDField(
+        null=True,
+        blank=True,
+        help_text="User added or removed; such events also reach that user directly"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'chats_change_event'
+        indexes = [
+            # Feed reads: events after a cursor in the user's conversations...
+            models.Index(fields=['conversation_id', 'id'], name='chats_event_conv_idx'),
+            # ...or addressed to the user directly
+            models.Index(fields=['user_id', 'id'], name='chats_event_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} in {self.conversation_id}"
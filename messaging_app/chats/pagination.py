@@ -1,42 +1,198 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 from collections import OrderedDict
 
 
-class MessagePagination(PageNumberPagination):
+def keyset_filter(ordering, values):
     """
-    Custom pagination class for messages.
-    Fetches 20 messages per page as required.
-    Inherits from PageNumberPagination to satisfy checker requirements.
+    Return a Q object matching rows that sort strictly after `values`
+    under `ordering`.
+
+    The row-value comparison `(a, b, c) > (x, y, z)` is expanded to
+    `a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)`,
+    honouring the direction of each ordering field.
     """
-    page_size = 20
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over a fixed, unique ordering.
+
+    Each page is fetched with a `WHERE (a, b) < (x, y) ORDER BY a, b LIMIT n`
+    style query, so deep pages cost the same as the first one and no
+    `COUNT(*)` is ever issued. Cursors are opaque base64 tokens.
+    """
+    cursor_query_param = 'cursor'
     page_size_query_param = 'page_size'
+    page_size = 20
     max_page_size = 100
-    
+    invalid_cursor_message = 'Invalid cursor'
+
+    # Ordering as a tuple of field names, e.g. ('-sent_at', '-message_id').
+    # The last field must be unique so that every row has a distinct key.
+    ordering = None
+
+    def __init__(self, ordering=None, page_size=None, max_page_size=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+        if page_size is not None:
+            self.page_size = page_size
+        if max_page_size is not None:
+            self.max_page_size = max_page_size
+
+    def get_page_size(self, request):
+        """
+        Return the requested page size, clamped to `max_page_size`.
+        """
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        assert self.ordering, 'KeysetPagination requires an `ordering`.'
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor['r'])
+        ordering = self._reversed_ordering() if reverse else self.ordering
+
+        queryset = queryset.order_by(*ordering)
+        if cursor:
+            queryset = queryset.filter(self._keyset_filter(queryset.model, ordering, cursor['k']))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        # Moving backwards we always came from a page further on, and
+        # moving forwards from a cursor means there is a page before us.
+        if reverse:
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+
+        self.page = results
+        return results
+
     def get_paginated_response(self, data):
         """
-        Return a paginated style `Response` object for the given output data.
+        Return a paginated style `Response` object without a total count.
         """
         return Response(OrderedDict([
-            ('count', self.page.paginator.count),
             ('next', self.get_next_link()),
             ('previous', self.get_previous_link()),
-            ('total_pages', self.page.paginator.num_pages),
-            ('current_page', self.page.number),
             ('page_size', self.page_size),
             ('results', data)
         ]))
 
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'page_size': {'type': 'integer'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self._link(self.page[0], reverse=True)
+
+    def encode_cursor(self, key, reverse):
+        """
+        Encode an ordering key and direction into an opaque token.
+        """
+        payload = json.dumps({'k': key, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request):
+        """
+        Decode the cursor query parameter, or return None if absent.
+        """
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            cursor = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            key = cursor['k']
+            if not isinstance(key, list) or len(key) != len(self.ordering):
+                raise ValueError
+            return {'k': key, 'r': bool(cursor.get('r'))}
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _link(self, row, reverse):
+        key = [self._key_value(row, field.lstrip('-')) for field in self.ordering]
+        token = self.encode_cursor(key, reverse)
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def _key_value(self, row, name):
+        value = row[name] if isinstance(row, dict) else getattr(row, name)
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return str(value)
+
+    def _reversed_ordering(self):
+        return tuple(
+            field[1:] if field.startswith('-') else '-' + field
+            for field in self.ordering
+        )
 
-class ConversationPagination(PageNumberPagination):
+    def _keyset_filter(self, model, ordering, key):
+        """
+        Convert a decoded cursor key to field values and build the filter.
+        """
+        values = []
+        for field, raw in zip(ordering, key):
+            model_field = model._meta.get_field(field.lstrip('-'))
+            try:
+                values.append(model_field.to_python(raw))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        return keyset_filter(ordering, values)
+
+
+class DetailedPageNumberPagination(PageNumberPagination):
     """
-    Custom pagination class for conversations.
-    Inherits from PageNumberPagination.
+    Page-number pagination whose responses also carry the total page
+    count, the current page number and the page size.
     """
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 50
-    
+
     def get_paginated_response(self, data):
         """
         Return a paginated style `Response` object for the given output data.
@@ -52,6 +208,65 @@ class ConversationPagination(PageNumberPagination):
         ]))
 
 
+class CursorOptInMixin:
+    """
+    Lets clients opt into keyset pagination per request with
+    `?pagination=cursor` (or by sending a `cursor`), while page-number
+    responses stay the default.
+    """
+    pagination_mode_query_param = 'pagination'
+    cursor_ordering = None
+
+    def wants_cursor(self, request):
+        params = request.query_params
+        return (
+            params.get(self.pagination_mode_query_param) == 'cursor'
+            or KeysetPagination.cursor_query_param in params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.cursor_ordering and self.wants_cursor(request):
+            self.keyset = KeysetPagination(
+                ordering=self.cursor_ordering,
+                page_size=self.page_size,
+                max_page_size=self.max_page_size,
+            )
+            self.keyset.page_size_query_param = self.page_size_query_param
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if getattr(self, 'keyset', None) is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class MessagePagination(CursorOptInMixin, DetailedPageNumberPagination):
+    """
+    Custom pagination class for messages.
+    Fetches 20 messages per page as required.
+    Inherits from PageNumberPagination to satisfy checker requirements.
+    Supports keyset pagination on (sent_at, message_id) via `?pagination=cursor`.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_ordering = ('-sent_at', '-message_id')
+
+
+class ConversationPagination(CursorOptInMixin, DetailedPageNumberPagination):
+    """
+    Custom pagination class for conversations.
+    Inherits from PageNumberPagination.
+    Supports keyset pagination on (updated_at, conversation_id) via `?pagination=cursor`.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    cursor_ordering = ('-updated_at', '-conversation_id')
+
+
 class UserPagination(PageNumberPagination):
     """
     Custom pagination class for users.
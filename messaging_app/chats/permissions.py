@@ -1,5 +1,6 @@
 from rest_framework import permissions
 from .models import Conversation, Message
+from .membership import is_participant
 
 
 class IsParticipantOfConversation(permissions.BasePermission):
@@ -23,11 +24,11 @@ class IsParticipantOfConversation(permissions.BasePermission):
         """
         if isinstance(obj, Conversation):
             # For conversation objects, check if user is a participant
-            return obj.participants.filter(user_id=request.user.user_id).exists()
+            return is_participant(request.user, obj.pk)
         
         elif isinstance(obj, Message):
             # For message objects, check if user is a participant in the conversation
-            return obj.conversation.participants.filter(user_id=request.user.user_id).exists()
+            return is_participant(request.user, obj.conversation_id)
         
         return False
 
@@ -76,15 +77,16 @@ class IsMessageSender(permissions.BasePermission):
         """
         if isinstance(obj, Message):
             # User must be the sender AND a participant in the conversation
-            is_sender = obj.sender == request.user
-            is_participant = obj.conversation.participants.filter(user_id=request.user.user_id).exists()
+            is_sender = obj.sender_id == request.user.pk
+            participant = is_participant(request.user, obj.conversation_id)
             
-            # For safe methods (GET, HEAD, OPTIONS), just check participation
-            if request.method in permissions.SAFE_METHODS:
-                return is_participant
+            # For safe methods (GET, HEAD, OPTIONS), just check participation;
+            # marking as read only moves the caller's own read cursor
+            if request.method in permissions.SAFE_METHODS or getattr(view, 'action', None) == 'mark_as_read':
+                return participant
             
             # For write methods, user must be both sender and participant
-            return is_sender and is_participant
+            return is_sender and participant
         
         return False
 
@@ -107,7 +109,7 @@ class CanAccessOwnData(permissions.BasePermission):
             return obj.sender == request.user
         
         if hasattr(obj, 'participants'):
-            return obj.participants.filter(user_id=request.user.user_id).exists()
+            return is_participant(request.user, obj.pk)
         
         return False
 
@@ -127,30 +129,30 @@ class ConversationParticipantPermission(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if isinstance(obj, Conversation):
             # User must be a participant in the conversation
-            is_participant = obj.participants.filter(user_id=request.user.user_id).exists()
+            participant = is_participant(request.user, obj.pk)
             
             # For safe methods (GET, HEAD, OPTIONS), just check participation
             if request.method in permissions.SAFE_METHODS:
-                return is_participant
+                return participant
             
             # For write methods, also check participation
             # (additional business logic can be added here)
-            return is_participant
+            return participant
             
         elif isinstance(obj, Message):
             # User must be a participant in the conversation
-            is_participant = obj.conversation.participants.filter(user_id=request.user.user_id).exists()
+            participant = is_participant(request.user, obj.conversation_id)
             
             # For safe methods, just check participation
             if request.method in permissions.SAFE_METHODS:
-                return is_participant
+                return participant
             
             # For write methods (PUT, PATCH, DELETE), user must be the sender
             if request.method in ['PUT', 'PATCH', 'DELETE']:
-                return obj.sender == request.user and is_participant
+                return obj.sender_id == request.user.pk and participant
             
             # For POST (creating messages), just check participation
-            return is_participant
+            return participant
             
         return False
 
@@ -169,9 +171,7 @@ class MessageOwnerPermission(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if isinstance(obj, Message):
             # Check if user is participant in the conversation
-            is_participant = obj.conversation.participants.filter(user_id=request.user.user_id).exists()
-            
-            if not is_participant:
+            if not is_participant(request.user, obj.conversation_id):
                 return False
             
             # For safe methods, participation is enough
@@ -179,7 +179,7 @@ class MessageOwnerPermission(permissions.BasePermission):
                 return True
             
             # For write methods, user must be the sender
-            return obj.sender == request.user
+            return obj.sender_id == request.user.pk
             
         return False
 
@@ -216,7 +216,7 @@ def can_access_conversation(user, conversation):
     Returns:
         bool: True if user can access, False otherwise
     """
-    return conversation.participants.filter(user_id=user.user_id).exists()
+    return is_participant(user, conversation)
 
 
 # Utility function to check if user can modify message
@@ -232,7 +232,7 @@ def can_modify_message(user, message):
         bool: True if user can modify, False otherwise
     """
     # User must be the sender and a participant in the conversation
-    is_sender = message.sender == user
-    is_participant = message.conversation.participants.filter(user_id=user.user_id).exists()
+    is_sender = message.sender_id == user.pk
+    participant = is_participant(user, message.conversation_id)
     
-    return is_sender and is_participant
\ No newline at end of file
+    return is_sender and participant
\ No newline at end of file
@@ -0,0 +1,258 @@
+import hashlib
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken, UntypedToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from . import metrics
+
+GENERATION_KEY = 'chats:revoked-tokens:generation'
+
+# Blacklist rows are read by ID, but IDs are assigned before commit, so a
+# row can appear after a higher one was read. IDs below the highest one
+# seen that were missing are kept pending and looked up again by every
+# sync; at most this many of the newest are kept.
+PENDING_IDS = 1000
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings. `in` may report false positives
+    (at about `error_rate` once `capacity` keys are added) but never false
+    negatives.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        positions = self.positions(key)
+        if all(self.bits[p >> 3] & (1 << (p & 7)) for p in positions):
+            return
+        for p in positions:
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(key))
+
+
+def current_generation():
+    """
+    Return the revocation generation shared through the cache, starting
+    one if the key is missing.
+    """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Start from the clock, so a restarted counter never repeats a
+        # generation some process already saw
+        cache.add(GENERATION_KEY, time.time_ns(), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def latest_revocation_id():
+    """
+    Return the highest blacklist row ID, or 0. An index-only read of the
+    primary key.
+    """
+    return BlacklistedToken.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+
+def bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), None)
+
+
+class RevokedTokenIndex:
+    """
+    In-process index of blacklisted refresh-token JTIs.
+
+    A Bloom filter answers "definitely not revoked" without a query; only
+    JTIs it reports as possibly revoked are checked against the blacklist
+    table. The filter is loaded on first use and kept current
+    incrementally: every revocation bumps a generation counter in the
+    cache, and a process that sees a new generation reads just the
+    blacklist rows above the highest ID it has (plus the pending IDs, see
+    PENDING_IDS). Revocations made by this process are added and advance
+    that ID directly. The cache may be per process (LocMemCache), so the
+    same read also runs every REVOKED_TOKENS_CHECK_INTERVAL seconds
+    whatever the generation; other lookups make no query unless the
+    filter reports a possible hit. Bloom filters cannot forget, so every
+    REVOKED_TOKENS_COMPACT_INTERVAL seconds (or once the filter outgrows
+    its capacity) it is rebuilt from the tokens that have not expired yet.
+    Expired rows themselves are removed by simplejwt's
+    `flushexpiredtokens` command.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.generation = None
+        self.max_id = 0
+        self.pending = set()
+        self.checked_at = None
+        self.compacted_at = None
+
+    def is_revoked(self, jti):
+        if jti is None or jti not in self.current():
+            metrics.increment('auth.revoked_tokens.skipped')
+            return False
+        metrics.increment('auth.revoked_tokens.checked')
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+    def add(self, jti, row_id=None):
+        """
+        Record a revocation made by this process straight away. Its
+        blacklist row ID is taken as read, so the sync its generation bump
+        triggers does not fetch it again.
+        """
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+                if row_id is not None:
+                    self.advance([row_id])
+
+    def current(self):
+        generation = current_generation()
+        with self.lock:
+            now = time.monotonic()
+            if (
+                self.bloom is None
+                or now - self.compacted_at > settings.REVOKED_TOKENS_COMPACT_INTERVAL
+                or self.bloom.count > self.bloom.capacity
+            ):
+                self.rebuild(generation)
+            elif generation != self.generation or now - self.checked_at >= settings.REVOKED_TOKENS_CHECK_INTERVAL:
+                self.sync(generation)
+            return self.bloom
+
+    def advance(self, row_ids):
+        """
+        Note blacklist rows as read: they stop being pending, and IDs
+        skipped below the new highest ID become pending.
+        """
+        row_ids = set(row_ids)
+        latest = max(row_ids, default=0)
+        if latest > self.max_id:
+            self.pending.update(range(max(self.max_id, latest - PENDING_IDS) + 1, latest))
+            self.max_id = latest
+        self.pending -= row_ids
+        if len(self.pending) > PENDING_IDS:
+            self.pending = set(sorted(self.pending)[-PENDING_IDS:])
+
+    def rebuild(self, generation):
+        # Unexpired tokens, plus the IDs of every row near the top so that
+        # the IDs missing there are known
+        now = timezone.now()
+        floor = max(latest_revocation_id() - PENDING_IDS, 0)
+        rows = list(BlacklistedToken.objects.filter(
+            Q(token__expires_at__gt=now) | Q(id__gt=floor)
+        ).values_list('id', 'token__jti', 'token__expires_at').iterator())
+        jtis = [jti for _row_id, jti, expires_at in rows if expires_at > now]
+        self.bloom = BloomFilter(max(len(jtis) * 2, settings.REVOKED_TOKENS_CAPACITY))
+        for jti in jtis:
+            self.bloom.add(jti)
+        self.max_id = floor
+        self.pending = set()
+        self.advance(row[0] for row in rows if row[0] > floor)
+        # Revocations committed after `generation` was read bump it again,
+        # so the next lookup syncs them
+        self.generation = generation
+        self.compacted_at = self.checked_at = time.monotonic()
+
+    def sync(self, generation):
+        new_rows = Q(id__gt=self.max_id)
+        if self.pending:
+            new_rows |= Q(id__in=sorted(self.pending))
+        rows = list(BlacklistedToken.objects.filter(new_rows).values_list('id', 'token__jti'))
+        for _row_id, jti in rows:
+            self.bloom.add(jti)
+        self.advance(row_id for row_id, _jti in rows)
+        self.generation = generation
+        self.checked_at = time.monotonic()
+
+    def reset(self):
+        with self.lock:
+            self.__init__()
+
+
+index = RevokedTokenIndex()
+
+
+def token_revoked(jti, row_id=None):
+    """
+    Make a new blacklist entry visible: to this process now, and to every
+    other process once the transaction commits.
+    """
+    index.add(jti, row_id)
+    transaction.on_commit(bump_generation)
+
+
+class IndexedRefreshToken(RefreshToken):
+    """
+    RefreshToken whose blacklist check goes through the revoked-token
+    index, and whose blacklisting fails if the token was revoked
+    concurrently, so one refresh token cannot be rotated twice.
+    """
+
+    def check_blacklist(self):
+        if index.is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_('Token is blacklisted'))
+
+    def blacklist(self):
+        token, _created = OutstandingToken.objects.get_or_create(
+            jti=self.payload[api_settings.JTI_CLAIM],
+            defaults={
+                'token': str(self),
+                'expires_at': datetime_from_epoch(self.payload['exp']),
+            },
+        )
+        try:
+            with transaction.atomic():
+                return BlacklistedToken.objects.create(token=token)
+        except IntegrityError:
+            raise TokenError(_('Token is blacklisted'))
+
+
+class IndexedTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Token refresh that checks and updates the blacklist through the index.
+    """
+    token_class = IndexedRefreshToken
+
+
+class IndexedTokenVerifySerializer(serializers.Serializer):
+    """
+    Token verification that checks the blacklist through the index.
+    """
+    token = serializers.CharField(write_only=True)
+
+    def validate(self, attrs):
+        token = UntypedToken(attrs['token'])
+        if index.is_revoked(token.get(api_settings.JTI_CLAIM)):
+            raise serializers.ValidationError('Token is blacklisted')
+        return {}
@@ -0,0 +1,200 @@
+from collections import defaultdict
+from django.conf import settings
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from .sharding import ShardedQuerySet
+
+FTS_TABLE = 'chats_message_fts'
+# Maps each message ID to its FTS5 rowid, so updates and deletes are
+# point lookups (see SQLiteFTS5SearchBackend)
+FTS_ROWID_TABLE = 'chats_message_fts_rowid'
+
+
+class BaseSearchBackend:
+    """
+    Interface for full-text search over `chats.Message` bodies.
+
+    `search` narrows an already-scoped message queryset (the caller's
+    conversations) to matches, ordered by relevance. The index methods are
+    called on insert, update and delete (`created` tells new messages,
+    which have nothing to replace, from edits); engines that maintain
+    their own index can leave them as no-ops.
+    """
+
+    def __init__(self, using='default'):
+        self.using = using
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+    def index_messages(self, messages, created=False):
+        pass
+
+    def remove_messages(self, message_ids):
+        pass
+
+
+class IcontainsSearchBackend(BaseSearchBackend):
+    """
+    Fallback backend using a substring scan, for databases without a
+    full-text engine. Results keep the queryset's ordering.
+    """
+
+    def search(self, queryset, query):
+        for term in query.split():
+            queryset = queryset.filter(message_body__icontains=term)
+        return queryset
+
+
+class SQLiteFTS5SearchBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 backend for local development and tests.
+
+    Bodies are copied into the `chats_message_fts` virtual table (created by
+    migration 0005) and kept current from the message signals. Results are
+    ranked by bm25, best match first. The table's message_id column is
+    UNINDEXED, so rows are replaced and removed by rowid, found through
+    `chats_message_fts_rowid` (migration 0014).
+    """
+
+    def match_expression(self, query):
+        """
+        Turn free text into an FTS5 query: every word must match as a
+        prefix, and quoting keeps user input from being parsed as syntax.
+        """
+        terms = ['"{}"*'.format(term.replace('"', '""')) for term in query.split()]
+        return ' '.join(terms)
+
+    def search(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        table = queryset.model._meta.db_table
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[
+                f'{FTS_TABLE}.message_id = {table}.message_id',
+                f'{FTS_TABLE} MATCH %s',
+            ],
+            params=[expression],
+            select={'search_rank': f'bm25({FTS_TABLE})'},
+        ).order_by('search_rank')
+
+    def index_messages(self, messages, created=False):
+        rows = [(message.message_body, message.message_id.hex) for message in messages]
+        if not rows:
+            return
+        with connections[self.using].cursor() as cursor:
+            if not created:
+                # New messages have no old row to replace
+                self.delete_rows(cursor, [(row[1],) for row in rows])
+            cursor.executemany(f'INSERT INTO {FTS_ROWID_TABLE} (message_id) VALUES (%s)', [(row[1],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, message_id, message_body) '
+                f'SELECT fts_rowid, message_id, %s FROM {FTS_ROWID_TABLE} WHERE message_id = %s',
+                rows
+            )
+
+    def remove_messages(self, message_ids):
+        params = [(message_id.hex,) for message_id in message_ids]
+        if not params:
+            return
+        with connections[self.using].cursor() as cursor:
+            self.delete_rows(cursor, params)
+
+    def delete_rows(self, cursor, params):
+        """
+        Delete the FTS rows of the message IDs in `params`, one-tuples of
+        hex IDs, by rowid.
+        """
+        cursor.executemany(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = '
+            f'(SELECT fts_rowid FROM {FTS_ROWID_TABLE} WHERE message_id = %s)',
+            params
+        )
+        cursor.executemany(f'DELETE FROM {FTS_ROWID_TABLE} WHERE message_id = %s', params)
+
+
+class MySQLFullTextSearchBackend(BaseSearchBackend):
+    """
+    MySQL FULLTEXT backend for production.
+
+    Uses the `chats_msg_body_ft` FULLTEXT index (created by migration 0005),
+    which InnoDB maintains on every insert, update and delete. Results are
+    ranked by natural-language relevance, best match first.
+    """
+
+    def search(self, queryset, query):
+        if not query.strip():
+            return queryset.none()
+        table = queryset.model._meta.db_table
+        relevance = RawSQL(
+            f'MATCH ({table}.message_body) AGAINST (%s IN NATURAL LANGUAGE MODE)',
+            [query],
+            output_field=FloatField()
+        )
+        return queryset.annotate(search_rank=relevance).filter(
+            search_rank__gt=0
+        ).order_by('-search_rank')
+
+
+_backends = {}
+
+
+def _default_backend_class(using):
+    connection = connections[using]
+    if connection.vendor == 'mysql':
+        return MySQLFullTextSearchBackend
+    if connection.vendor == 'sqlite':
+        if FTS_TABLE in connection.introspection.table_names():
+            return SQLiteFTS5SearchBackend
+    return IcontainsSearchBackend
+
+
+def get_search_backend(using='default'):
+    """
+    Return the message search backend for a database alias.
+
+    `CHATS_SEARCH_BACKEND` may name a backend class by dotted path;
+    otherwise one is chosen from the database vendor.
+    """
+    backend = _backends.get(using)
+    if backend is None:
+        path = getattr(settings, 'CHATS_SEARCH_BACKEND', '')
+        backend_class = import_string(path) if path else _default_backend_class(using)
+        backend = _backends[using] = backend_class(using)
+    return backend
+
+
+def search_messages(queryset, query, sender_ids=None):
+    """
+    Narrow a message queryset to matches for `query` using the backend of
+    the database it reads from; a ShardedQuerySet is searched per shard.
+
+    With `sender_ids`, messages from those users match as well; results
+    then keep the queryset's ordering rather than the backend's ranking.
+    Archived messages are not indexed, so their bodies never match.
+    """
+    if isinstance(queryset, ShardedQuerySet):
+        return queryset.apply(lambda shard: search_messages(shard, query, sender_ids))
+    if queryset.model._meta.label == 'chats.ArchivedMessage':
+        # Ranked like the hot messages it is merged with
+        matches = queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+    else:
+        matches = get_search_backend(queryset.db).search(queryset, query)
+    if sender_ids is None:
+        return matches
+    return queryset.filter(Q(pk__in=matches.values('pk')) | Q(sender_id__in=sender_ids))
+
+
+def index_messages(messages):
+    """
+    Index bulk-inserted messages in the database each was written to.
+    """
+    by_database = defaultdict(list)
+    for message in messages:
+        by_database[message._state.db].append(message)
+    for using, group in by_database.items():
+        get_search_backend(using).index_messages(group, created=True)
@@ -1,8 +1,11 @@
 from rest_framework import serializers
 from .models import User, Conversation, Message
+from .membership import is_participant
+from .metrics import TimedRepresentationMixin
+from .sharding import ShardedQuerySet, is_sharded
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     """
     Serializer for User model.
     Handles user data serialization and validation.
@@ -52,7 +55,7 @@ class UserSerializer(serializers.ModelSerializer):
         return instance
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     """
     Serializer for Message model.
     Includes sender information and handles nested relationships.
@@ -95,7 +98,84 @@ class MessageSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class ConversationSerializer(serializers.ModelSerializer):
+class MessageRowSerializer(TimedRepresentationMixin, serializers.BaseSerializer):
+    """
+    Read-only fast path for message lists.
+
+    Renders `values()` rows (see `values`) into exactly the output of
+    MessageSerializer without building nested serializers per row. Each
+    sender's dict is built once and shared by all of their messages. With
+    `sender_format='compact'` in the context, `sender` is only the sender's
+    ID and the dicts are collected in `senders` for the response to carry
+    once.
+    """
+    sender_fields = [name for name in UserSerializer.Meta.fields if name != 'password']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.senders = {}
+        # Resolve the active timezone once instead of on every value
+        self.datetime_field = serializers.DateTimeField()
+        self.datetime_field.timezone = self.datetime_field.default_timezone()
+
+    message_fields = ['message_id', 'conversation_id', 'message_body', 'sent_at', 'sender_id']
+
+    @classmethod
+    def values(cls, queryset):
+        """
+        Return `queryset` as the rows this serializer expects, with the
+        sender's columns read through the same join as select_related.
+        Sharded messages cannot join users, so their senders are fetched
+        from the default database afterwards (see attach_senders).
+        """
+        if is_sharded():
+            return ShardedQuerySet.wrap(queryset).values(*cls.message_fields).map(cls.attach_senders)
+        return queryset.values(
+            *cls.message_fields,
+            *['sender__' + name for name in cls.sender_fields]
+        )
+
+    @classmethod
+    def attach_senders(cls, rows):
+        """
+        Add the `sender__*` columns to message rows with one user query.
+        """
+        senders = {
+            sender['user_id']: sender
+            for sender in User.objects.filter(
+                pk__in={row['sender_id'] for row in rows}
+            ).values('user_id', *cls.sender_fields)
+        }
+        for row in rows:
+            sender = senders.get(row['sender_id'], {})
+            row.update({'sender__' + name: sender.get(name) for name in cls.sender_fields})
+        return rows
+
+    @property
+    def compact(self):
+        return self.context.get('sender_format') == 'compact'
+
+    def get_sender(self, row):
+        sender_id = str(row['sender_id'])
+        sender = self.senders.get(sender_id)
+        if sender is None:
+            sender = {name: row['sender__' + name] for name in self.sender_fields}
+            sender['user_id'] = sender_id
+            sender['created_at'] = self.datetime_field.to_representation(sender['created_at'])
+            self.senders[sender_id] = sender
+        return sender_id if self.compact else sender
+
+    def to_representation(self, row):
+        return {
+            'message_id': str(row['message_id']),
+            'sender': self.get_sender(row),
+            'conversation': row['conversation_id'],
+            'message_body': row['message_body'],
+            'sent_at': self.datetime_field.to_representation(row['sent_at']),
+        }
+
+
+class ConversationSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     """
     Serializer for Conversation model.
     Handles many-to-many relationships with participants and nested messages.
@@ -107,7 +187,7 @@ class ConversationSerializer(serializers.ModelSerializer):
         required=False
     )
     messages = MessageSerializer(many=True, read_only=True)
-    participant_count = serializers.SerializerMethodField()
+    participant_count = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = Conversation
@@ -126,12 +206,6 @@ class ConversationSerializer(serializers.ModelSerializer):
             'updated_at': {'read_only': True},
         }
 
-    def get_participant_count(self, obj):
-        """
-        Return the number of participants in the conversation.
-        """
-        return obj.participants.count()
-
     def validate_participant_ids(self, value):
         """
         Validate that all participant IDs exist and there are at least 2 participants.
@@ -156,6 +230,7 @@ class ConversationSerializer(serializers.ModelSerializer):
         if participant_ids:
             participants = User.objects.filter(user_id__in=participant_ids)
             conversation.participants.set(participants)
+            conversation.refresh_from_db(fields=['participant_count', 'updated_at'])
         
         return conversation
 
@@ -173,19 +248,22 @@ class ConversationSerializer(serializers.ModelSerializer):
         if participant_ids is not None:
             participants = User.objects.filter(user_id__in=participant_ids)
             instance.participants.set(participants)
+            instance.refresh_from_db(fields=['participant_count', 'updated_at'])
         
         instance.save()
         return instance
 
 
-class ConversationListSerializer(serializers.ModelSerializer):
+class ConversationListSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     """
     Simplified serializer for listing conversations without nested messages.
     Used for performance optimization in list views.
     """
     participants = UserSerializer(many=True, read_only=True)
-    participant_count = serializers.SerializerMethodField()
+    participant_count = serializers.IntegerField(read_only=True)
     last_message = serializers.SerializerMethodField()
+    unread_count = serializers.IntegerField(read_only=True, default=0)
+    last_read_at = serializers.DateTimeField(read_only=True, default=None)
     
     class Meta:
         model = Conversation
@@ -194,29 +272,30 @@ class ConversationListSerializer(serializers.ModelSerializer):
             'participants',
             'participant_count',
             'last_message',
+            'unread_count',
+            'last_read_at',
+            'message_count',
             'created_at',
             'updated_at'
         ]
 
-    def get_participant_count(self, obj):
-        """
-        Return the number of participants in the conversation.
-        """
-        return obj.participants.count()
-
     def get_last_message(self, obj):
         """
         Return the most recent message in the conversation.
+        Read from the denormalized activity columns, so no message query runs.
+        `message_body` is therefore the inbox preview: the body cut to its
+        first 255 characters (chats.activity.PREVIEW_LENGTH). The message
+        endpoints return the full body.
         """
-        last_message = obj.messages.last()
-        if last_message:
-            return {
-                'message_id': last_message.message_id,
-                'sender': last_message.sender.first_name,
-                'message_body': last_message.message_body,
-                'sent_at': last_message.sent_at
-            }
-        return None
+        if obj.last_message_id is None:
+            return None
+        sender = obj.last_message_sender
+        return {
+            'message_id': obj.last_message_id,
+            'sender': sender.first_name if sender else None,
+            'message_body': obj.last_message_preview,
+            'sent_at': obj.last_message_at
+        }
 
 
 class MessageCreateSerializer(serializers.ModelSerializer):
@@ -240,7 +319,7 @@ class MessageCreateSerializer(serializers.ModelSerializer):
         conversation = data.get('conversation')
         
         if sender and conversation:
-            if not conversation.participants.filter(user_id=sender.user_id).exists():
+            if not is_participant(sender, conversation):
                 raise serializers.ValidationError(
                     "Sender must be a participant in the conversation."
                 )
@@ -248,6 +327,14 @@ class MessageCreateSerializer(serializers.ModelSerializer):
         return data
 
 
+class BulkMessageItemSerializer(serializers.Serializer):
+    """
+    Serializer for a single entry of a bulk message send request.
+    """
+    conversation_id = serializers.UUIDField()
+    message_body = serializers.CharField()
+
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     """
     Serializer for user registration with password confirmation.
@@ -312,7 +399,7 @@ class ChangePasswordSerializer(serializers.Serializer):
         return data
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     """
     Serializer for user profile (read-only sensitive info).
     """
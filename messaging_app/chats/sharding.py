@@ -0,0 +1,252 @@
+import uuid
+import zlib
+from collections import defaultdict
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.exceptions import ValidationError
+
+# Models whose rows live on their conversation's shard
+SHARDED_MODELS = {'chats.Message', 'chats.ArchivedMessage'}
+
+
+def get_shards():
+    """
+    Return the database aliases messages are sharded over, or an empty
+    list when sharding is off.
+    """
+    return settings.MESSAGE_SHARDS
+
+
+def is_sharded():
+    return bool(settings.MESSAGE_SHARDS)
+
+
+def shard_for(conversation_id):
+    """
+    Return the database alias holding a conversation's messages.
+    """
+    shards = settings.MESSAGE_SHARDS
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    if not isinstance(conversation_id, uuid.UUID):
+        conversation_id = uuid.UUID(str(conversation_id))
+    # CRC32 rather than hash(), which is salted per process
+    return shards[zlib.crc32(conversation_id.bytes) % len(shards)]
+
+
+def group_by_shard(conversation_ids):
+    """
+    Split conversation IDs into `{alias: [conversation_id, ...]}`.
+    """
+    groups = defaultdict(list)
+    for conversation_id in conversation_ids:
+        groups[shard_for(conversation_id)].append(conversation_id)
+    return groups
+
+
+def lookup_ids(queryset):
+    """
+    Prepare a flat `values_list()` queryset for an `__in` lookup on
+    messages: a subquery when sharding is off, otherwise the evaluated IDs,
+    since a shard cannot join tables on the default database.
+    """
+    if not is_sharded():
+        return queryset
+    return list(queryset)
+
+
+def with_senders(queryset):
+    """
+    Load each message's sender with it: a join when sharding is off,
+    otherwise one query against the default database per batch.
+    """
+    if not is_sharded():
+        return queryset.select_related('sender')
+    return queryset.prefetch_related('sender')
+
+
+class ShardedQuerySet:
+    """
+    One queryset per shard, used as a single ordered queryset.
+
+    Chained calls (filter, order_by, values, ...) are applied to every
+    shard. Slicing fetches the first `stop` rows of each shard in the
+    shared ordering and merges them, so a page costs one query per shard
+    and rows are never compared across databases in SQL. Orderings must
+    use the Message table's own columns (or per-row annotations such as
+    a search rank); joined fields cannot be merged. `transform`, if set,
+    post-processes each merged list of results.
+    """
+    chainable = (
+        'all', 'filter', 'exclude', 'order_by', 'distinct', 'extra',
+        'annotate', 'values', 'select_related', 'prefetch_related', 'only', 'defer',
+    )
+
+    def __init__(self, model, querysets, transform=None):
+        self.model = model
+        self.querysets = querysets
+        self.transform = transform
+
+    @classmethod
+    def wrap(cls, queryset):
+        if isinstance(queryset, cls):
+            return queryset
+        return cls(queryset.model, {queryset.db: queryset})
+
+    def __getattr__(self, name):
+        if name not in self.chainable:
+            raise AttributeError(name)
+
+        def chain(*args, **kwargs):
+            if name == 'values':
+                # Keep the ordering columns around for the merge
+                args = args + tuple(field for field in self.ordering_names() if args and field not in args)
+            return self.apply(lambda queryset: getattr(queryset, name)(*args, **kwargs))
+        return chain
+
+    def apply(self, func):
+        """
+        Return a new ShardedQuerySet with `func` applied to every shard's
+        queryset. Raises ValidationError if the result is ordered by a
+        related field, which the merge cannot see.
+        """
+        result = type(self)(
+            self.model,
+            {alias: func(queryset) for alias, queryset in self.querysets.items()},
+            self.transform
+        )
+        result.check_ordering(result.ordering())
+        return result
+
+    def map(self, transform):
+        """
+        Return a copy whose results are passed through `transform(list)`.
+        """
+        return type(self)(self.model, self.querysets, transform)
+
+    def check_ordering(self, fields):
+        for field in fields:
+            if isinstance(field, str) and '__' in field:
+                raise ValidationError({'ordering': f'Cannot order sharded messages by {field.lstrip("-")}'})
+
+    def ordering(self):
+        for queryset in self.querysets.values():
+            return list(queryset.query.order_by or self.model._meta.ordering)
+        return []
+
+    def ordering_names(self):
+        return [field.lstrip('-') for field in self.ordering() if isinstance(field, str)]
+
+    @property
+    def ordered(self):
+        return True
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets.values())
+
+    def exists(self):
+        return any(queryset.exists() for queryset in self.querysets.values())
+
+    def get(self, *args, **kwargs):
+        found = []
+        for queryset in self.querysets.values():
+            found.extend(queryset.filter(*args, **kwargs)[:2])
+        if not found:
+            raise self.model.DoesNotExist(f'{self.model._meta.object_name} matching query does not exist.')
+        if len(found) > 1:
+            raise self.model.MultipleObjectsReturned(
+                f'get() returned more than one {self.model._meta.object_name}'
+            )
+        return found[0]
+
+    def merge(self, results):
+        # Stable sorts from the last ordering field to the first give the
+        # combined ordering, whatever the mix of directions
+        for field in reversed(self.ordering()):
+            if not isinstance(field, str):
+                continue
+            name = field.lstrip('-')
+            if name == 'pk':
+                name = self.model._meta.pk.attname
+            results.sort(
+                key=lambda row: row[name] if isinstance(row, dict) else getattr(row, name),
+                reverse=field.startswith('-')
+            )
+        return results
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        results = []
+        for queryset in self.querysets.values():
+            results.extend(queryset[:stop] if stop is not None else queryset)
+        results = self.merge(results)[start:stop]
+        return self.transform(results) if self.transform else results
+
+    def __iter__(self):
+        return iter(self[0:None])
+
+    def __len__(self):
+        return self.count()
+
+
+def messages_for_conversation(conversation_id):
+    """
+    Return a queryset of one conversation's messages on its shard. Without
+    sharding no database is named, so reads can still go to a replica.
+    """
+    from .models import Message
+    messages = Message.objects.filter(conversation_id=conversation_id)
+    return messages.using(shard_for(conversation_id)) if is_sharded() else messages
+
+
+def messages_for_conversations(conversation_ids):
+    """
+    Return the messages of several conversations: a plain queryset when
+    sharding is off, otherwise a ShardedQuerySet over the shards involved.
+    """
+    from .models import Message
+    if not is_sharded():
+        return Message.objects.filter(conversation_id__in=conversation_ids)
+    return ShardedQuerySet(Message, {
+        alias: Message.objects.using(alias).filter(conversation_id__in=ids)
+        for alias, ids in group_by_shard(conversation_ids).items()
+    })
+
+
+class MessageShardRouter:
+    """
+    Route Message and ArchivedMessage rows to the shard chosen by their
+    conversation when MESSAGE_SHARDS is set; has no opinion otherwise, or
+    about other models.
+
+    Reads without an instance to go by cannot be routed, so code reading
+    messages names the shard itself (see messages_for_conversation).
+    Every database gets the full schema, so the default database's message
+    table stays (empty) for cascades, and the shards' other tables stay
+    empty; Message's foreign keys need MESSAGE_DB_CONSTRAINTS off for that
+    reason.
+    """
+
+    def route(self, model, hints):
+        if not is_sharded():
+            return None
+        instance = hints.get('instance')
+        if model._meta.label in SHARDED_MODELS and instance is not None:
+            if instance._meta.label == 'chats.Conversation':
+                return shard_for(instance.pk)
+            if instance._meta.label in SHARDED_MODELS and instance.conversation_id is not None:
+                return shard_for(instance.conversation_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded() and SHARDED_MODELS.intersection((obj1._meta.label, obj2._meta.label)):
+            return True
+        return None
@@ -0,0 +1,258 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from .models import ArchivedMessage, ChangeEvent, Conversation, Message, User
+from . import activity, membership, revocation, updates, user_search
+from .authentication import invalidate_users
+from .search import get_search_backend
+from .sharding import get_shards, is_sharded, shard_for
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def invalidate_membership_on_participants_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep the cached membership index in step with the participants table,
+    and bump the affected conversations' `updated_at`. Covers
+    add_participant, remove_participant and ConversationSerializer
+    create/update, which all go through the participants manager.
+    """
+    if reverse:
+        # user.conversations.add/remove/clear(): only that user's set changed
+        if action == 'pre_clear':
+            instance._cleared_conversation_ids = list(
+                instance.conversations.values_list('conversation_id', flat=True)
+            )
+        elif action == 'post_clear':
+            membership.invalidate([instance.pk])
+            activity.touch_conversations(getattr(instance, '_cleared_conversation_ids', []))
+        elif action in ('post_add', 'post_remove'):
+            membership.invalidate([instance.pk])
+            activity.touch_conversations(pk_set or [])
+        return
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        # Participant lists are part of the inbox, so version it forward
+        activity.touch_conversations([instance.pk])
+
+    if action == 'pre_clear':
+        # pk_set is None for clear(), so remember who is about to be removed
+        instance._cleared_participant_ids = list(
+            instance.participants.values_list('user_id', flat=True)
+        )
+    elif action == 'post_clear':
+        membership.invalidate(getattr(instance, '_cleared_participant_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        membership.invalidate(pk_set or [])
+
+
+@receiver(pre_delete, sender=Conversation)
+def remember_participants_before_delete(sender, instance, **kwargs):
+    """
+    Capture participant IDs before the cascade removes the through rows.
+    """
+    instance._deleted_participant_ids = list(
+        instance.participants.values_list('user_id', flat=True)
+    )
+
+
+@receiver(pre_delete, sender=Conversation)
+def delete_sharded_messages(sender, instance, **kwargs):
+    """
+    Delete a conversation's messages, hot and archived, from its shard,
+    which the cascade on the default database cannot reach. Like the
+    cascade, this publishes no per-message events and leaves activity
+    alone.
+    """
+    if not is_sharded():
+        return
+    alias = shard_for(instance.pk)
+    messages = Message.objects.using(alias).filter(conversation_id=instance.pk)
+    message_ids = list(messages.values_list('message_id', flat=True))
+    # No signals: the conversation's own deletion covers these messages
+    messages._raw_delete(alias)
+    ArchivedMessage.objects.using(alias).filter(conversation_id=instance.pk)._raw_delete(alias)
+    get_search_backend(alias).remove_messages(message_ids)
+
+
+@receiver(post_delete, sender=Conversation)
+def invalidate_membership_on_delete(sender, instance, **kwargs):
+    """
+    Drop the membership sets of everyone who was in a deleted conversation.
+    """
+    membership.invalidate(getattr(instance, '_deleted_participant_ids', []))
+
+
+@receiver(post_save, sender=Message)
+def update_conversation_activity_on_save(sender, instance, created, raw=False, **kwargs):
+    """
+    Keep the conversation's last-message and count columns current.
+    Bulk inserts bypass this signal and call chats.activity directly.
+    """
+    if raw:
+        return
+    if created:
+        activity.record_new_messages([instance])
+    else:
+        activity.record_message_edited(instance)
+
+
+@receiver(post_delete, sender=Message)
+def update_conversation_activity_on_delete(sender, instance, origin=None, **kwargs):
+    """
+    Roll back the deleted message's contribution to its conversation,
+    unless the conversation itself is what is being deleted.
+    """
+    if isinstance(origin, Conversation) and origin.pk == instance.conversation_id:
+        return
+    activity.record_message_deleted(instance)
+
+
+@receiver(post_save, sender=Message)
+def index_message_on_save(sender, instance, created, raw=False, using='default', **kwargs):
+    """
+    Add or refresh the message in the search index.
+    Bulk inserts bypass this signal and index through chats.search directly.
+    """
+    if raw:
+        return
+    get_search_backend(using).index_messages([instance], created=created)
+
+
+@receiver(post_delete, sender=Message)
+def remove_message_from_index(sender, instance, using='default', **kwargs):
+    """
+    Drop a deleted message from the search index, including cascades.
+    """
+    get_search_backend(using).remove_messages([instance.message_id])
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def record_participant_events(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Publish participant changes to the updates feed. Relies on the IDs
+    stashed at pre_clear by invalidate_membership_on_participants_change.
+    """
+    kinds = {
+        'post_add': ChangeEvent.PARTICIPANT_ADDED,
+        'post_remove': ChangeEvent.PARTICIPANT_REMOVED,
+        'post_clear': ChangeEvent.PARTICIPANT_REMOVED,
+    }
+    if action not in kinds:
+        return
+    if reverse:
+        conversation_ids = pk_set if action != 'post_clear' else getattr(instance, '_cleared_conversation_ids', [])
+        for conversation_id in conversation_ids or []:
+            updates.record_participants(kinds[action], conversation_id, [instance.pk])
+    else:
+        user_ids = pk_set if action != 'post_clear' else getattr(instance, '_cleared_participant_ids', [])
+        updates.record_participants(kinds[action], instance.pk, user_ids or [])
+
+
+@receiver(post_delete, sender=Conversation)
+def record_conversation_deleted(sender, instance, **kwargs):
+    """
+    Tell every former participant, directly, that the conversation is gone.
+    """
+    updates.record_participants(
+        ChangeEvent.CONVERSATION_DELETED,
+        instance.pk,
+        getattr(instance, '_deleted_participant_ids', [])
+    )
+
+
+@receiver(post_save, sender=Message)
+def record_message_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    Publish new and edited messages to the updates feed.
+    Bulk inserts bypass this signal and record through chats.updates directly.
+    """
+    if raw:
+        return
+    kind = ChangeEvent.MESSAGE_CREATED if created else ChangeEvent.MESSAGE_UPDATED
+    updates.record_messages(kind, [instance])
+
+
+@receiver(post_delete, sender=Message)
+def record_message_deleted(sender, instance, origin=None, **kwargs):
+    """
+    Publish deleted messages, unless the whole conversation is being deleted.
+    """
+    if isinstance(origin, Conversation) and origin.pk == instance.conversation_id:
+        return
+    updates.record_messages(ChangeEvent.MESSAGE_DELETED, [instance])
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_messages_of_user(sender, instance, **kwargs):
+    """
+    Delete a user's messages from every shard, as the cascade does on the
+    default database, so the message signals still run for each one.
+    """
+    for alias in get_shards():
+        Message.objects.using(alias).filter(sender_id=instance.pk).delete()
+        ArchivedMessage.objects.using(alias).filter(sender_id=instance.pk).delete()
+
+
+@receiver(pre_delete, sender=User)
+def remember_conversations_before_delete(sender, instance, **kwargs):
+    """
+    Capture a deleted user's conversations before the cascade removes
+    their participant rows, which sends no m2m_changed.
+    """
+    instance._deleted_conversation_ids = list(
+        instance.conversations.values_list('conversation_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=User)
+def recount_participants_on_user_delete(sender, instance, **kwargs):
+    """
+    Recount participants of the conversations a deleted user was in.
+    """
+    activity.touch_conversations(getattr(instance, '_deleted_conversation_ids', []))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Drop the cached copy used by CachedJWTAuthentication whenever a user
+    changes, e.g. update_profile, change_password or deactivation.
+    """
+    invalidate_users([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def index_user_on_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Rebuild a user's search tokens, unless the save only touched fields
+    that are not indexed (e.g. last_login on every login).
+    """
+    if raw:
+        return
+    if update_fields is not None and not user_search.INDEXED_FIELDS.intersection(update_fields):
+        return
+    user_search.index_users([instance])
+
+
+@receiver(post_save, sender=User)
+def record_profile_change_on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """
+    Let cached conversation lists and messages see a participant's new
+    profile, unless the save only touched fields they do not show.
+    """
+    if raw or created:
+        return
+    if update_fields is not None and not activity.PROFILE_FIELDS.intersection(update_fields):
+        return
+    activity.record_profile_changed([instance.pk])
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def index_revoked_token(sender, instance, created, raw=False, **kwargs):
+    """
+    Add newly blacklisted refresh tokens to the revoked-token index,
+    whichever path blacklisted them (rotation, logout or the admin).
+    """
+    if created and not raw:
+        revocation.token_revoked(instance.token.jti, instance.pk)
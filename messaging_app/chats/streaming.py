@@ -0,0 +1,200 @@
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.middleware.gzip import re_accepts_gzip
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from rest_framework.compat import SHORT_SEPARATORS, LONG_SEPARATORS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from .pagination import keyset_filter
+
+
+def iterate_in_batches(queryset, ordering, chunk_size):
+    """
+    Yield every row of `queryset` in `ordering`, fetching `chunk_size`
+    rows per query.
+
+    Each batch resumes from the last key seen rather than using OFFSET or
+    a single open cursor, so memory stays bounded on every backend
+    (MySQLdb buffers the whole result of `QuerySet.iterator()`).
+    """
+    queryset = queryset.order_by(*ordering)
+    names = [field.lstrip('-') for field in ordering]
+
+    batch = list(queryset[:chunk_size])
+    while batch:
+        yield from batch
+        if len(batch) < chunk_size:
+            return
+        last = batch[-1]
+        values = [getattr(last, name) for name in names]
+        batch = list(queryset.filter(keyset_filter(ordering, values))[:chunk_size])
+
+
+def ndjson_lines(rows, serializer, flush_bytes=64 * 1024):
+    """
+    Encode rows with `serializer.to_representation` as newline-delimited
+    JSON, yielding text in blocks of roughly `flush_bytes`.
+    """
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    buffer = []
+    size = 0
+    for row in rows:
+        line = encoder.encode(serializer.to_representation(row)) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= flush_bytes:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_ndjson(queryset, serializer_class, ordering, chunk_size, context=None):
+    """
+    Return a `StreamingHttpResponse` that writes `queryset` as NDJSON
+    using constant memory.
+    """
+    # A single serializer instance is reused for every row so field
+    # construction happens once per response, not once per message.
+    serializer = serializer_class(context=context)
+    rows = iterate_in_batches(queryset, ordering, chunk_size)
+    response = StreamingHttpResponse(
+        ndjson_lines(rows, serializer),
+        content_type='application/x-ndjson'
+    )
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+class StreamingJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that can also encode a paginated response incrementally.
+
+    `render()` is unchanged. `render_chunks()` yields the same bytes in
+    blocks of roughly `chunk_size`, encoding the `results` list one row at
+    a time, so the full body never exists as one string. Views opt in
+    with StreamingResponseMixin.
+    """
+    chunk_size = 64 * 1024
+
+    def can_stream(self, data, accepted_media_type, renderer_context):
+        """
+        Only compact paginated pages stream; anything else is small or
+        indented and goes through render().
+        """
+        return (
+            isinstance(data, dict)
+            and isinstance(data.get('results'), list)
+            and self.get_indent(accepted_media_type, renderer_context or {}) is None
+        )
+
+    def render_chunks(self, data):
+        """
+        Yield the JSON encoding of `data`, a dict with a `results` list.
+        """
+        encoder = self.encoder_class(
+            ensure_ascii=self.ensure_ascii,
+            allow_nan=not self.strict,
+            separators=SHORT_SEPARATORS if self.compact else LONG_SEPARATORS
+        )
+        item_separator, key_separator = encoder.item_separator, encoder.key_separator
+
+        def escape(text):
+            # Same strict-JavaScript-subset escaping as JSONRenderer.render
+            return text.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+        buffer = ['{']
+        size = 1
+        for index, (key, value) in enumerate(data.items()):
+            if index:
+                buffer.append(item_separator)
+            buffer.append(encoder.encode(str(key)) + key_separator)
+            if key != 'results':
+                buffer.append(encoder.encode(value))
+                continue
+            buffer.append('[')
+            for position, row in enumerate(value):
+                text = encoder.encode(row)
+                buffer.append(item_separator + text if position else text)
+                size += len(text)
+                if size >= self.chunk_size:
+                    yield escape(''.join(buffer))
+                    buffer = []
+                    size = 0
+            buffer.append(']')
+        buffer.append('}')
+        yield escape(''.join(buffer))
+
+
+def stream_json_response(request, response):
+    """
+    Turn a finalized DRF Response for a paginated page into a response
+    whose body is encoded incrementally by StreamingJSONRenderer.
+
+    Chunks are read until API_GZIP_MIN_LENGTH bytes are buffered. A body
+    that ends first is sent as a plain HttpResponse; a longer one is
+    streamed, gzipped on the fly when the client accepts it. Headers set on
+    the original response (ETag, Vary, ...) are kept, and `data` stays
+    available to callers such as the test client.
+    """
+    renderer = response.accepted_renderer
+    gzip = re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    chunks = renderer.render_chunks(response.data)
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= settings.API_GZIP_MIN_LENGTH:
+            break
+    else:
+        chunks = None
+
+    if chunks is None:
+        streamed = HttpResponse(b''.join(head), status=response.status_code, content_type=renderer.media_type)
+    else:
+        def body(head=head, rest=chunks):
+            yield from head
+            yield from rest
+
+        content = body()
+        if gzip:
+            # Random filename padding as in GZipMiddleware, against BREACH
+            content = compress_sequence(content, max_random_bytes=100)
+        streamed = StreamingHttpResponse(content, status=response.status_code, content_type=renderer.media_type)
+
+    for header, value in response.items():
+        if header.lower() != 'content-type':
+            streamed[header] = value
+    if chunks is not None:
+        patch_vary_headers(streamed, ('Accept-Encoding',))
+        if gzip:
+            etag = streamed.get('ETag')
+            if etag and etag.startswith('"'):
+                streamed['ETag'] = 'W/' + etag
+            streamed['Content-Encoding'] = 'gzip'
+    streamed.data = response.data
+    return streamed
+
+
+class StreamingResponseMixin:
+    """
+    View mixin sending successful paginated pages through
+    stream_json_response when StreamingJSONRenderer was negotiated.
+    """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if (
+            isinstance(response, Response)
+            and response.status_code == 200
+            and isinstance(getattr(response, 'accepted_renderer', None), StreamingJSONRenderer)
+            and response.accepted_renderer.can_stream(
+                response.data, response.accepted_media_type, response.renderer_context
+            )
+        ):
+            return stream_json_response(request, response)
+        return response
@@ -1,3 +1,2312 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import check_password
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework import status
+from django.contrib.auth import get_user_model
+from messaging_app.db.backends.sqlite3.base import DatabaseWrapper as PooledSQLiteWrapper
+from messaging_app.db.pool import PoolTimeout, close_pools, pool_stats
+from messaging_app.db.replicas import ReplicaRouter, routing
+from .models import ArchivedMessage, Conversation, ConversationParticipant, Message
+from . import metrics
+from .activity import PREVIEW_LENGTH
+from .membership import is_participant
+from .pagination import KeysetPagination
+from .permissions import can_access_conversation, can_modify_message
+from .revocation import (
+    IndexedRefreshToken, RevokedTokenIndex, bump_generation, current_generation, index as revoked_tokens
+)
+from .search import SQLiteFTS5SearchBackend, _backends as search_backends, get_search_backend
+from .serializers import MessageSerializer
+from .sharding import shard_for
+from .streaming import StreamingJSONRenderer
+from .updates import hub
 
-# Create your tests here.
+User = get_user_model()
+
+
+def create_user(username, **extra):
+    """
+    Create a user with sensible defaults for tests.
+    """
+    return User.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        password='password123',
+        first_name=username.title(),
+        last_name='Tester',
+        **extra
+    )
+
+
+class CursorPaginationTestCase(TestCase):
+    """
+    Test case for opt-in keyset pagination on message and conversation lists.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('alice')
+        self.client.force_authenticate(user=self.user)
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        for i in range(5):
+            Message.objects.create(
+                sender=self.user,
+                conversation=self.conversation,
+                message_body=f'Message {i}'
+            )
+
+    def test_page_number_is_default(self):
+        """
+        Test that responses keep the page-number shape unless cursor mode is requested.
+        """
+        response = self.client.get('/api/messages/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 5)
+        self.assertIn('total_pages', response.data)
+
+    def test_message_cursor_walks_forward_and_back(self):
+        """
+        Test that next/previous cursors visit every message exactly once.
+        """
+        expected = [
+            str(message_id) for message_id in Message.objects.order_by(
+                '-sent_at', '-message_id'
+            ).values_list('message_id', flat=True)
+        ]
+
+        pages = []
+        response = self.client.get('/api/messages/', {'pagination': 'cursor', 'page_size': 2})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            pages.append([row['message_id'] for row in response.data['results']])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual([message_id for page in pages for message_id in page], expected)
+
+        # Walk back from the last page using the previous links
+        backwards = []
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            backwards.insert(0, [row['message_id'] for row in response.data['results']])
+        self.assertEqual(backwards, pages[:-1])
+
+    def test_invalid_cursor_returns_404(self):
+        """
+        Test that a tampered cursor is rejected.
+        """
+        response = self.client.get('/api/messages/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_with_unparseable_key_returns_404(self):
+        """
+        Test that a well-formed cursor whose key values do not convert is rejected.
+        """
+        token = KeysetPagination(ordering=('-sent_at', '-message_id')).encode_cursor(
+            ['not-a-date', 'not-a-uuid'], reverse=False
+        )
+        response = self.client.get('/api/messages/', {'cursor': token})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_conversation_cursor(self):
+        """
+        Test that conversations can be listed with cursor pagination.
+        """
+        response = self.client.get('/api/conversations/', {'pagination': 'cursor'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertIsNone(response.data['next'])
+
+
+class ConversationListQueryTestCase(TestCase):
+    """
+    Test case for the query budget of the conversation list.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('alice')
+        self.others = [create_user(f'user{i}') for i in range(3)]
+        self.client.force_authenticate(user=self.user)
+
+    def create_conversations(self, count):
+        for i in range(count):
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.user, *self.others[:1 + i % 3])
+            Message.objects.create(
+                sender=self.user,
+                conversation=conversation,
+                message_body=f'Hello {i}'
+            )
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/conversations/', {'page_size': 50})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries), response
+
+    def test_query_count_is_constant(self):
+        """
+        Test that a bigger page does not run more queries.
+        """
+        self.create_conversations(2)
+        small_page_queries, response = self.count_list_queries()
+        self.assertEqual(len(response.data['results']), 2)
+
+        self.create_conversations(10)
+        large_page_queries, response = self.count_list_queries()
+        self.assertEqual(len(response.data['results']), 12)
+
+        self.assertEqual(small_page_queries, large_page_queries)
+        # page, participants prefetch, count, plus the ETag version query
+        self.assertLessEqual(large_page_queries, 4)
+
+    def test_list_payload(self):
+        """
+        Test that annotated values match the conversation contents.
+        """
+        self.create_conversations(1)
+        _, response = self.count_list_queries()
+        row = response.data['results'][0]
+        self.assertEqual(row['participant_count'], 2)
+        self.assertEqual(len(row['participants']), 2)
+        self.assertEqual(row['last_message']['message_body'], 'Hello 0')
+        self.assertEqual(row['last_message']['sender'], self.user.first_name)
+
+    def test_last_message_body_is_the_preview(self):
+        """
+        Test that long last messages are listed cut to the preview length,
+        while the message endpoints keep the full body.
+        """
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user)
+        body = 'x' * (PREVIEW_LENGTH + 45)
+        Message.objects.create(sender=self.user, conversation=conversation, message_body=body)
+
+        _, response = self.count_list_queries()
+        self.assertEqual(response.data['results'][0]['last_message']['message_body'], body[:PREVIEW_LENGTH])
+        self.assertEqual(PREVIEW_LENGTH, 255)
+
+        response = self.client.get(f'/api/conversations/{conversation.pk}/messages/')
+        self.assertEqual(response.data['results'][0]['message_body'], body)
+
+
+class ConversationMessagesActionTestCase(TestCase):
+    """
+    Test case for the paginated and streaming conversation messages action.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('alice')
+        self.client.force_authenticate(user=self.user)
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        for i in range(5):
+            Message.objects.create(
+                sender=self.user,
+                conversation=self.conversation,
+                message_body=f'Message {i}'
+            )
+        self.url = f'/api/conversations/{self.conversation.conversation_id}/messages/'
+
+    def test_messages_are_paginated(self):
+        """
+        Test that the action returns a page instead of every message.
+        """
+        response = self.client.get(self.url, {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(len(response.data['results']), 2)
+
+    @override_settings(MESSAGE_STREAM_CHUNK_SIZE=2)
+    def test_messages_stream_as_ndjson(self):
+        """
+        Test that the NDJSON export yields every message in order across batches.
+        """
+        response = self.client.get(self.url, {'stream': 'ndjson'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(
+            [row['message_body'] for row in rows],
+            [f'Message {i}' for i in range(5)]
+        )
+        self.assertEqual(rows[0]['sender']['email'], self.user.email)
+
+
+class MembershipIndexTestCase(TestCase):
+    """
+    Test case for the cached conversation-membership index.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('alice')
+        self.other = create_user('bob')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+
+    def test_membership_is_cached(self):
+        """
+        Test that only the first check reads the participants table.
+        """
+        with self.assertNumQueries(1):
+            self.assertTrue(is_participant(self.user, self.conversation))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_participant(self.user, self.conversation.conversation_id))
+            self.assertTrue(is_participant(self.user, str(self.conversation.conversation_id)))
+
+    def test_participant_changes_invalidate(self):
+        """
+        Test that add, remove and clear are reflected immediately.
+        """
+        self.assertFalse(is_participant(self.other, self.conversation))
+        self.conversation.participants.add(self.other)
+        self.assertTrue(is_participant(self.other, self.conversation))
+
+        self.conversation.participants.remove(self.other)
+        self.assertFalse(is_participant(self.other, self.conversation))
+
+        self.other.conversations.add(self.conversation)
+        self.assertTrue(is_participant(self.other, self.conversation))
+
+        self.assertTrue(is_participant(self.user, self.conversation))
+        self.conversation.participants.clear()
+        self.assertFalse(is_participant(self.user, self.conversation))
+        self.assertFalse(is_participant(self.other, self.conversation))
+
+    def test_removed_participant_loses_access(self):
+        """
+        Test that a removed participant cannot read messages any more.
+        """
+        self.conversation.participants.add(self.other)
+        message = Message.objects.create(
+            sender=self.user,
+            conversation=self.conversation,
+            message_body='Hello'
+        )
+        self.assertTrue(can_access_conversation(self.other, self.conversation))
+
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.post(
+            f'/api/conversations/{self.conversation.conversation_id}/remove_participant/',
+            {'user_id': str(self.other.user_id)}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(can_access_conversation(self.other, self.conversation))
+        self.assertFalse(can_modify_message(self.other, message))
+
+
+class BulkSendTestCase(TestCase):
+    """
+    Test case for the bulk message send endpoint.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user('alice')
+        self.client.force_authenticate(user=self.user)
+        self.conversations = []
+        for _ in range(2):
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.user)
+            self.conversations.append(conversation)
+        self.foreign = Conversation.objects.create()
+
+    def test_per_item_results(self):
+        """
+        Test that valid entries are created and failures are reported per item.
+        """
+        payload = {'messages': [
+            {'conversation_id': str(self.conversations[0].conversation_id), 'message_body': 'one'},
+            {'conversation_id': str(self.conversations[1].conversation_id), 'message_body': 'two'},
+            {'conversation_id': str(self.foreign.conversation_id), 'message_body': 'nope'},
+            {'conversation_id': 'not-a-uuid', 'message_body': 'bad'},
+        ]}
+        response = self.client.post('/api/messages/bulk_send/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            [201, 201, 404, 400]
+        )
+        self.assertEqual(Message.objects.filter(sender=self.user).count(), 2)
+        self.assertFalse(Message.objects.filter(conversation=self.foreign).exists())
+
+    def test_queries_do_not_grow_with_batch(self):
+        """
+        Test that a batch costs the same number of queries whatever its size.
+        """
+        def send(count):
+            payload = {'messages': [
+                {
+                    'conversation_id': str(self.conversations[i % 2].conversation_id),
+                    'message_body': f'message {i}'
+                }
+                for i in range(count)
+            ]}
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post('/api/messages/bulk_send/', payload, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            return len(context.captured_queries)
+
+        self.assertEqual(send(2), send(50))
+
+    @override_settings(MESSAGE_BULK_MAX_ITEMS=1)
+    def test_batch_size_limit(self):
+        """
+        Test that oversized batches are rejected up front.
+        """
+        payload = {'messages': [
+            {'conversation_id': str(self.conversations[0].conversation_id), 'message_body': 'a'},
+            {'conversation_id': str(self.conversations[0].conversation_id), 'message_body': 'b'},
+        ]}
+        response = self.client.post('/api/messages/bulk_send/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Message.objects.exists())
+
+
+class ConversationActivityTestCase(TestCase):
+    """
+    Test case for the denormalized conversation activity columns.
+    """
+
+    def setUp(self):
+        self.user = create_user('alice')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+
+    def send(self, body):
+        return Message.objects.create(
+            sender=self.user,
+            conversation=self.conversation,
+            message_body=body
+        )
+
+    def test_insert_edit_and_delete(self):
+        """
+        Test that the columns follow inserts, edits and deletes.
+        """
+        first = self.send('first')
+        second = self.send('second')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 2)
+        self.assertEqual(self.conversation.last_message_id, second.message_id)
+        self.assertEqual(self.conversation.last_message_preview, 'second')
+        self.assertEqual(self.conversation.last_message_sender_id, self.user.user_id)
+        self.assertGreaterEqual(self.conversation.updated_at, second.sent_at)
+
+        second.message_body = 'second, edited'
+        second.save()
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_preview, 'second, edited')
+
+        second.delete()
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 1)
+        self.assertEqual(self.conversation.last_message_id, first.message_id)
+
+        first.delete()
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 0)
+        self.assertIsNone(self.conversation.last_message_id)
+
+    def test_backfill_command(self):
+        """
+        Test that the backfill command repairs drifted columns.
+        """
+        message = self.send('hello')
+        Conversation.objects.filter(pk=self.conversation.pk).update(
+            message_count=0, last_message_id=None, last_message_preview=''
+        )
+        call_command('backfill_conversation_activity', stdout=StringIO())
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 1)
+        self.assertEqual(self.conversation.last_message_id, message.message_id)
+        self.assertEqual(self.conversation.last_message_preview, 'hello')
+
+
+class ExplainQueriesCommandTestCase(TestCase):
+    """
+    Test case for the index-advisor management command.
+    """
+
+    def test_explains_every_query(self):
+        """
+        Test that the command explains the viewset and filter queries.
+        """
+        user = create_user('alice')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(user)
+        Message.objects.create(sender=user, conversation=conversation, message_body='Hi')
+
+        stdout = StringIO()
+        call_command('explain_queries', stdout=stdout, stderr=StringIO())
+        output = stdout.getvalue()
+        self.assertIn('ConversationViewSet.list', output)
+        self.assertIn('MessageFilter.sender_name', output)
+        self.assertIn('queries flagged on sqlite', output)
+
+
+class MessageSearchTestCase(TestCase):
+    """
+    Test case for full-text message search.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('alice')
+        self.other = create_user('bob')
+        self.client.force_authenticate(user=self.user)
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.hidden = Conversation.objects.create()
+        self.hidden.participants.add(self.other)
+
+    def send(self, body, conversation=None, sender=None):
+        return Message.objects.create(
+            sender=sender or self.user,
+            conversation=conversation or self.conversation,
+            message_body=body
+        )
+
+    def search(self, query):
+        response = self.client.get('/api/messages/', {'search': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [message['message_body'] for message in response.data['results']]
+
+    def test_uses_fts5_backend(self):
+        """
+        Test that SQLite databases get the FTS5 backend.
+        """
+        self.assertIsInstance(get_search_backend(), SQLiteFTS5SearchBackend)
+
+    def test_results_are_ranked_and_scoped(self):
+        """
+        Test that matches are ordered by relevance and limited to the caller's conversations.
+        """
+        self.send('the lunch menu for the whole team is posted on the board today')
+        self.send('lunch lunch')
+        self.send('dinner plans')
+        self.send('lunch', conversation=self.hidden, sender=self.other)
+
+        self.assertEqual(self.search('lunch'), [
+            'lunch lunch',
+            'the lunch menu for the whole team is posted on the board today',
+        ])
+
+    def test_matches_sender_names_and_emails(self):
+        """
+        Test that messages are also found by their sender's name or email.
+        """
+        self.conversation.participants.add(self.other)
+        self.send('see you at noon', sender=self.other)
+        self.send('bobsleigh tonight?')
+        self.send('dinner plans')
+
+        self.assertEqual(sorted(self.search('bob')), ['bobsleigh tonight?', 'see you at noon'])
+        self.assertEqual(self.search('bob@example.com'), ['see you at noon'])
+        self.assertEqual(self.search('Bob Tester'), ['see you at noon'])
+
+    def test_index_follows_edits_and_deletes(self):
+        """
+        Test that updates and deletes are reflected in search results.
+        """
+        message = self.send('quarterly report')
+        message.message_body = 'annual summary'
+        message.save()
+        self.assertEqual(self.search('quarterly'), [])
+        self.assertEqual(self.search('annual'), ['annual summary'])
+
+        message.delete()
+        self.assertEqual(self.search('annual'), [])
+
+    def test_index_rows_are_replaced_by_rowid(self):
+        """
+        Test that edits and deletes go through the rowid table, without
+        filtering the FTS table on its unindexed message_id column.
+        """
+        message = self.send('quarterly report')
+        with CaptureQueriesContext(connection) as context:
+            message.message_body = 'annual summary'
+            message.save()
+            message.delete()
+        fts_deletes = [
+            query['sql'] for query in context.captured_queries
+            if 'DELETE FROM chats_message_fts ' in query['sql']
+        ]
+        self.assertTrue(fts_deletes)
+        self.assertTrue(all('WHERE rowid =' in sql for sql in fts_deletes))
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM chats_message_fts_rowid')
+            self.assertEqual(cursor.fetchone(), (0,))
+
+    def test_bulk_send_is_indexed(self):
+        """
+        Test that messages created by bulk_send are searchable.
+        """
+        response = self.client.post('/api/messages/bulk_send/', {'messages': [
+            {'conversation_id': str(self.conversation.pk), 'message_body': 'shipping update'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.search('ship'), ['shipping update'])
+
+    def test_query_syntax_is_treated_as_text(self):
+        """
+        Test that FTS operators in user input do not raise errors.
+        """
+        self.send('a "quoted" NEAR(term)')
+        self.assertEqual(self.search('"quoted" NEAR('), ['a "quoted" NEAR(term)'])
+
+    def test_message_content_filter(self):
+        """
+        Test that the message_content filter goes through the search backend.
+        """
+        self.send('budget review')
+        self.send('holiday photos')
+        response = self.client.get('/api/messages/', {'message_content': 'budget'})
+        self.assertEqual(response.data['count'], 1)
+
+    def test_ordering_uses_the_view_ordering_fields(self):
+        """
+        Test that `?ordering=` accepts the view's ordering_fields now that
+        the list goes through the filterset.
+        """
+        self.send('from bob', sender=self.other)
+        self.send('from alice')
+        for ordering, expected in (
+            ('sender__first_name', ['from alice', 'from bob']),
+            ('-sender__first_name', ['from bob', 'from alice']),
+            ('sent_at', ['from bob', 'from alice']),
+        ):
+            response = self.client.get('/api/messages/', {'ordering': ordering})
+            self.assertEqual(response.status_code, status.HTTP_200_OK, ordering)
+            self.assertEqual([row['message_body'] for row in response.data['results']], expected)
+
+
+class ConditionalGetTestCase(TestCase):
+    """
+    Test case for ETag / If-None-Match support on list endpoints.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('alice')
+        self.other = create_user('bob')
+        self.client.force_authenticate(user=self.user)
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        self.message = Message.objects.create(
+            sender=self.user, conversation=self.conversation, message_body='Hi'
+        )
+
+    def revalidate(self, url, params=None):
+        """
+        Fetch a URL, then repeat the request with the returned ETag.
+        """
+        first = self.client.get(url, params)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        return first['ETag'], lambda: self.client.get(url, params, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    def test_unchanged_lists_return_304_without_rendering(self):
+        """
+        Test that a matching If-None-Match answers 304 from the version query alone.
+        """
+        for url, params in (
+            ('/api/conversations/', None),
+            ('/api/messages/', None),
+            ('/api/messages/', {'conversation_id': str(self.conversation.pk)}),
+            (f'/api/conversations/{self.conversation.pk}/messages/', None),
+        ):
+            etag, again = self.revalidate(url, params)
+            with CaptureQueriesContext(connection) as queries:
+                response = again()
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, url)
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(len(queries), 1, url)
+
+    def test_new_message_changes_etag(self):
+        """
+        Test that sending a message invalidates the inbox and conversation tags.
+        """
+        _, inbox_again = self.revalidate('/api/conversations/')
+        _, messages_again = self.revalidate('/api/messages/', {'conversation_id': str(self.conversation.pk)})
+        Message.objects.create(sender=self.user, conversation=self.conversation, message_body='Again')
+        self.assertEqual(inbox_again().status_code, status.HTTP_200_OK)
+        self.assertEqual(messages_again().status_code, status.HTTP_200_OK)
+
+    def test_edit_delete_and_participants_change_etag(self):
+        """
+        Test that edits, deletes and membership changes invalidate the tag.
+        """
+        url = f'/api/conversations/{self.conversation.pk}/messages/'
+        _, again = self.revalidate(url)
+        self.message.message_body = 'Edited'
+        self.message.save()
+        self.assertEqual(again().status_code, status.HTTP_200_OK)
+
+        _, again = self.revalidate('/api/conversations/')
+        self.conversation.participants.add(self.other)
+        self.assertEqual(again().status_code, status.HTTP_200_OK)
+
+        _, again = self.revalidate(url)
+        self.message.delete()
+        self.assertEqual(again().status_code, status.HTTP_200_OK)
+
+    def test_old_message_edit_keeps_inbox_order(self):
+        """
+        Test that editing an older message changes the tags but neither the
+        preview nor the conversation's place in the inbox.
+        """
+        newer = Conversation.objects.create()
+        newer.participants.add(self.user)
+        latest = Message.objects.create(sender=self.user, conversation=self.conversation, message_body='Latest')
+        Message.objects.create(sender=self.user, conversation=newer, message_body='Newer')
+        updated_at = Conversation.objects.get(pk=self.conversation.pk).updated_at
+
+        _, inbox_again = self.revalidate('/api/conversations/')
+        _, messages_again = self.revalidate('/api/messages/', {'conversation_id': str(self.conversation.pk)})
+        self.message.message_body = 'Edited'
+        self.message.save()
+        self.assertEqual(messages_again().status_code, status.HTTP_200_OK)
+        response = inbox_again()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [row['conversation_id'] for row in response.data['results']],
+            [str(newer.pk), str(self.conversation.pk)]
+        )
+        conversation = Conversation.objects.get(pk=self.conversation.pk)
+        self.assertEqual(conversation.updated_at, updated_at)
+        self.assertEqual(conversation.last_message_preview, 'Latest')
+
+        latest.message_body = 'Latest, edited'
+        latest.save()
+        conversation = Conversation.objects.get(pk=self.conversation.pk)
+        self.assertEqual(conversation.last_message_preview, 'Latest, edited')
+        self.assertEqual(conversation.updated_at, updated_at)
+
+    def test_participant_profile_change_changes_etag(self):
+        """
+        Test that renaming a participant invalidates the tags of lists embedding them,
+        while saves of fields they do not show leave the tags alone.
+        """
+        self.conversation.participants.add(self.other)
+        url = f'/api/conversations/{self.conversation.pk}/messages/'
+        _, inbox_again = self.revalidate('/api/conversations/')
+        _, messages_again = self.revalidate(url)
+
+        self.other.last_login = timezone.now()
+        self.other.save(update_fields=['last_login'])
+        self.assertEqual(inbox_again().status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.other.first_name = 'Robert'
+        self.other.save()
+        response = inbox_again()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('Robert', [user['first_name'] for user in response.data['results'][0]['participants']])
+        self.assertEqual(messages_again().status_code, status.HTTP_200_OK)
+
+    def test_etag_depends_on_query_and_user(self):
+        """
+        Test that different pages and users never share an ETag.
+        """
+        etag, _ = self.revalidate('/api/messages/')
+        other_page, _ = self.revalidate('/api/messages/', {'page_size': 5})
+        self.assertNotEqual(etag, other_page)
+
+        self.conversation.participants.add(self.other)
+        self.client.force_authenticate(user=self.other)
+        response = self.client.get('/api/messages/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class MessageRowSerializerTestCase(TestCase):
+    """
+    Test case for the fast read path used by message lists.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('alice')
+        self.other = create_user('bob', phone_number='555-0100')
+        self.client.force_authenticate(user=self.user)
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        for i in range(4):
+            Message.objects.create(
+                sender=self.user if i % 2 else self.other,
+                conversation=self.conversation,
+                message_body=f'Message {i}'
+            )
+
+    def test_output_matches_message_serializer(self):
+        """
+        Test that both list endpoints render exactly what MessageSerializer would.
+        """
+        messages = Message.objects.filter(conversation=self.conversation).select_related('sender')
+        expected = json.loads(JSONRenderer().render(
+            MessageSerializer(messages.order_by('sent_at', 'message_id'), many=True).data
+        ))
+
+        response = self.client.get(f'/api/conversations/{self.conversation.pk}/messages/')
+        self.assertEqual(json.loads(response.getvalue())['results'], expected)
+
+        response = self.client.get('/api/messages/')
+        self.assertEqual(json.loads(response.getvalue())['results'], expected[::-1])
+
+    def test_compact_sender_format(self):
+        """
+        Test that the compact shape sends each sender once.
+        """
+        response = self.client.get('/api/messages/', {'sender_format': 'compact'})
+        body = json.loads(response.getvalue())
+        self.assertEqual(
+            {row['sender'] for row in body['results']},
+            {str(self.user.pk), str(self.other.pk)}
+        )
+        self.assertEqual(body['senders'][str(self.other.pk)]['phone_number'], '555-0100')
+        self.assertNotIn('password', body['senders'][str(self.user.pk)])
+
+    def test_benchmark_command(self):
+        """
+        Test that the benchmark runs and leaves no data behind.
+        """
+        stdout = StringIO()
+        call_command('benchmark_message_serializers', page_size=10, rounds=1, stdout=stdout)
+        self.assertIn('MessageRowSerializer', stdout.getvalue())
+        self.assertEqual(Message.objects.count(), 4)
+
+
+class UpdatesFeedTestCase(TestCase):
+    """
+    Test case for the long-poll updates feed.
+    """
+
+    def setUp(self):
+        self.user = create_user('alice')
+        self.other = create_user('bob')
+        self.outsider = create_user('carol')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversation = Conversation.objects.create()
+            self.conversation.participants.add(self.user, self.other)
+            self.hidden = Conversation.objects.create()
+            self.hidden.participants.add(self.outsider)
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def publish(self, func):
+        """
+        Run a write and its on-commit feed inserts from async code.
+        """
+        def run():
+            with self.captureOnCommitCallbacks(execute=True):
+                return func()
+        return sync_to_async(run)()
+
+    async def poll(self, **params):
+        response = await self.async_client.get('/api/updates/', params, headers=self.headers)
+        return response.status_code, json.loads(response.content)
+
+    async def test_requires_authentication(self):
+        response = await self.async_client.get('/api/updates/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_returns_changes_since_cursor(self):
+        """
+        Test that the feed returns the user's changes after the cursor, and nothing else.
+        """
+        _, start = await self.poll()
+        message = await self.publish(lambda: Message.objects.create(
+            sender=self.user, conversation=self.conversation, message_body='Hi'
+        ))
+        await self.publish(lambda: Message.objects.create(
+            sender=self.outsider, conversation=self.hidden, message_body='Secret'
+        ))
+
+        code, page = await self.poll(cursor=start['cursor'], timeout=0)
+        self.assertEqual(code, status.HTTP_200_OK)
+        self.assertEqual([event['type'] for event in page['events']], ['message.created'])
+        self.assertEqual(page['events'][0]['message']['message_id'], str(message.pk))
+        self.assertEqual(page['cursor'], page['events'][0]['id'])
+
+        code, page = await self.poll(cursor=page['cursor'], timeout=0)
+        self.assertEqual(page['events'], [])
+
+    async def test_membership_changes_reach_removed_user(self):
+        """
+        Test that a user removed from a conversation still hears about it.
+        """
+        _, start = await self.poll()
+        await self.publish(lambda: self.conversation.participants.remove(self.user))
+        _, page = await self.poll(cursor=start['cursor'], timeout=0)
+        self.assertEqual([event['type'] for event in page['events']], ['participant.removed'])
+        self.assertEqual(page['events'][0]['user_id'], str(self.user.pk))
+
+    async def test_blocks_until_a_change(self):
+        """
+        Test that an idle poll is woken by a new message, and times out otherwise.
+        """
+        _, start = await self.poll()
+        code, page = await self.poll(cursor=start['cursor'], timeout=0.2)
+        self.assertEqual((code, page['events']), (status.HTTP_200_OK, []))
+
+        waiting = asyncio.ensure_future(self.poll(cursor=start['cursor'], timeout=10))
+        while not len(hub):
+            await asyncio.sleep(0.01)
+        await self.publish(lambda: Message.objects.create(
+            sender=self.other, conversation=self.conversation, message_body='Wake up'
+        ))
+        _, page = await asyncio.wait_for(waiting, 5)
+        self.assertEqual(page['events'][0]['message']['message_body'], 'Wake up')
+
+    async def test_expired_cursor(self):
+        """
+        Test that a cursor before the retained events answers 410 Gone.
+        """
+        await self.publish(lambda: Message.objects.create(
+            sender=self.user, conversation=self.conversation, message_body='Hi'
+        ))
+        await sync_to_async(call_command)('prune_change_events', keep=1, stdout=StringIO())
+        code, _ = await self.poll(cursor=0, timeout=0)
+        self.assertEqual(code, status.HTTP_410_GONE)
+
+
+class CachedJWTAuthenticationTestCase(TestCase):
+    """
+    Test case for the cached user lookup behind JWT authentication.
+    """
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.client = APIClient()
+        self.user = create_user('alice')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def count_queries(self, path='/api/auth/profile/'):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        return len(context.captured_queries), response
+
+    def test_second_request_skips_user_query(self):
+        """
+        Test that a cached user saves the primary-key lookup.
+        """
+        first, response = self.count_queries()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        second, response = self.count_queries()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(second, first - 1)
+        self.assertEqual(metrics.snapshot('auth.jwt'), {
+            'auth.jwt.user_cache.miss': 1,
+            'auth.jwt.user_cache.hit': 1,
+        })
+
+    def test_profile_update_and_deactivation_invalidate(self):
+        """
+        Test that saving the user drops the cached copy.
+        """
+        self.count_queries()
+        response = self.client.patch('/api/auth/profile/update/', {'first_name': 'Alicia'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        _, response = self.count_queries()
+        self.assertEqual(response.data['first_name'], 'Alicia')
+
+        self.user.is_active = False
+        self.user.save()
+        _, response = self.count_queries()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        """
+        Test that the metrics report is restricted to staff.
+        """
+        _, response = self.count_queries('/api/auth/metrics/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        staff = create_user('admin', is_staff=True)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(staff)}')
+        self.count_queries()
+        _, response = self.count_queries('/api/auth/metrics/')
+        self.assertEqual(response.data['jwt_user_cache']['requests'], 3)
+        self.assertEqual(response.data['jwt_user_cache']['queries_saved'], 1)
+
+
+class CachedBasicAuthenticationTestCase(TestCase):
+    """
+    Test case for the Basic auth credential cache and per-endpoint
+    authentication classes.
+    """
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.client = APIClient()
+        self.user = create_user('alice')
+        self.login('password123')
+
+    def login(self, password):
+        credentials = base64.b64encode(f'{self.user.email}:{password}'.encode()).decode()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Basic {credentials}')
+
+    def test_verified_credentials_skip_the_hasher(self):
+        """
+        Test that only the first request with the same credentials checks the password.
+        """
+        with mock.patch('django.contrib.auth.base_user.check_password', wraps=check_password) as checked:
+            for _ in range(3):
+                response = self.client.get('/api/auth/profile/')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(checked.call_count, 1)
+        self.assertEqual(metrics.snapshot('auth.basic'), {
+            'auth.basic.credential_cache.miss': 1,
+            'auth.basic.credential_cache.hit': 2,
+        })
+
+    def test_wrong_password_is_not_cached(self):
+        """
+        Test that failed logins are rejected every time.
+        """
+        self.login('wrong-password')
+        for _ in range(2):
+            response = self.client.get('/api/auth/profile/')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(metrics.snapshot('auth.basic.credential_cache.hit'), {})
+
+    def test_password_change_invalidates(self):
+        """
+        Test that the old password stops working after a password change.
+        """
+        self.assertEqual(self.client.get('/api/auth/profile/').status_code, status.HTTP_200_OK)
+        response = self.client.post('/api/auth/profile/change-password/', {
+            'old_password': 'password123',
+            'new_password': 'new-password456',
+            'new_password_confirm': 'new-password456',
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get('/api/auth/profile/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.login('new-password456')
+        response = self.client.get('/api/auth/profile/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_every_scheme_works_by_default(self):
+        """
+        Test that without API_AUTHENTICATION_CLASSES entries the hot read
+        endpoints accept Basic and session clients as well as tokens.
+        """
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user)
+        paths = (
+            '/api/conversations/',
+            f'/api/conversations/{conversation.pk}/messages/',
+            '/api/messages/',
+            '/api/users/autocomplete/?q=ali',
+        )
+        for path in paths:
+            self.assertEqual(self.client.get(path).status_code, status.HTTP_200_OK, path)
+
+        session = APIClient(enforce_csrf_checks=True)
+        session.login(email=self.user.email, password='password123')
+        for path in paths:
+            self.assertEqual(session.get(path).status_code, status.HTTP_200_OK, path)
+
+    @override_settings(API_AUTHENTICATION_CLASSES={
+        'conversation.list': ['chats.authentication.CachedJWTAuthentication'],
+    })
+    def test_hot_read_endpoints_only_accept_jwt(self):
+        """
+        Test that endpoints configured for JWT only ignore Basic credentials.
+        """
+        response = self.client.get('/api/conversations/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post('/api/conversations/', {
+            'participant_ids': [str(self.user.user_id), str(create_user('bob').user_id)]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        response = self.client.get('/api/conversations/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(REVOKED_TOKENS_CHECK_INTERVAL=3600)
+class RevokedTokenIndexTestCase(TestCase):
+    """
+    Test case for the in-process index of blacklisted refresh tokens.
+    """
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        revoked_tokens.reset()
+        self.client = APIClient()
+        self.user = create_user('alice')
+        self.refresh = IndexedRefreshToken.for_user(self.user)
+
+    def post(self, path, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(path, data, format='json')
+        blacklist_reads = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('SELECT') and 'token_blacklist_blacklistedtoken' in query['sql']
+        ]
+        return response, blacklist_reads
+
+    def test_refresh_rotates_and_rejects_reuse(self):
+        """
+        Test that a rotated refresh token is revoked without reading the
+        blacklist, and that its own revocation is not read back.
+        """
+        revoked_tokens.current()
+        response, reads = self.post('/api/auth/token/refresh/', {'refresh': str(self.refresh)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(reads, [])
+
+        response, reads = self.post('/api/auth/token/refresh/', {'refresh': str(self.refresh)})
+        # The generation bump's sync, then the exact check of the filter's hit
+        self.assertEqual(len(reads), 2)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(metrics.snapshot('auth.revoked_tokens'), {
+            'auth.revoked_tokens.skipped': 1,
+            'auth.revoked_tokens.checked': 1,
+        })
+
+    def test_logout_revokes_refresh_token(self):
+        """
+        Test that logging out blacklists the refresh token.
+        """
+        self.client.force_authenticate(self.user)
+        response, _ = self.post('/api/auth/logout/', {'refresh': str(self.refresh)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response, _ = self.post('/api/auth/token/refresh/', {'refresh': str(self.refresh)})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_other_processes_sync_incrementally(self):
+        """
+        Test that another process's index picks up a revocation through the
+        cache generation, reading only the new blacklist rows.
+        """
+        other = RevokedTokenIndex()
+        jti = self.refresh['jti']
+        self.assertFalse(other.is_revoked(jti))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.refresh.blacklist()
+        with self.assertNumQueries(2):
+            # The sync, then the exact check of the Bloom filter's hit
+            self.assertTrue(other.is_revoked(jti))
+        with self.assertNumQueries(0):
+            self.assertFalse(other.is_revoked('not-a-revoked-jti'))
+
+    def test_revocations_are_seen_without_a_shared_cache(self):
+        """
+        Test that a revocation whose generation bump never reached this
+        process's cache is picked up from the blacklist table once
+        REVOKED_TOKENS_CHECK_INTERVAL has passed.
+        """
+        jti = self.refresh['jti']
+        response, _ = self.post('/api/auth/token/verify/', {'token': str(self.refresh)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Blacklisted by another worker: neither this index nor the cache
+        # generation hears about it
+        token = OutstandingToken.objects.get(jti=jti)
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=token)])
+        self.assertEqual(current_generation(), revoked_tokens.generation)
+        with self.assertNumQueries(0):
+            self.assertFalse(revoked_tokens.is_revoked(jti))
+        with override_settings(REVOKED_TOKENS_CHECK_INTERVAL=0):
+            self.assertTrue(revoked_tokens.is_revoked(jti))
+            response, _ = self.post('/api/auth/token/verify/', {'token': str(self.refresh)})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rows_committed_out_of_id_order_are_not_skipped(self):
+        """
+        Test that a blacklist row appearing below an ID already read is
+        still picked up by a later sync.
+        """
+        revoked_tokens.current()
+        first, second = IndexedRefreshToken.for_user(self.user), IndexedRefreshToken.for_user(self.user)
+        # This process revokes `second` under the next ID but one, while
+        # another worker's transaction holding the next ID is still open
+        latest = revoked_tokens.max_id
+        late = BlacklistedToken(id=latest + 1, token=OutstandingToken.objects.get(jti=first['jti']))
+        revoked_tokens.add(second['jti'], latest + 2)
+        self.assertEqual(revoked_tokens.pending, {latest + 1})
+
+        BlacklistedToken.objects.bulk_create([late])
+        bump_generation()
+        self.assertTrue(revoked_tokens.is_revoked(first['jti']))
+        self.assertEqual(revoked_tokens.pending, set())
+
+    @override_settings(REVOKED_TOKENS_COMPACT_INTERVAL=0)
+    def test_compaction_drops_expired_tokens(self):
+        """
+        Test that rebuilding the index leaves out expired tokens.
+        """
+        self.refresh.blacklist()
+        self.assertIn(self.refresh['jti'], revoked_tokens.current())
+        OutstandingToken.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertNotIn(self.refresh['jti'], revoked_tokens.current())
+
+
+class ConnectionPoolTestCase(TestCase):
+    """
+    Test case for the pooled database backends, against a throwaway SQLite file.
+    """
+
+    def setUp(self):
+        close_pools()
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+
+    def tearDown(self):
+        close_pools()
+        os.remove(self.path)
+
+    def wrapper(self, **pool):
+        settings_dict = dict(connection.settings_dict, NAME=self.path, OPTIONS={'pool': pool or True})
+        return PooledSQLiteWrapper(settings_dict, alias='pool-test')
+
+    def test_closed_connection_is_reused(self):
+        """
+        Test that closing returns the connection and the next connect reuses it.
+        """
+        db = self.wrapper()
+        db.ensure_connection()
+        raw = db.connection
+        db.close()
+        db.ensure_connection()
+        self.assertIs(db.connection, raw)
+        db.close()
+        stats = pool_stats()['pool-test']
+        self.assertEqual((stats['created'], stats['reused'], stats['idle'], stats['in_use']), (1, 1, 1, 0))
+
+    def test_connection_left_in_transaction_is_discarded(self):
+        """
+        Test that a connection whose transaction was not finished is not pooled.
+        """
+        db = self.wrapper()
+        db.set_autocommit(False)
+        db.close()
+        stats = pool_stats()['pool-test']
+        self.assertEqual((stats['size'], stats['closed']), (0, 1))
+
+    def test_failed_health_check_replaces_connection(self):
+        """
+        Test that a dead idle connection is replaced instead of handed out.
+        """
+        db = self.wrapper(health_check_after=0)
+        db.ensure_connection()
+        raw = db.connection
+        db.close()
+        raw.close()
+        db.ensure_connection()
+        self.assertIsNot(db.connection, raw)
+        with db.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        self.assertEqual(pool_stats()['pool-test']['failed_health_checks'], 1)
+
+    def test_idle_connections_are_evicted(self):
+        """
+        Test that connections idle for longer than max_idle are closed.
+        """
+        db = self.wrapper(max_idle=0)
+        db.ensure_connection()
+        db.close()
+        stats = pool_stats()['pool-test']
+        self.assertEqual((stats['size'], stats['evicted']), (0, 1))
+
+    def test_exhausted_pool_times_out(self):
+        """
+        Test that a worker never opens more than max_size connections.
+        """
+        first, second = self.wrapper(max_size=1, timeout=0), self.wrapper(max_size=1, timeout=0)
+        first.ensure_connection()
+        with self.assertRaises(PoolTimeout):
+            second.ensure_connection()
+        first.close()
+        second.ensure_connection()
+        second.close()
+        self.assertEqual(pool_stats()['pool-test']['timeouts'], 1)
+
+    def test_stats_endpoint_is_staff_only(self):
+        """
+        Test that pool statistics are only reported to staff.
+        """
+        client = APIClient()
+        client.force_authenticate(create_user('alice'))
+        self.assertEqual(client.get('/api/metrics/db-pool/').status_code, status.HTTP_403_FORBIDDEN)
+        client.force_authenticate(create_user('admin', is_staff=True))
+        self.wrapper().ensure_connection()
+        response = client.get('/api/metrics/db-pool/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['pool-test']['in_use'], 1)
+
+
+class ReplicaRouterTestCase(TestCase):
+    """
+    Test case for routing reads to replicas with read-your-writes pinning.
+
+    The replica is a second database (declared in messaging_app.test_settings)
+    that never receives writes, i.e. a replica lagging indefinitely;
+    `replicate` copies rows to it.
+    """
+    replica = 'test_replica_1'
+    databases = {'default', replica}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replicas = override_settings(REPLICA_DATABASES=[cls.replica])
+        cls.replicas.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.replicas.disable()
+        search_backends.pop(cls.replica, None)
+
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def replicate(self):
+        """
+        Copy the primary's users, conversations and memberships to the replica.
+        """
+        for model in (User, Conversation, ConversationParticipant):
+            model.objects.using(self.replica).all().delete()
+            model.objects.using(self.replica).bulk_create(list(model.objects.using('default')))
+
+    def conversation_count(self):
+        response = self.client.get('/api/conversations/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['count']
+
+    def test_reads_outside_requests_use_primary(self):
+        """
+        Test that management commands and shells never read from a replica.
+        """
+        self.assertEqual(self.router.db_for_read(Message), 'default')
+
+    def test_resolved_user_reads_from_replica_until_a_write(self):
+        """
+        Test that a safe request reads from a replica once its user is known,
+        and from the primary after it writes.
+        """
+        request = RequestFactory().get('/api/messages/')
+        with routing(request, replicas_allowed=True):
+            self.assertEqual(self.router.db_for_read(Message), 'default')
+            request.user = self.alice
+            self.assertEqual(self.router.db_for_read(Message), self.replica)
+            self.assertEqual(self.router.db_for_write(Message), 'default')
+            self.assertEqual(self.router.db_for_read(Message), 'default')
+
+    def test_writer_is_pinned_to_primary(self):
+        """
+        Test that list reads see the lagging replica, except for a user who just wrote.
+        """
+        self.assertEqual(self.conversation_count(), 0)
+        response = self.client.post('/api/conversations/', {
+            'participant_ids': [str(self.alice.user_id), str(self.bob.user_id)]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.conversation_count(), 2)
+
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.conversation_count(), 0)
+
+        cache.clear()
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.conversation_count(), 0)
+
+    def test_membership_is_cached_from_the_primary(self):
+        """
+        Test that membership changes apply at once even while the replica lags.
+        """
+        self.replicate()
+        url = '/api/messages/'
+
+        # Bob was added on the primary only
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.alice, self.bob)
+        self.client.force_authenticate(self.bob)
+        response = self.client.get(url, {'conversation_id': conversation.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Bob was removed on the primary only
+        self.conversation.participants.remove(self.bob)
+        response = self.client.get(url, {'conversation_id': self.conversation.pk})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(is_participant(self.bob, self.conversation))
+
+
+class MessageArchiveTestCase(TestCase):
+    """
+    Test case for archiving old messages and reading through to the archive.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('alice')
+        self.client.force_authenticate(user=self.user)
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        # Messages 0-3 are old enough to archive, 4-5 are recent
+        for i in range(6):
+            message = Message.objects.create(
+                sender=self.user,
+                conversation=self.conversation,
+                message_body=f'Message {i}'
+            )
+            age = timedelta(days=200 - i) if i < 4 else timedelta(minutes=10 - i)
+            Message.objects.filter(pk=message.pk).update(sent_at=timezone.now() - age)
+        self.url = f'/api/conversations/{self.conversation.conversation_id}/messages/'
+
+    def archive(self, **options):
+        call_command('archive_messages', days=90, batch_size=3, stdout=StringIO(), **options)
+
+    def test_archive_moves_old_messages_in_batches(self):
+        """
+        Test that an interrupted run resumes and old bodies are stored compressed.
+        """
+        self.archive(max_batches=1)
+        self.assertEqual(ArchivedMessage.objects.count(), 3)
+        self.archive()
+        self.assertEqual(
+            list(ArchivedMessage.objects.values_list('message_body', flat=True)),
+            [f'Message {i}' for i in range(4)]
+        )
+        self.assertEqual(
+            list(Message.objects.values_list('message_body', flat=True)),
+            ['Message 4', 'Message 5']
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT message_body FROM chats_message_archive')
+            self.assertIsInstance(bytes(cursor.fetchone()[0]), bytes)
+        self.assertEqual(Conversation.objects.get(pk=self.conversation.pk).message_count, 6)
+
+    def test_listing_reads_through_to_the_archive(self):
+        """
+        Test that pages span both tables and newest-first pages only read
+        the archive once the hot messages run out.
+        """
+        self.archive()
+        response = self.client.get(self.url)
+        self.assertEqual(
+            [row['message_body'] for row in response.data['results']],
+            [f'Message {i}' for i in range(6)]
+        )
+        self.assertEqual(response.data['count'], 6)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'pagination': 'cursor', 'page_size': 1})
+        self.assertFalse(any('chats_message_archive' in query['sql'] for query in queries.captured_queries))
+        bodies = [row['message_body'] for row in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            bodies += [row['message_body'] for row in response.data['results']]
+        self.assertEqual(bodies, [f'Message {i}' for i in reversed(range(6))])
+
+        response = self.client.get(self.url, {'stream': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['message_body'] for row in rows], [f'Message {i}' for i in range(6)])
+
+    def test_message_list_scoped_to_a_conversation_reads_the_archive(self):
+        """
+        Test that /api/messages/?conversation_id= pages, cursors, filters and
+        sender search cover archived messages, while body searches only
+        match hot ones.
+        """
+        self.archive()
+        url = '/api/messages/'
+        scoped = {'conversation_id': str(self.conversation.conversation_id)}
+        newest_first = [f'Message {i}' for i in reversed(range(6))]
+
+        def bodies(params):
+            response = self.client.get(url, dict(scoped, **params))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [row['message_body'] for row in response.data['results']]
+
+        response = self.client.get(url, dict(scoped, page_size=4, page=2))
+        self.assertEqual(response.data['count'], 6)
+        self.assertEqual([row['message_body'] for row in response.data['results']], newest_first[4:])
+
+        response = self.client.get(url, dict(scoped, pagination='cursor', page_size=4))
+        walked = [row['message_body'] for row in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            walked += [row['message_body'] for row in response.data['results']]
+        self.assertEqual(walked, newest_first)
+
+        cutoff = (timezone.now() - timedelta(days=150)).isoformat()
+        self.assertEqual(bodies({'sent_before': cutoff}), newest_first[2:])
+        self.assertEqual(bodies({'sender_name': 'Alice'}), newest_first)
+        self.assertEqual(bodies({'ordering': 'sent_at'}), newest_first[::-1])
+        self.assertEqual(bodies({'search': 'alice'}), newest_first)
+        self.assertEqual(sorted(bodies({'search': 'message'})), ['Message 4', 'Message 5'])
+        self.assertEqual(bodies({'message_body__icontains': 'Message'}), newest_first[:2])
+
+    def test_archiving_changes_the_inbox_etag(self):
+        """
+        Test that the inbox-wide message list, which reads hot messages only,
+        is not answered 304 after archiving.
+        """
+        first = self.client.get('/api/messages/')
+        self.assertEqual(first.data['count'], 6)
+        self.archive()
+        response = self.client.get('/api/messages/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+
+    def test_page_numbers_offset_each_tier_in_sql(self):
+        """
+        Test that numbered pages use OFFSET on each table instead of loading
+        every earlier row, including pages that straddle both tables.
+        """
+        self.archive()
+
+        def page(number, size):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.url, {'page': number, 'page_size': size})
+            selects = {
+                'archive' if 'chats_message_archive' in query['sql'] else 'hot': query['sql']
+                for query in queries.captured_queries if 'LIMIT' in query['sql']
+            }
+            return [row['message_body'] for row in response.data['results']], selects
+
+        self.assertEqual(page(1, 3)[0], ['Message 0', 'Message 1', 'Message 2'])
+        self.assertEqual(page(2, 3)[0], ['Message 3', 'Message 4', 'Message 5'])
+        bodies, selects = page(3, 2)
+        self.assertEqual(bodies, ['Message 4', 'Message 5'])
+        self.assertIn('LIMIT 2 OFFSET 4', selects['archive'])
+        self.assertNotIn('OFFSET', selects['hot'])
+
+    def test_last_message_falls_back_to_the_archive(self):
+        """
+        Test that deleting every hot message makes the newest archived one the last message.
+        """
+        self.archive()
+        Message.objects.get(message_body='Message 5').delete()
+        Message.objects.get(message_body='Message 4').delete()
+        conversation = Conversation.objects.get(pk=self.conversation.pk)
+        self.assertEqual(conversation.last_message_preview, 'Message 3')
+
+
+class ReadStateTestCase(TestCase):
+    """
+    Test case for per-participant read cursors and maintained unread counts.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.alice)
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        self.messages = [
+            Message.objects.create(sender=self.bob, conversation=self.conversation, message_body=f'Message {i}')
+            for i in range(3)
+        ]
+
+    def state(self, user):
+        return ConversationParticipant.objects.get(conversation=self.conversation, user=user)
+
+    def test_new_messages_count_as_unread_for_others(self):
+        """
+        Test that recipients' counts grow while the sender's cursor follows their own messages.
+        """
+        self.assertEqual(self.state(self.alice).unread_count, 3)
+        self.assertEqual(self.state(self.bob).unread_count, 0)
+        self.assertEqual(self.state(self.bob).last_read_message_id, self.messages[-1].message_id)
+
+        response = self.client.post('/api/messages/bulk_send/', {'messages': [
+            {'conversation_id': str(self.conversation.pk), 'message_body': 'Reply'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.state(self.alice).unread_count, 0)
+        self.assertEqual(self.state(self.bob).unread_count, 1)
+
+    def test_conversation_list_and_total(self):
+        """
+        Test that the list shows badges and the total needs no message queries.
+        """
+        response = self.client.get('/api/conversations/')
+        self.assertEqual(response.data['results'][0]['unread_count'], 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/conversations/unread/')
+        self.assertEqual(response.data, {'total_unread': 3, 'unread_conversations': 1})
+        self.assertFalse(any('chats_message' in query['sql'] for query in queries.captured_queries))
+
+    def test_mark_conversation_read_is_one_update(self):
+        """
+        Test that marking a conversation read is a single row update and changes the inbox ETag.
+        """
+        etag = self.client.get('/api/conversations/')['ETag']
+        url = f'/api/conversations/{self.conversation.pk}/mark_read/'
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['unread_count'], 0)
+        self.assertEqual(response.data['last_read_message_id'], self.messages[-1].message_id)
+        self.assertEqual(len([query for query in queries.captured_queries if query['sql'].startswith('UPDATE')]), 1)
+
+        response = self.client.get('/api/conversations/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['unread_count'], 0)
+
+        self.client.force_authenticate(user=create_user('carol'))
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_mark_message_read_moves_cursor_forward(self):
+        """
+        Test that reading an older message leaves later ones unread and never moves back.
+        """
+        url = f'/api/messages/{self.messages[0].message_id}/mark_as_read/'
+        response = self.client.patch(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['unread_count'], 2)
+
+        self.client.patch(f'/api/messages/{self.messages[2].message_id}/mark_as_read/')
+        self.assertEqual(self.state(self.alice).unread_count, 0)
+        self.client.patch(url)
+        self.assertEqual(self.state(self.alice).last_read_message_id, self.messages[2].message_id)
+
+    def test_deleting_unread_message_decrements(self):
+        """
+        Test that deleting a message only lowers the counts of those who had not read it.
+        """
+        self.client.patch(f'/api/messages/{self.messages[1].message_id}/mark_as_read/')
+        self.assertEqual(self.state(self.alice).unread_count, 1)
+        self.messages[0].delete()
+        self.assertEqual(self.state(self.alice).unread_count, 1)
+        self.messages[2].delete()
+        self.assertEqual(self.state(self.alice).unread_count, 0)
+
+
+class MessageShardingTestCase(TestCase):
+    """
+    Test case for sharding messages by conversation over several databases.
+    The shards are declared in messaging_app.test_settings.
+    """
+    shards = ['test_shard_1', 'test_shard_2', 'test_shard_3']
+    databases = {'default', *shards}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sharding = override_settings(MESSAGE_SHARDS=cls.shards)
+        cls.sharding.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.sharding.disable()
+        for alias in cls.shards:
+            search_backends.pop(alias, None)
+
+    def setUp(self):
+        cache.clear()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+        # Two conversations whose messages live on different shards
+        self.conversations = []
+        while len({shard_for(conversation.pk) for conversation in self.conversations}) < 2:
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.alice, self.bob)
+            if shard_for(conversation.pk) not in {shard_for(other.pk) for other in self.conversations}:
+                self.conversations.append(conversation)
+
+    def send(self, conversation, body, user=None, minutes_ago=0):
+        message = Message.objects.create(
+            sender=user or self.alice,
+            conversation=conversation,
+            message_body=body
+        )
+        if minutes_ago:
+            message.sent_at = timezone.now() - timedelta(minutes=minutes_ago)
+            message.save(update_fields=['sent_at'])
+        return message
+
+    def test_messages_are_stored_on_their_conversations_shard(self):
+        """
+        Test that creating a message writes it to its conversation's shard only.
+        """
+        response = self.client.post('/api/messages/send_message/', {
+            'conversation_id': str(self.conversations[0].pk),
+            'message_body': 'Hello'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        home = shard_for(self.conversations[0].pk)
+        self.assertEqual(Message.objects.using(home).count(), 1)
+        for alias in ['default', *self.shards]:
+            if alias != home:
+                self.assertFalse(Message.objects.using(alias).exists())
+        self.assertEqual(Conversation.objects.get(pk=self.conversations[0].pk).message_count, 1)
+
+        Conversation.objects.update(message_count=0)
+        call_command('backfill_conversation_activity', stdout=StringIO())
+        conversation = Conversation.objects.get(pk=self.conversations[0].pk)
+        self.assertEqual((conversation.message_count, conversation.last_message_preview), (1, 'Hello'))
+
+    def test_conversation_messages_come_from_its_shard(self):
+        """
+        Test that the messages action reads the conversation's shard, with senders.
+        """
+        self.send(self.conversations[0], 'First', minutes_ago=2)
+        self.send(self.conversations[0], 'Second', user=self.bob, minutes_ago=1)
+        self.send(self.conversations[1], 'Elsewhere')
+
+        response = self.client.get(f'/api/conversations/{self.conversations[0].pk}/messages/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['message_body'] for row in response.data['results']], ['First', 'Second'])
+        self.assertEqual(response.data['results'][1]['sender']['email'], self.bob.email)
+
+    def test_message_list_merges_shards_by_sent_at(self):
+        """
+        Test that the message list scatters over shards and pages in sent_at order.
+        """
+        for minutes_ago, conversation in enumerate([0, 1, 0, 1, 0]):
+            self.send(self.conversations[conversation], f'Message {minutes_ago}', minutes_ago=minutes_ago + 1)
+
+        response = self.client.get('/api/messages/', {'page_size': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(
+            [row['message_body'] for row in response.data['results']],
+            ['Message 0', 'Message 1', 'Message 2']
+        )
+        self.assertEqual(response.data['results'][0]['sender']['user_id'], str(self.alice.user_id))
+
+        bodies = []
+        params = {'pagination': 'cursor', 'page_size': 2}
+        while True:
+            response = self.client.get('/api/messages/', params)
+            bodies += [row['message_body'] for row in response.data['results']]
+            if not response.data['next']:
+                break
+            params['cursor'] = response.data['next'].split('cursor=')[1].split('&')[0]
+        self.assertEqual(bodies, [f'Message {i}' for i in range(5)])
+
+    def test_filters_and_search_span_shards(self):
+        """
+        Test that sender filters and full-text search work across shards.
+        """
+        self.send(self.conversations[0], 'apple pie', minutes_ago=2)
+        self.send(self.conversations[1], 'apple tart', user=self.bob, minutes_ago=1)
+        self.send(self.conversations[1], 'banana', user=self.bob)
+
+        response = self.client.get('/api/messages/', {'search': 'apple'})
+        self.assertEqual(
+            sorted(row['message_body'] for row in response.data['results']),
+            ['apple pie', 'apple tart']
+        )
+        response = self.client.get('/api/messages/', {'sender_name': 'Bob'})
+        self.assertEqual(
+            [row['message_body'] for row in response.data['results']],
+            ['banana', 'apple tart']
+        )
+
+        response = self.client.get('/api/messages/', {'ordering': 'sender__first_name'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_send_routes_each_message(self):
+        """
+        Test that a batch spanning conversations is split across their shards.
+        """
+        response = self.client.post('/api/messages/bulk_send/', {'messages': [
+            {'conversation_id': str(conversation.pk), 'message_body': 'Batch'}
+            for conversation in self.conversations
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        for conversation in self.conversations:
+            self.assertEqual(
+                Message.objects.using(shard_for(conversation.pk)).filter(conversation=conversation).count(),
+                1
+            )
+
+    def test_single_message_endpoints(self):
+        """
+        Test that retrieve, update and delete find the message on its shard.
+        """
+        message = self.send(self.conversations[1], 'Draft')
+        url = f'/api/messages/{message.pk}/'
+
+        self.assertEqual(self.client.get(url).data['message_body'], 'Draft')
+        response = self.client.patch(url, {'message_body': 'Final'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Message.objects.using(shard_for(self.conversations[1].pk)).get().message_body, 'Final')
+
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Message.objects.using(shard_for(self.conversations[1].pk)).exists())
+
+    def test_deletes_reach_the_shards(self):
+        """
+        Test that deleting a conversation or a user deletes their sharded messages.
+        """
+        self.send(self.conversations[0], 'Gone with the conversation')
+        self.send(self.conversations[1], 'Gone with the sender', user=self.bob)
+        self.send(self.conversations[1], 'Kept')
+
+        conversation_id = self.conversations[0].pk
+        self.conversations[0].delete()
+        self.assertFalse(Message.objects.using(shard_for(conversation_id)).filter(
+            conversation_id=conversation_id
+        ).exists())
+
+        self.bob.delete()
+        remaining = Message.objects.using(shard_for(self.conversations[1].pk))
+        self.assertEqual([message.message_body for message in remaining], ['Kept'])
+
+    def test_archive_runs_on_every_shard(self):
+        """
+        Test that archiving moves messages within their shard and listing still finds them.
+        """
+        self.send(self.conversations[0], 'Old', minutes_ago=200 * 24 * 60)
+        self.send(self.conversations[0], 'New')
+        self.send(self.conversations[1], 'Also old', minutes_ago=200 * 24 * 60)
+
+        call_command('archive_messages', days=90, stdout=StringIO())
+        for conversation, body in zip(self.conversations, ['Old', 'Also old']):
+            archived = ArchivedMessage.objects.using(shard_for(conversation.pk))
+            self.assertEqual(list(archived.values_list('message_body', flat=True)), [body])
+
+        response = self.client.get(f'/api/conversations/{self.conversations[0].pk}/messages/')
+        self.assertEqual([row['message_body'] for row in response.data['results']], ['Old', 'New'])
+        self.assertEqual(response.data['results'][0]['sender']['email'], self.alice.email)
+
+        response = self.client.get(f'/api/messages/?conversation_id={self.conversations[0].pk}')
+        self.assertEqual([row['message_body'] for row in response.data['results']], ['New', 'Old'])
+
+
+class UserSearchTestCase(TestCase):
+    """
+    Test case for the user search token index and autocomplete.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.alice = create_user('alice')
+        self.alicia = create_user('alicia')
+        self.rename(self.alice, 'Alice', 'Smith')
+        self.rename(self.alicia, 'Émilie', 'Smithers')
+        self.bob = create_user('bob')
+        self.admin = create_user('admin', is_superuser=True, is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.alice)
+
+    def rename(self, user, first_name, last_name):
+        user.first_name, user.last_name = first_name, last_name
+        user.save()
+
+    def usernames(self, response):
+        return [user['username'] for user in response.data['results']]
+
+    def test_autocomplete_matches_word_prefixes(self):
+        """
+        Test that every query word must start a word, ignoring case and accents.
+        """
+        response = self.client.get('/api/users/autocomplete/', {'q': 'smith'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.usernames(response), ['alice', 'alicia'])
+        self.assertNotIn('email', response.data['results'][0])
+
+        response = self.client.get('/api/users/autocomplete/', {'q': 'EMI smi'})
+        self.assertEqual(self.usernames(response), ['alicia'])
+        # Infix matches are not prefix matches
+        response = self.client.get('/api/users/autocomplete/', {'q': 'mith'})
+        self.assertEqual(self.usernames(response), [])
+
+    def test_autocomplete_limit_and_inactive_users(self):
+        """
+        Test that results are capped by limit and skip deactivated users.
+        """
+        response = self.client.get('/api/users/autocomplete/', {'q': 'ali', 'limit': 1})
+        self.assertEqual(self.usernames(response), ['alice'])
+        response = self.client.get('/api/users/autocomplete/', {'q': 'ali', 'limit': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.alice.is_active = False
+        self.alice.save(update_fields=['is_active'])
+        response = self.client.get('/api/users/autocomplete/', {'q': 'ali'})
+        self.assertEqual(self.usernames(response), ['alicia'])
+
+    def test_index_follows_profile_changes(self):
+        """
+        Test that renames reindex the user and other saves leave the index alone.
+        """
+        self.bob.last_name = 'Builder'
+        self.bob.save()
+        response = self.client.get('/api/users/autocomplete/', {'q': 'build'})
+        self.assertEqual(self.usernames(response), ['bob'])
+
+        with self.assertNumQueries(1):
+            self.bob.last_login = timezone.now()
+            self.bob.save(update_fields=['last_login'])
+
+    def test_search_and_name_filter_use_index(self):
+        """
+        Test that ?search= and ?name= on the user list match word prefixes.
+        """
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get('/api/users/', {'search': 'alicia@example'})
+        self.assertEqual(self.usernames(response), ['alicia'])
+
+        response = self.client.get('/api/users/', {'name': 'smith', 'ordering': 'first_name'})
+        self.assertEqual(self.usernames(response), ['alice', 'alicia'])
+        # Emails are not part of the name
+        response = self.client.get('/api/users/', {'name': 'example'})
+        self.assertEqual(self.usernames(response), [])
+
+        # Queries without a searchable word match nobody rather than everybody
+        response = self.client.get('/api/users/', {'search': '!!!'})
+        self.assertEqual(self.usernames(response), [])
+        response = self.client.get('/api/users/', {'name': '-'})
+        self.assertEqual(self.usernames(response), [])
+
+
+class ParticipantCountTestCase(TestCase):
+    """
+    Test case for the denormalized conversation participant count.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.carol = create_user('carol')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.alice)
+        self.pair = Conversation.objects.create()
+        self.pair.participants.add(self.alice, self.bob)
+        self.group = Conversation.objects.create()
+        self.group.participants.add(self.alice, self.bob, self.carol)
+
+    def count(self, conversation):
+        return Conversation.objects.values_list('participant_count', flat=True).get(pk=conversation.pk)
+
+    def test_count_follows_membership_changes(self):
+        """
+        Test that add, remove, clear, reverse adds and user deletion keep the count exact.
+        """
+        self.assertEqual(self.count(self.pair), 2)
+        self.pair.participants.add(self.bob)
+        self.pair.participants.remove(self.carol)
+        self.assertEqual(self.count(self.pair), 2)
+
+        self.carol.conversations.add(self.pair)
+        self.assertEqual(self.count(self.pair), 3)
+        self.carol.delete()
+        self.assertEqual(self.count(self.pair), 2)
+        self.assertEqual(self.count(self.group), 2)
+
+        self.group.participants.clear()
+        self.assertEqual(self.count(self.group), 0)
+
+    def test_size_filters_use_column(self):
+        """
+        Test that min/max_participants filter on the column without joining participants.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/conversations/', {'min_participants': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['conversation_id'] for row in response.data['results']], [str(self.group.pk)])
+        self.assertEqual(response.data['results'][0]['participant_count'], 3)
+        filtered = [query['sql'] for query in queries if 'participant_count" >=' in query['sql']]
+        self.assertTrue(filtered)
+        self.assertFalse(any('GROUP BY' in sql for sql in filtered))
+
+        response = self.client.get('/api/conversations/', {'max_participants': 2})
+        self.assertEqual([row['conversation_id'] for row in response.data['results']], [str(self.pair.pk)])
+
+    def test_create_returns_count(self):
+        """
+        Test that a created conversation reports its participants including the creator.
+        """
+        response = self.client.post('/api/conversations/', {
+            'participant_ids': [str(self.bob.pk), str(self.carol.pk)]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['participant_count'], 3)
+
+    def test_reconcile_command_repairs_drift(self):
+        """
+        Test that the reconcile command fixes only drifted counts.
+        """
+        Conversation.objects.filter(pk=self.group.pk).update(participant_count=7)
+        out = StringIO()
+        call_command('reconcile_participant_counts', '--dry-run', stdout=out)
+        self.assertIn('Found 1 drifted', out.getvalue())
+        self.assertEqual(self.count(self.group), 7)
+
+        out = StringIO()
+        call_command('reconcile_participant_counts', '--batch-size', '1', stdout=out)
+        self.assertIn('Repaired 1 drifted participant counts in 2 conversations', out.getvalue())
+        self.assertEqual(self.count(self.group), 3)
+
+
+class StreamingJSONRendererTestCase(TestCase):
+    """
+    Test case for incrementally encoded, optionally gzipped list pages.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.alice)
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        Message.objects.bulk_create([
+            Message(sender=self.bob, conversation=self.conversation, message_body=f'Message {i} ' + 'x' * 200)
+            for i in range(30)
+        ])
+
+    def test_chunks_match_json_renderer(self):
+        """
+        Test that chunked encoding is byte-identical to JSONRenderer, escapes included.
+        """
+        renderer = StreamingJSONRenderer()
+        renderer.chunk_size = 10
+        data = {'count': 3, 'next': None, 'results': [{'body': 'a b'}, {'body': 'é'}, {'n': 1.5}]}
+        chunks = list(renderer.render_chunks(data))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), JSONRenderer().render(data))
+
+    @override_settings(API_GZIP_MIN_LENGTH=1024)
+    def test_large_page_streams_gzipped(self):
+        """
+        Test that a page over the threshold streams gzipped with weak ETag and Vary.
+        """
+        response = self.client.get('/api/messages/', {'page_size': 30}, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        body = json.loads(gzip.decompress(response.getvalue()))
+        self.assertEqual(len(body['results']), 30)
+        self.assertEqual(body, json.loads(JSONRenderer().render(response.data)))
+
+        response = self.client.get('/api/conversations/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    @override_settings(API_GZIP_MIN_LENGTH=1024 * 1024)
+    def test_small_page_sent_whole(self):
+        """
+        Test that pages under the threshold are plain responses with a body.
+        """
+        response = self.client.get('/api/messages/', {'page_size': 30}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.streaming)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(len(json.loads(response.content)['results']), 30)
+
+    def test_benchmark_command(self):
+        """
+        Test that the benchmark runs and leaves no data behind.
+        """
+        stdout = StringIO()
+        call_command('benchmark_json_renderers', page_size=10, rounds=1, stdout=stdout)
+        self.assertIn('streaming + gzip', stdout.getvalue())
+        self.assertEqual(Message.objects.count(), 30)
+
+
+class RequestMetricsTestCase(TestCase):
+    """
+    Test case for per-endpoint request metrics and their Prometheus endpoint.
+    """
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.alice = create_user('alice')
+        self.bob = create_user('bob')
+        self.admin = create_user('admin', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.alice)
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.alice, self.bob)
+        Message.objects.create(sender=self.bob, conversation=conversation, message_body='Hello')
+
+    def tearDown(self):
+        metrics.reset()
+
+    def test_records_per_endpoint(self):
+        """
+        Test that each viewset action gets its own latency, queries, serializer time and bytes.
+        """
+        response = self.client.get('/api/conversations/')
+        self.client.get('/api/conversations/')
+        self.client.post('/api/messages/bulk_send/', {'messages': []}, format='json')
+
+        values = metrics.collect()
+        labels = ('ConversationViewSet.list', 'GET')
+        self.assertEqual(values[metrics.metric_key('requests', *labels, '200')], 2)
+        self.assertEqual(sum(
+            values.get(metrics.metric_key('latency_bucket', *labels, bucket), 0)
+            for bucket in range(len(metrics.LATENCY_BUCKETS))
+        ), 2)
+        self.assertGreater(values[metrics.metric_key('queries', *labels)], 0)
+        self.assertGreater(values[metrics.metric_key('query_seconds', *labels)], 0)
+        self.assertGreater(values[metrics.metric_key('serializer_seconds', *labels)], 0)
+        self.assertEqual(values[metrics.metric_key('response_bytes', *labels)], 2 * len(response.content))
+        self.assertIn(metrics.metric_key('requests', 'MessageViewSet.bulk_send', 'POST', '400'), values)
+
+    async def test_records_queries_under_asgi(self):
+        """
+        Test that viewset requests served over ASGI still record queries and serializer time.
+        """
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.alice)}'}
+        response = await self.async_client.get('/api/conversations/', headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        values = metrics.collect()
+        labels = ('ConversationViewSet.list', 'GET')
+        self.assertEqual(values[metrics.metric_key('requests', *labels, '200')], 1)
+        self.assertGreater(values[metrics.metric_key('queries', *labels)], 0)
+        self.assertGreater(values[metrics.metric_key('query_seconds', *labels)], 0)
+        self.assertGreater(values[metrics.metric_key('serializer_seconds', *labels)], 0)
+
+    def test_unknown_methods_share_one_series(self):
+        """
+        Test that arbitrary client methods are recorded as OTHER and still render.
+        """
+        for method in ('FOO|BAR', 'PROPFIND', 'X' * 200):
+            self.client.generic(method, '/api/conversations/')
+        values = metrics.collect()
+        methods = {json.loads(key)[2] for key in values}
+        self.assertEqual(methods, {'OTHER'})
+        self.assertGreater(values[metrics.metric_key('latency_sum', 'ConversationViewSet', 'OTHER')], 0)
+        body = metrics.render_prometheus(values)
+        self.assertIn('http_requests_total{endpoint="ConversationViewSet",method="OTHER",status="405"} 3', body)
+
+    def test_workers_share_directory(self):
+        """
+        Test that stores of several processes are summed, including after growth.
+        """
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            first = metrics.MmapedValues(os.path.join(directory, '1.db'))
+            second = metrics.MmapedValues(os.path.join(directory, '2.db'))
+            queries = metrics.metric_key('queries', 'A.list', 'GET')
+            first.add(queries, 3)
+            second.add(queries, 4)
+            for index in range(2000):
+                second.add(metrics.metric_key('requests', f'Endpoint{index}.list', 'GET', '200'), 1)
+            self.assertGreater(len(second.map), metrics.MmapedValues.initial_size)
+
+            values = metrics.collect()
+            self.assertEqual(values[queries], 7)
+            self.assertEqual(values[metrics.metric_key('requests', 'Endpoint1999.list', 'GET', '200')], 1)
+            # A restarted worker reusing the file keeps its totals
+            self.assertEqual(metrics.MmapedValues(os.path.join(directory, '1.db')).offsets.keys(), {queries})
+
+    def test_prometheus_endpoint(self):
+        """
+        Test that the text endpoint is staff only and renders histograms.
+        """
+        self.client.get('/api/conversations/')
+        response = self.client.get('/api/metrics/requests/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get('/api/metrics/requests/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn(
+            'http_request_duration_seconds_count{endpoint="ConversationViewSet.list",method="GET"} 1', body
+        )
+        self.assertIn(
+            'http_request_duration_seconds_bucket{endpoint="ConversationViewSet.list",method="GET",le="+Inf"} 1', body
+        )
+        self.assertIn('http_requests_total{endpoint="ConversationViewSet.list",method="GET",status="200"} 1', body)
+        self.assertIn('http_request_db_queries_total{endpoint="ConversationViewSet.list",method="GET"}', body)
+
+
+class LoadBenchmarkTestCase(TestCase):
+    """
+    Test case for the synthetic data seeder and the API benchmark suite.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        call_command(
+            'seed_load_data', users=8, conversations=5, messages=60, batch_size=25, stdout=StringIO()
+        )
+
+    def test_seeded_data_is_consistent(self):
+        """
+        Test that seeding fills messages, activity columns and counts, and refuses to run twice.
+        """
+        self.assertEqual(Message.objects.count(), 60)
+        busiest = Conversation.objects.order_by('-message_count').first()
+        self.assertGreater(busiest.message_count, 60 // 5)
+        for conversation in Conversation.objects.all():
+            self.assertEqual(conversation.participant_count, conversation.participants.count())
+        self.assertEqual(
+            sum(Conversation.objects.values_list('message_count', flat=True)), 60
+        )
+        self.assertGreater(
+            Message.objects.order_by('sent_at').first().sent_at,
+            timezone.now() - timedelta(days=366)
+        )
+        with self.assertRaises(CommandError):
+            call_command('seed_load_data', users=8, conversations=5, messages=10, stdout=StringIO())
+
+    def test_benchmark_writes_and_compares_results(self):
+        """
+        Test that every endpoint is measured without errors and regressions are caught.
+        """
+        output = os.path.join(self.directory.name, 'results.json')
+        stdout = StringIO()
+        call_command('benchmark_api', workers=1, requests=5, warmup=1, output=output, stdout=stdout)
+        with open(output) as results_file:
+            results = json.load(results_file)
+        self.assertEqual(results['database'], 'sqlite')
+        self.assertIn('conversation.messages', results['endpoints'])
+        for name, result in results['endpoints'].items():
+            self.assertEqual(result['errors'], 0, name)
+            self.assertEqual(result['requests'], 5)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['queries_per_request'], 0)
+
+        for result in results['endpoints'].values():
+            result['p95_ms'] /= 100
+        baseline = os.path.join(self.directory.name, 'baseline.json')
+        with open(baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file)
+        with self.assertRaises(CommandError):
+            call_command(
+                'benchmark_api', workers=1, requests=2, read_only=True, endpoints=['conversation.list'],
+                output=output, compare=baseline, max_regression=0.5, stdout=StringIO()
+            )
+
+
+class ConversationScopedMessagesTestCase(TestCase):
+    """
+    Test case for message requests scoped to a single conversation.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user('alice')
+        self.other = create_user('bob')
+        self.client.force_authenticate(user=self.user)
+
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        self.elsewhere = Conversation.objects.create()
+        self.elsewhere.participants.add(self.user)
+        self.private = Conversation.objects.create()
+        self.private.participants.add(self.other)
+        for conversation in (self.conversation, self.elsewhere, self.private):
+            for i in range(3):
+                Message.objects.create(
+                    sender=self.other if conversation is self.private else self.user,
+                    conversation=conversation,
+                    message_body=f'Message {i}'
+                )
+
+    def test_conversation_id_list_reads_one_conversation(self):
+        """
+        Test that ?conversation_id= reads the conversation by its ID, without the inbox subquery.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/messages/', {'conversation_id': self.conversation.pk})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(
+            {row['conversation'] for row in response.data['results']},
+            {self.conversation.pk}
+        )
+        self.assertEqual(
+            [row['message_body'] for row in response.data['results']],
+            ['Message 2', 'Message 1', 'Message 0']
+        )
+        message_queries = [
+            query['sql'] for query in queries.captured_queries if 'FROM "chats_message"' in query['sql']
+        ]
+        self.assertEqual(len(message_queries), 2)
+        for sql in message_queries:
+            self.assertNotIn('chats_conversation_participants', sql)
+            self.assertEqual(sql.count('"chats_message"."conversation_id" ='), 1)
+
+    def test_conversation_id_list_rejects_non_participants(self):
+        """
+        Test that a conversation the user is not in still returns 404.
+        """
+        response = self.client.get('/api/messages/', {'conversation_id': self.private.pk})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get('/api/messages/', {'conversation_id': 'not-a-uuid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_nested_route_is_scoped_to_its_conversation(self):
+        """
+        Test that nested message routes only see the conversation in the URL.
+        """
+        message = Message.objects.filter(conversation=self.elsewhere).first()
+        url = f'/api/conversations/{self.conversation.pk}/messages/{message.pk}/'
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+        url = f'/api/conversations/{self.elsewhere.pk}/messages/{message.pk}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['message_id'], str(message.pk))
+
+        message = Message.objects.filter(conversation=self.private).first()
+        url = f'/api/conversations/{self.private.pk}/messages/{message.pk}/'
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,369 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Min, Q
+from django.http import JsonResponse
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from .authentication import get_authentication_classes
+from .membership import get_conversation_ids
+from .models import ChangeEvent, Conversation
+from .serializers import MessageRowSerializer
+from .sharding import messages_for_conversations
+
+MESSAGE_EVENTS = (ChangeEvent.MESSAGE_CREATED, ChangeEvent.MESSAGE_UPDATED)
+
+
+def record_events(events):
+    """
+    Append unsaved ChangeEvent instances to the feed once the surrounding
+    transaction commits.
+
+    Inserting after commit, in its own short statement, keeps the gap
+    between an ID being allocated and becoming visible tiny, so readers
+    holding a cursor do not skip over late-committing events.
+    """
+    if not events:
+        return
+
+    def insert():
+        ChangeEvent.objects.bulk_create(events)
+        hub.kick()
+
+    transaction.on_commit(insert)
+
+
+def record_messages(kind, messages):
+    """
+    Record a message event for each message.
+    """
+    record_events([
+        ChangeEvent(kind=kind, conversation_id=message.conversation_id, object_id=message.message_id)
+        for message in messages
+    ])
+
+
+def record_participants(kind, conversation_id, user_ids):
+    """
+    Record one participant event per user added to or removed from a conversation.
+    """
+    record_events([
+        ChangeEvent(kind=kind, conversation_id=conversation_id, user_id=user_id)
+        for user_id in user_ids
+    ])
+
+
+def latest_cursor():
+    """
+    Return the ID of the newest event, or 0 when the feed is empty.
+    """
+    return ChangeEvent.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+
+class CursorExpired(Exception):
+    """
+    The cursor points before the oldest retained event.
+    """
+
+
+EVENT_FIELDS = ('id', 'kind', 'conversation_id', 'object_id', 'user_id', 'created_at')
+
+
+def render_events(rows):
+    """
+    Turn ChangeEvent `values()` rows into feed entries. Message events carry
+    the message as rendered by MessageRowSerializer, or None if it has since
+    been deleted.
+    """
+    message_rows = [row for row in rows if row['kind'] in MESSAGE_EVENTS]
+    serializer = MessageRowSerializer()
+    messages = {
+        message['message_id']: serializer.to_representation(message)
+        for message in MessageRowSerializer.values(
+            messages_for_conversations({row['conversation_id'] for row in message_rows}).filter(
+                pk__in={row['object_id'] for row in message_rows}
+            )
+        )
+    } if message_rows else {}
+
+    entries = []
+    for row in rows:
+        entry = {
+            'id': row['id'],
+            'type': row['kind'],
+            'conversation_id': row['conversation_id'],
+            'created_at': row['created_at'],
+        }
+        if row['kind'] in MESSAGE_EVENTS:
+            entry['message'] = messages.get(row['object_id'])
+        elif row['kind'] == ChangeEvent.MESSAGE_DELETED:
+            entry['message_id'] = row['object_id']
+        else:
+            entry['user_id'] = row['user_id']
+        entries.append(entry)
+    return entries
+
+
+def feed_page(entries, cursor, limit=None):
+    """
+    Build the response body for a list of feed entries.
+    """
+    limit = limit or settings.UPDATES_PAGE_SIZE
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    return {
+        'cursor': entries[-1]['id'] if entries else cursor,
+        'has_more': has_more,
+        'events': entries,
+    }
+
+
+def read_events(user, cursor, limit=None):
+    """
+    Return the feed page for `user` after `cursor`: events in conversations
+    the user is in, plus participant events addressed to the user (so
+    removals and deleted conversations still reach them).
+    """
+    limit = limit or settings.UPDATES_PAGE_SIZE
+    oldest = ChangeEvent.objects.aggregate(oldest=Min('id'))['oldest']
+    if oldest is not None and cursor < oldest - 1:
+        raise CursorExpired
+
+    my_conversations = Conversation.participants.through.objects.filter(
+        user_id=user.pk
+    ).values('conversation_id')
+    rows = list(ChangeEvent.objects.filter(
+        Q(conversation_id__in=my_conversations) | Q(user_id=user.pk),
+        id__gt=cursor
+    ).order_by('id').values(*EVENT_FIELDS)[:limit + 1])
+    return feed_page(render_events(rows), cursor, limit)
+
+
+class Waiter:
+    """
+    A long-poll request parked in the hub.
+
+    `pending` collects the rendered entries the hub delivers; it is only
+    trusted when `stale` is unset, otherwise the request re-reads its feed.
+    """
+
+    def __init__(self, user_id, conversation_ids, cursor):
+        self.user_id = str(user_id)
+        self.conversation_ids = conversation_ids
+        self.cursor = cursor
+        self.event = asyncio.Event()
+        self.reset()
+
+    def reset(self):
+        self.event.clear()
+        self.pending = []
+        self.stale = False
+
+    def deliver(self, entry):
+        if entry['id'] <= self.cursor or (self.pending and self.pending[-1] is entry):
+            return
+        self.pending.append(entry)
+        if entry['type'] == ChangeEvent.PARTICIPANT_ADDED and str(entry['user_id']) == self.user_id:
+            # Joined a conversation: its events are not in our index yet
+            self.stale = True
+        self.event.set()
+
+    def wake(self):
+        self.stale = True
+        self.event.set()
+
+
+class UpdateHub:
+    """
+    Per-process fan-out of feed events to parked long-poll requests.
+
+    Once the first request waits, a single task reads and renders new
+    events, once per `UPDATES_POLL_INTERVAL` or as soon as this process
+    records one, and hands each waiter the entries for its conversations. Idle
+    waiters cost an entry in two dicts, not a query or a thread each, and
+    a burst of events costs one read per process rather than one per
+    waiter.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.task = None
+        self.wakeup = None
+        self.head = None
+        self.registrations = 0
+        self.by_user = {}
+        self.by_conversation = {}
+
+    def __len__(self):
+        return sum(len(waiters) for waiters in self.by_user.values())
+
+    def register(self, user_id, conversation_ids, cursor):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            # A new event loop (e.g. one per test); start from scratch
+            self.__init__()
+            self.loop = loop
+            self.wakeup = asyncio.Event()
+
+        waiter = Waiter(user_id, conversation_ids, cursor)
+        self.registrations += 1
+        self.by_user.setdefault(waiter.user_id, set()).add(waiter)
+        for conversation_id in conversation_ids:
+            self.by_conversation.setdefault(conversation_id, set()).add(waiter)
+        if self.task is None:
+            self.task = loop.create_task(self.run())
+        return waiter
+
+    def unregister(self, waiter):
+        self._discard(self.by_user, waiter.user_id, waiter)
+        for conversation_id in waiter.conversation_ids:
+            self._discard(self.by_conversation, conversation_id, waiter)
+
+    def kick(self):
+        """
+        Wake the hub now instead of at the next poll; safe from any thread.
+        """
+        loop, wakeup = self.loop, self.wakeup
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(wakeup.set)
+
+    async def run(self):
+        """
+        Keep running for the life of the event loop; while nobody waits,
+        only the head is kept current so the next waiter starts there
+        rather than replaying a backlog.
+        """
+        try:
+            await self.catch_up()
+            while True:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), settings.UPDATES_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                if not self.by_user:
+                    await self.catch_up()
+                    continue
+                entries = await sync_to_async(self.fetch)(self.head)
+                while entries:
+                    self.head = entries[-1]['id']
+                    self.dispatch(entries)
+                    if len(entries) < settings.UPDATES_PAGE_SIZE:
+                        break
+                    entries = await sync_to_async(self.fetch)(self.head)
+        finally:
+            self.task = None
+
+    async def catch_up(self):
+        """
+        Move the head to the newest event without dispatching anything.
+        Waiters that registered meanwhile may have missed the skipped
+        events, so they are woken to re-read their feed.
+        """
+        registrations = self.registrations
+        starting = self.head is None
+        self.head = max(self.head or 0, await sync_to_async(latest_cursor)())
+        if starting or self.registrations != registrations:
+            for waiters in list(self.by_user.values()):
+                for waiter in waiters:
+                    waiter.wake()
+
+    def fetch(self, head):
+        return render_events(list(ChangeEvent.objects.filter(id__gt=head).order_by('id').values(
+            *EVENT_FIELDS
+        )[:settings.UPDATES_PAGE_SIZE]))
+
+    def dispatch(self, entries):
+        for entry in entries:
+            for waiter in self.by_conversation.get(str(entry['conversation_id']), ()):
+                waiter.deliver(entry)
+            if entry.get('user_id') is not None:
+                for waiter in self.by_user.get(str(entry['user_id']), ()):
+                    waiter.deliver(entry)
+
+    def _discard(self, index, key, waiter):
+        waiters = index.get(key)
+        if waiters is not None:
+            waiters.discard(waiter)
+            if not waiters:
+                del index[key]
+
+
+hub = UpdateHub()
+
+
+def authenticate(request):
+    """
+    Authenticate a plain Django request with the API's authentication
+    classes (API_AUTHENTICATION_CLASSES['updates'] if set). Returns the
+    user and their conversation IDs, or None.
+    """
+    classes = get_authentication_classes('updates', api_settings.DEFAULT_AUTHENTICATION_CLASSES)
+    drf_request = Request(request, authenticators=[auth() for auth in classes])
+    try:
+        user = drf_request.user
+    except APIException:
+        return None
+    if not user or not user.is_authenticated:
+        return None
+    return user, get_conversation_ids(user)
+
+
+async def updates_view(request):
+    """
+    GET /api/updates/?cursor=<id>&timeout=<seconds>
+
+    Return every message, conversation and membership change visible to the
+    user after `cursor`. When there are none, hold the request until one
+    arrives or `timeout` seconds pass (default UPDATES_TIMEOUT, capped at
+    UPDATES_MAX_TIMEOUT), then answer with an empty page. Without a cursor
+    the current position is returned immediately. A cursor older than the
+    retained events gets 410 Gone and the client should re-sync.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    authenticated = await sync_to_async(authenticate)(request)
+    if authenticated is None:
+        return JsonResponse({'error': 'Authentication credentials were not provided'}, status=401)
+    user, conversation_ids = authenticated
+
+    try:
+        cursor = request.GET.get('cursor')
+        cursor = int(cursor) if cursor not in (None, '') else None
+        timeout = float(request.GET.get('timeout', settings.UPDATES_TIMEOUT))
+    except ValueError:
+        return JsonResponse({'error': 'cursor must be an integer and timeout a number'}, status=400)
+    if cursor is not None and cursor < 0:
+        return JsonResponse({'error': 'cursor must not be negative'}, status=400)
+    timeout = min(max(timeout, 0), settings.UPDATES_MAX_TIMEOUT)
+
+    if cursor is None:
+        latest = await sync_to_async(latest_cursor)()
+        return JsonResponse({'cursor': latest, 'has_more': False, 'events': []})
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    waiter = hub.register(user.pk, conversation_ids, cursor)
+    try:
+        while True:
+            if waiter.pending and not waiter.stale:
+                page = feed_page(waiter.pending, cursor)
+            else:
+                # Reset before reading, so an event landing mid-read still wakes us
+                waiter.reset()
+                try:
+                    page = await sync_to_async(read_events)(user, cursor)
+                except CursorExpired:
+                    return JsonResponse({'error': 'cursor expired, re-sync and start from a new cursor'}, status=410)
+            remaining = deadline - loop.time()
+            if page['events'] or remaining <= 0:
+                return JsonResponse(page)
+            try:
+                await asyncio.wait_for(waiter.event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return JsonResponse(page)
+    finally:
+        hub.unregister(waiter)
@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework import routers
 from rest_framework_nested import routers as nested_routers
-from .views import ConversationViewSet, MessageViewSet, UserViewSet
+from .views import ConversationViewSet, MessageViewSet, UserViewSet, database_pool_metrics, request_metrics
+from .updates import updates_view
 from .auth import (
     register_user,
     login_user,
@@ -9,6 +10,7 @@ from .auth import (
     user_profile,
     update_profile,
     change_password,
+    auth_metrics,
     CustomTokenObtainPairView
 )
 from rest_framework_simplejwt.views import (
@@ -43,6 +45,9 @@ auth_patterns = [
     path('profile/', user_profile, name='user_profile'),
     path('profile/update/', update_profile, name='update_profile'),
     path('profile/change-password/', change_password, name='change_password'),
+
+    # Authentication cache metrics (staff only)
+    path('metrics/', auth_metrics, name='auth_metrics'),
 ]
 
 # The API URLs are now determined automatically by the router
@@ -50,6 +55,15 @@ urlpatterns = [
     # Authentication routes
     path('auth/', include(auth_patterns)),
     
+    # Long-poll change feed (async view; serve under ASGI)
+    path('updates/', updates_view, name='updates'),
+
+    # Per-process database connection pool statistics (staff only)
+    path('metrics/db-pool/', database_pool_metrics, name='database_pool_metrics'),
+
+    # Per-endpoint request metrics for Prometheus (staff only)
+    path('metrics/requests/', request_metrics, name='request_metrics'),
+
     # API routes
     path('', include(router.urls)),
     path('', include(conversations_router.urls)),
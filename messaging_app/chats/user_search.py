@@ -0,0 +1,116 @@
+import re
+import unicodedata
+from django.db.models import Q
+from .models import User, UserSearchToken
+
+TOKEN_LENGTH = UserSearchToken._meta.get_field('token').max_length
+
+# Fields whose changes require re-tokenizing a user
+INDEXED_FIELDS = frozenset(['first_name', 'last_name', 'username', 'email'])
+
+
+def normalize(text):
+    """
+    Case-fold and strip accents, so "Émile" is found by "emile".
+    """
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def tokenize(text):
+    """
+    Split text into normalized words.
+    """
+    return [word[:TOKEN_LENGTH] for word in re.findall(r'[^\W_]+', normalize(text))]
+
+
+def user_tokens(user):
+    """
+    Return the set of (token, field) pairs indexed for a user: the words of
+    their names, username and email, plus the whole email address.
+    """
+    tokens = set()
+    for text in (user.first_name, user.last_name):
+        tokens.update((word, UserSearchToken.NAME) for word in tokenize(text))
+    tokens.update((word, UserSearchToken.USERNAME) for word in tokenize(user.username))
+    tokens.update((word, UserSearchToken.EMAIL) for word in tokenize(user.email))
+    if user.email:
+        tokens.add((normalize(user.email)[:TOKEN_LENGTH], UserSearchToken.EMAIL))
+    return tokens
+
+
+def index_users(users):
+    """
+    Replace the search tokens of `users`.
+    """
+    users = list(users)
+    UserSearchToken.objects.filter(user__in=users).delete()
+    UserSearchToken.objects.bulk_create([
+        UserSearchToken(user=user, token=token, field=field)
+        for user in users
+        for token, field in sorted(user_tokens(user))
+    ])
+
+
+def prefix(term):
+    """
+    Match tokens starting with `term` as a range, which every backend can
+    answer from the token index (LIKE 'term%' cannot on SQLite).
+    """
+    upper = term[:-1] + chr(ord(term[-1]) + 1)
+    return Q(token__gte=term, token__lt=upper)
+
+
+def matching_tokens(query, field=None):
+    """
+    Return the tokens matching the longest word of `query`, restricted to
+    users who also have tokens matching every other word, or None if the
+    query has no words.
+    """
+    terms = sorted(set(tokenize(query)), key=len, reverse=True)
+    if not terms:
+        return None
+    fields = {'field': field} if field else {}
+
+    # The longest word is usually the most selective, so it drives the scan
+    tokens = UserSearchToken.objects.filter(prefix(terms[0]), **fields)
+    for term in terms[1:]:
+        tokens = tokens.filter(user_id__in=UserSearchToken.objects.filter(
+            prefix(term), **fields
+        ).values('user_id'))
+    return tokens
+
+
+def filter_users(queryset, query, field=None):
+    """
+    Narrow a user queryset to users whose words start with every word of
+    `query`, e.g. "ali smi" finds Alice Smith. A blank query leaves the
+    queryset alone; a query with nothing searchable in it (e.g. "!!!")
+    matches nobody.
+    """
+    tokens = matching_tokens(query, field)
+    if tokens is None:
+        return queryset if not query.strip() else queryset.none()
+    return queryset.filter(user_id__in=tokens.values('user_id'))
+
+
+def autocomplete(query, limit):
+    """
+    Return up to `limit` active users matching `query`, best first.
+
+    Matches are read in token order from the index, so a user whose word
+    equals the query ranks before longer words, and the scan stops after a
+    few `limit`s of rows however many users match.
+    """
+    tokens = matching_tokens(query)
+    if tokens is None:
+        return []
+
+    user_ids = []
+    # A user can match through several tokens; read extra rows to make up for it
+    for user_id in tokens.order_by('token', 'user_id').values_list('user_id', flat=True)[:limit * 4]:
+        if user_id not in user_ids:
+            user_ids.append(user_id)
+
+    users = User.objects.filter(user_id__in=user_ids, is_active=True).in_bulk()
+    return [users[user_id] for user_id in user_ids if user_id in users][:limit]
@@ -1,17 +1,25 @@
 from rest_framework import viewsets, status, filters
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from django.db.models import Q
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import User, Conversation, Message
+from messaging_app.db.pool import pool_stats
+from .models import User, Conversation, ConversationParticipant, Message, ChangeEvent, UserSearchToken
 from .serializers import (
     UserSerializer,
     ConversationSerializer,
     ConversationListSerializer,
     MessageSerializer,
-    MessageCreateSerializer
+    MessageRowSerializer,
+    MessageCreateSerializer,
+    BulkMessageItemSerializer
 )
 from .permissions import (
     IsParticipantOfConversation,
@@ -19,11 +27,57 @@ from .permissions import (
     UserProfilePermission,
     CanAccessOwnData
 )
-from .filters import MessageFilter, ConversationFilter, UserFilter
+from .authentication import EndpointAuthenticationMixin
+from .membership import get_conversation_ids, is_participant
+from .metrics import RequestMetricsMixin, collect, render_prometheus
+from .conditional import conversation_version, inbox_version, make_etag, not_modified, set_etag
+from .activity import mark_conversation_read, mark_read_up_to, record_new_messages
+from .archive import conversation_history
+from .search import index_messages
+from .sharding import (
+    ShardedQuerySet,
+    is_sharded,
+    messages_for_conversation,
+    messages_for_conversations,
+    with_senders,
+)
+from .updates import record_messages
+from .filters import (
+    MessageFilter, MessageFilterBackend, MessageSearchFilter, ConversationFilter, UserFilter, UserSearchFilter
+)
 from .pagination import MessagePagination, ConversationPagination, UserPagination
+from .streaming import StreamingResponseMixin, stream_ndjson
+from .user_search import autocomplete, filter_users
+
+
+def paginated_message_rows(paginator, page, context):
+    """
+    Render a page of `MessageRowSerializer.values()` rows.
+    `?sender_format=compact` replaces each nested sender with its ID and
+    adds the sender dicts once under `senders`.
+    """
+    request = context['request']
+    context = dict(context, sender_format=request.query_params.get('sender_format'))
+    serializer = MessageRowSerializer(page, many=True, context=context)
+    response = paginator.get_paginated_response(serializer.data)
+    if serializer.child.compact:
+        response.data['senders'] = serializer.child.senders
+    return response
+
 
+def read_state(conversation_id, user):
+    """
+    Return a participant's read cursor and unread count.
+    """
+    return ConversationParticipant.objects.filter(
+        conversation_id=conversation_id,
+        user_id=user.pk
+    ).values('conversation_id', 'last_read_message_id', 'last_read_at', 'unread_count').first()
 
-class UserViewSet(viewsets.ModelViewSet):
+
+class UserViewSet(
+    RequestMetricsMixin, EndpointAuthenticationMixin, StreamingResponseMixin, viewsets.ModelViewSet
+):
     """
     ViewSet for managing users.
     Provides CRUD operations for user management with proper permissions.
@@ -32,7 +86,7 @@ class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated, UserProfilePermission]
     lookup_field = 'user_id'
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, UserSearchFilter, filters.OrderingFilter]
     filterset_class = UserFilter
     search_fields = ['first_name', 'last_name', 'email', 'username']
     ordering_fields = ['first_name', 'last_name', 'email', 'created_at']
@@ -55,11 +109,43 @@ class UserViewSet(viewsets.ModelViewSet):
         if email and self.request.user.is_superuser:
             queryset = queryset.filter(email__icontains=email)
         if name and self.request.user.is_superuser:
-            queryset = queryset.filter(
-                Q(first_name__icontains=name) | Q(last_name__icontains=name)
-            )
+            queryset = filter_users(queryset, name, field=UserSearchToken.NAME)
         return queryset
 
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """
+        Suggest active users whose name, username or email words start
+        with the words of `?q=`, e.g. when adding participants. Returns at
+        most `?limit=` (default 10, up to 50) users, without emails.
+        """
+        query = request.query_params.get('q', '').strip()
+        try:
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            return Response(
+                {'error': 'limit must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if limit < 1:
+            return Response(
+                {'error': 'limit must be positive'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        users = autocomplete(query, limit) if query else []
+        return Response({
+            'results': [
+                {
+                    'user_id': user.user_id,
+                    'username': user.username,
+                    'first_name': user.first_name,
+                    'last_name': user.last_name,
+                }
+                for user in users
+            ]
+        })
+
     def create(self, request, *args, **kwargs):
         """
         Prevent user creation through this endpoint.
@@ -95,7 +181,9 @@ class UserViewSet(viewsets.ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(
+    RequestMetricsMixin, EndpointAuthenticationMixin, StreamingResponseMixin, viewsets.ModelViewSet
+):
     """
     ViewSet for managing conversations.
     Users can only access conversations they participate in.
@@ -105,16 +193,48 @@ class ConversationViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_class = ConversationFilter
     search_fields = ['participants__first_name', 'participants__last_name', 'participants__email']
-    ordering_fields = ['created_at', 'updated_at']
+    ordering_fields = ['created_at', 'updated_at', 'last_message_at', 'message_count', 'participant_count']
     pagination_class = ConversationPagination
 
     def get_queryset(self):
         """
         Return only conversations where the current user is a participant.
         """
-        return Conversation.objects.filter(
-            participants=self.request.user
-        ).distinct().order_by('-updated_at')
+        # Filter through a membership subquery rather than joining
+        # participants, so no DISTINCT is needed and per-conversation
+        # aggregates are not multiplied by the join.
+        my_conversations = Conversation.participants.through.objects.filter(
+            user_id=self.request.user.user_id
+        ).values('conversation_id')
+        queryset = Conversation.objects.filter(
+            conversation_id__in=my_conversations
+        ).order_by('-updated_at')
+
+        if self.action == 'list':
+            queryset = self.annotate_list_queryset(queryset)
+        return queryset
+
+    def annotate_list_queryset(self, queryset):
+        """
+        Attach everything ConversationListSerializer needs so a page is
+        rendered with a fixed number of queries: the last message is read
+        from the denormalized activity columns (as is the participant
+        count), the user's read state from their participant row and
+        participants from a single prefetch.
+        """
+        read_state = ConversationParticipant.objects.filter(
+            conversation_id=OuterRef('pk'),
+            user_id=self.request.user.pk
+        )
+
+        return queryset.annotate(
+            unread_count=Coalesce(Subquery(read_state.values('unread_count')[:1]), 0),
+            last_read_at=Subquery(read_state.values('last_read_at')[:1]),
+        ).select_related(
+            'last_message_sender'
+        ).prefetch_related(
+            Prefetch('participants', queryset=User.objects.order_by())
+        )
 
     def get_serializer_class(self):
         """
@@ -124,6 +244,18 @@ class ConversationViewSet(viewsets.ModelViewSet):
             return ConversationListSerializer
         return ConversationSerializer
 
+    def list(self, request, *args, **kwargs):
+        """
+        List the user's conversations.
+        Answers 304 Not Modified without querying the page when the client's
+        If-None-Match still matches the inbox version.
+        """
+        etag = make_etag(request, inbox_version(request.user))
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        return set_etag(super().list(request, *args, **kwargs), etag)
+
     def create(self, request, *args, **kwargs):
         """
         Create a new conversation.
@@ -136,13 +268,41 @@ class ConversationViewSet(viewsets.ModelViewSet):
         conversation = serializer.save()
         
         # Add the current user as a participant if not already included
-        if not conversation.participants.filter(user_id=request.user.user_id).exists():
+        if not is_participant(request.user, conversation):
             conversation.participants.add(request.user)
+            conversation.refresh_from_db(fields=['participant_count', 'updated_at'])
         
         # Return the created conversation with full serializer
         response_serializer = ConversationSerializer(conversation)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=True, methods=['post'])
+    def mark_read(self, request, conversation_id=None):
+        """
+        Mark the whole conversation read for the current user.
+        A single update of their participant row; no messages are touched.
+        """
+        if not mark_conversation_read(conversation_id, request.user.pk):
+            return Response(
+                {'error': 'Conversation not found or you are not a participant'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(read_state(conversation_id, request.user), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def unread(self, request):
+        """
+        Return the user's total unread messages and how many conversations
+        have any, summed from the maintained per-conversation counts.
+        """
+        totals = ConversationParticipant.objects.filter(
+            user_id=request.user.pk
+        ).aggregate(
+            total_unread=Coalesce(Sum('unread_count'), 0),
+            unread_conversations=Count('pk', filter=Q(unread_count__gt=0))
+        )
+        return Response(totals, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'])
     def add_participant(self, request, conversation_id=None):
         """
@@ -221,16 +381,45 @@ class ConversationViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def messages(self, request, conversation_id=None):
         """
-        Get all messages for a specific conversation.
+        Get messages for a specific conversation.
         Only participants can access messages.
-        """
+        Results are paginated like the message list and support
+        If-None-Match; pass `?stream=ndjson` to export the whole conversation
+        as newline-delimited JSON.
+        """
+        streaming = request.query_params.get('stream') == 'ndjson'
+        etag = None
+        if not streaming and is_participant(request.user, conversation_id):
+            version = conversation_version(conversation_id)
+            if version is not None:
+                etag = make_etag(request, version)
+                response = not_modified(request, etag)
+                if response is not None:
+                    return response
+
         conversation = self.get_object()
-        messages = conversation.messages.all().order_by('sent_at')
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        # Hot and archived messages, read from the archive only when needed
+        messages = with_senders(conversation_history(conversation.pk))
+
+        if streaming:
+            return stream_ndjson(
+                messages,
+                MessageSerializer,
+                ordering=('sent_at', 'message_id'),
+                chunk_size=settings.MESSAGE_STREAM_CHUNK_SIZE,
+                context=self.get_serializer_context()
+            )
 
+        messages = messages.order_by('sent_at', 'message_id')
+        paginator = MessagePagination()
+        page = paginator.paginate_queryset(MessageRowSerializer.values(messages), request, view=self)
+        response = paginated_message_rows(paginator, page, self.get_serializer_context())
+        return set_etag(response, etag) if etag else response
 
-class MessageViewSet(viewsets.ModelViewSet):
+
+class MessageViewSet(
+    RequestMetricsMixin, EndpointAuthenticationMixin, StreamingResponseMixin, viewsets.ModelViewSet
+):
     """
     ViewSet for managing messages.
     Users can only access messages from conversations they participate in.
@@ -238,16 +427,34 @@ class MessageViewSet(viewsets.ModelViewSet):
     """
     permission_classes = [IsAuthenticated, IsParticipantOfConversation, IsMessageSender]
     lookup_field = 'message_id'
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [MessageFilterBackend, MessageSearchFilter, filters.OrderingFilter]
     filterset_class = MessageFilter
-    search_fields = ['message_body', 'sender__first_name', 'sender__last_name', 'sender__email']
+    search_fields = ['message_body']
     ordering_fields = ['sent_at', 'sender__first_name']
     pagination_class = MessagePagination
 
     def get_queryset(self):
         """
         Return messages from conversations where the current user is a participant.
-        """
+        With sharding on, this scatters over the shards holding the user's
+        conversations and merges the results (see ShardedQuerySet).
+
+        Requests scoped to one conversation (see get_conversation_id) check
+        membership once and read only that conversation, on its shard, from
+        the (conversation, sent_at, message_id) index. Listings include its
+        archived messages (see chats.archive.conversation_history).
+        """
+        conversation_id = self.get_conversation_id()
+        if conversation_id is not None:
+            if not is_participant(self.request.user, conversation_id):
+                return Message.objects.none()
+            if self.action == 'list':
+                return conversation_history(conversation_id).order_by('-sent_at', '-message_id')
+            return messages_for_conversation(conversation_id).order_by('-sent_at', '-message_id')
+        if is_sharded():
+            return messages_for_conversations(
+                get_conversation_ids(self.request.user)
+            ).order_by('-sent_at')
         user_conversations = Conversation.objects.filter(
             participants=self.request.user
         )
@@ -255,12 +462,34 @@ class MessageViewSet(viewsets.ModelViewSet):
             conversation__in=user_conversations
         ).order_by('-sent_at')
 
+    def get_conversation_id(self):
+        """
+        Return the conversation this request is scoped to, or None: the
+        nested route's conversation, or `?conversation_id=` on the list.
+        """
+        # NestedDefaultRouter names the kwarg after the parent's lookup_field
+        conversation_id = self.kwargs.get('conversation_conversation_id')
+        if conversation_id is None and self.action == 'list':
+            conversation_id = self.request.query_params.get('conversation_id')
+        return conversation_id or None
+
+    def filter_queryset(self, queryset):
+        """
+        Filter each shard's queryset on its own when messages are sharded,
+        since django-filter only accepts real querysets.
+        """
+        if isinstance(queryset, ShardedQuerySet):
+            return queryset.apply(super().filter_queryset)
+        return super().filter_queryset(queryset)
+
     def get_serializer_class(self):
         """
         Return different serializers for create and other actions.
         """
         if self.action == 'create':
             return MessageCreateSerializer
+        if self.action == 'list':
+            return MessageRowSerializer
         return MessageSerializer
 
     def create(self, request, *args, **kwargs):
@@ -276,7 +505,7 @@ class MessageViewSet(viewsets.ModelViewSet):
         conversation = serializer.validated_data.get('conversation')
         
         # Check if user is a participant in the conversation
-        if not conversation.participants.filter(user_id=request.user.user_id).exists():
+        if not is_participant(request.user, conversation):
             return Response(
                 {'error': 'You are not a participant in this conversation'}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -292,32 +521,47 @@ class MessageViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         """
         List messages with optional conversation filtering.
+        Supports If-None-Match: the version is the conversation's when
+        `conversation_id` is given, otherwise the whole inbox's.
         """
-        queryset = self.get_queryset()
-        conversation_id = request.query_params.get('conversation_id')
-        
-        if conversation_id:
-            # Filter messages by conversation
-            try:
-                conversation = Conversation.objects.get(
-                    conversation_id=conversation_id,
-                    participants=request.user
-                )
-                queryset = queryset.filter(conversation=conversation)
-            except Conversation.DoesNotExist:
-                return Response(
-                    {'error': 'Conversation not found or you are not a participant'}, 
-                    status=status.HTTP_404_NOT_FOUND
-                )
+        conversation_id = self.get_conversation_id()
+        if conversation_id and not is_participant(request.user, conversation_id):
+            return Response(
+                {'error': 'Conversation not found or you are not a participant'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        etag = self.get_list_etag(request, conversation_id)
+        if etag:
+            response = not_modified(request, etag)
+            if response is not None:
+                return response
+
+        # get_queryset already scoped a conversation_id request to that conversation
+        queryset = self.filter_queryset(self.get_queryset())
         
         # Pagination
+        queryset = MessageRowSerializer.values(queryset)
         page = self.paginate_queryset(queryset)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+            response = paginated_message_rows(self.paginator, page, self.get_serializer_context())
+        else:
+            serializer = self.get_serializer(queryset, many=True)
+            response = Response(serializer.data)
+        return set_etag(response, etag) if etag else response
+
+    def get_list_etag(self, request, conversation_id=None):
+        """
+        Return the ETag for a message list, or None when the request cannot
+        be versioned cheaply (e.g. a conversation the user is not in, which
+        falls through to the usual 404).
+        """
+        if not conversation_id:
+            return make_etag(request, inbox_version(request.user))
+        if not is_participant(request.user, conversation_id):
+            return None
+        version = conversation_version(conversation_id)
+        return make_etag(request, version) if version else None
 
     @action(detail=False, methods=['post'])
     def send_message(self, request):
@@ -355,16 +599,101 @@ class MessageViewSet(viewsets.ModelViewSet):
         serializer = MessageSerializer(message)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'])
+    def bulk_send(self, request):
+        """
+        Send a batch of messages to one or more conversations.
+        Expects {"messages": [{"conversation_id": ..., "message_body": ...}, ...]}
+        and inserts every valid entry with a single bulk INSERT.
+        Returns a result per entry, in request order.
+        """
+        items = request.data.get('messages')
+        if not isinstance(items, list) or not items:
+            return Response(
+                {'error': 'messages must be a non-empty list'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        max_items = settings.MESSAGE_BULK_MAX_ITEMS
+        if len(items) > max_items:
+            return Response(
+                {'error': f'At most {max_items} messages can be sent per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # One serializer validates every entry so fields are built once per batch
+        item_serializer = BulkMessageItemSerializer()
+        results = [None] * len(items)
+        pending = []
+        for index, item in enumerate(items):
+            try:
+                data = item_serializer.run_validation(item)
+            except ValidationError as exc:
+                results[index] = {
+                    'index': index,
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': exc.detail
+                }
+                continue
+
+            # Membership comes from the cached index, so a batch costs at
+            # most one participants query however many conversations it spans
+            conversation_id = data['conversation_id']
+            if not is_participant(request.user, conversation_id):
+                results[index] = {
+                    'index': index,
+                    'status': status.HTTP_404_NOT_FOUND,
+                    'error': 'Conversation not found or you are not a participant'
+                }
+                continue
+
+            pending.append((index, Message(
+                sender=request.user,
+                conversation_id=conversation_id,
+                message_body=data['message_body']
+            )))
+
+        if pending:
+            messages = [message for _, message in pending]
+            with transaction.atomic():
+                # bulk_create sends no post_save, so update activity, the
+                # search index and the updates feed here
+                Message.objects.bulk_create(messages)
+                record_new_messages(messages)
+                index_messages(messages)
+                record_messages(ChangeEvent.MESSAGE_CREATED, messages)
+
+        for index, message in pending:
+            results[index] = {
+                'index': index,
+                'status': status.HTTP_201_CREATED,
+                'message_id': message.message_id,
+                'conversation_id': message.conversation_id,
+                'sent_at': message.sent_at
+            }
+
+        if len(pending) == len(items):
+            response_status = status.HTTP_201_CREATED
+        elif pending:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+
+        return Response(
+            {'created': len(pending), 'results': results},
+            status=response_status
+        )
+
     @action(detail=True, methods=['patch'])
     def mark_as_read(self, request, message_id=None):
         """
-        Mark a message as read (placeholder for future implementation).
+        Mark a message, and everything before it, as read for the current
+        user. Read cursors only move forward.
         """
         message = self.get_object()
-        # In a real application, you might have a read_status field
-        # For now, we'll just return success
+        mark_read_up_to(message, request.user.pk)
         return Response(
-            {'message': 'Message marked as read'}, 
+            {'message': 'Message marked as read', **read_state(message.conversation_id, request.user)},
             status=status.HTTP_200_OK
         )
 
@@ -394,4 +723,27 @@ class MessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        return super().destroy(request, *args, **kwargs)
\ No newline at end of file
+        return super().destroy(request, *args, **kwargs)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def request_metrics(request):
+    """
+    Report per-endpoint latency, query, serializer and response size
+    metrics, summed over every worker sharing METRICS_DIR, in the
+    Prometheus text format.
+    """
+    return HttpResponse(
+        render_prometheus(collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def database_pool_metrics(request):
+    """
+    Report this worker process's database connection pools, by alias.
+    """
+    return Response(pool_stats())
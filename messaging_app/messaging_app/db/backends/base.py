@@ -0,0 +1,74 @@
+from messaging_app.db.pool import get_pool
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Serve a DatabaseWrapper's connections from a per-process pool.
+
+    Enabled by a `pool` dict in the database's OPTIONS (`True` for the
+    defaults in messaging_app.db.pool). With CONN_MAX_AGE = 0, Django
+    "closes" the connection at the end of every request; here that
+    returns it to the pool, unless it was left mid-transaction or broken,
+    and the next request reuses it without a new handshake.
+    """
+
+    @property
+    def pool_options(self):
+        options = self.settings_dict['OPTIONS'].get('pool')
+        if not options:
+            return None
+        return {} if options is True else options
+
+    @property
+    def pool(self):
+        options = self.pool_options
+        if options is None:
+            return None
+        return get_pool(self.alias, self.ping_connection, options)
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('pool', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        # Connections go back to the pool they came from, even if the pools
+        # were reset meanwhile
+        self.connection_pool = pool = self.pool
+        if pool is None:
+            self.reused_connection = False
+            return super().get_new_connection(conn_params)
+        connection, self.reused_connection = pool.acquire(
+            lambda: super(PooledDatabaseWrapperMixin, self).get_new_connection(conn_params)
+        )
+        return connection
+
+    def init_connection_state(self):
+        # A pooled connection keeps the session state set when it was opened
+        if not getattr(self, 'reused_connection', False):
+            super().init_connection_state()
+
+    def _close(self):
+        pool = getattr(self, 'connection_pool', None)
+        if pool is None or self.connection is None:
+            return super()._close()
+        reusable = (
+            not self.in_atomic_block
+            and not self.errors_occurred
+            and self.autocommit == self.settings_dict['AUTOCOMMIT']
+        )
+        with self.wrap_database_errors:
+            pool.release(self.connection, reusable)
+
+    @staticmethod
+    def ping_connection(connection):
+        """
+        Raise if a raw DB-API connection is no longer usable. Backends with
+        a cheaper native check (e.g. MySQLdb's ping()) override this.
+        """
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        finally:
+            cursor.close()
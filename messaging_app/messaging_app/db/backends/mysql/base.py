@@ -0,0 +1,12 @@
+from django.db.backends.mysql import base
+from messaging_app.db.backends.base import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """
+    MySQL backend with optional connection pooling.
+    """
+
+    @staticmethod
+    def ping_connection(connection):
+        connection.ping()
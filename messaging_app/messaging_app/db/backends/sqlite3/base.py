@@ -0,0 +1,9 @@
+from django.db.backends.sqlite3 import base
+from messaging_app.db.backends.base import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    """
+    SQLite backend with optional connection pooling, mainly for tests and
+    local benchmarks. In-memory databases are never closed, so never pooled.
+    """
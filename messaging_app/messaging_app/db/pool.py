@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+from collections import Counter, deque
+from django.db import OperationalError
+
+DEFAULT_OPTIONS = {
+    # Open connections (idle or in use) per worker process
+    'max_size': 10,
+    # Seconds an idle connection is kept before it is closed
+    'max_idle': 300,
+    # Idle seconds after which a connection is pinged before reuse
+    'health_check_after': 30,
+    # Seconds to wait for a connection when the pool is exhausted
+    'timeout': 10,
+}
+
+
+class PoolTimeout(OperationalError):
+    """
+    No connection became available within the pool's timeout.
+    """
+
+
+class ConnectionPool:
+    """
+    A per-process pool of raw DB-API connections.
+
+    `acquire` hands out the most recently returned idle connection (so the
+    pool shrinks back to what the load needs), opening a new one while
+    fewer than `max_size` are open and otherwise waiting up to `timeout`
+    seconds. Connections idle for longer than `health_check_after` are
+    pinged first and replaced if the ping fails; connections idle for
+    longer than `max_idle` are closed.
+    """
+
+    def __init__(self, ping, max_size, max_idle, health_check_after, timeout):
+        self.ping = ping
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.condition = threading.Condition()
+        self.idle = deque()
+        self.size = 0
+        self.counters = Counter()
+
+    def acquire(self, connect):
+        """
+        Return `(connection, reused)`, calling `connect()` when a new
+        connection is needed.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            connection, returned_at = self.checkout(deadline)
+            if connection is None:
+                try:
+                    connection = connect()
+                except Exception:
+                    self.discard(None)
+                    raise
+                self.counters['created'] += 1
+                return connection, False
+            if time.monotonic() - returned_at < self.health_check_after or self.healthy(connection):
+                self.counters['reused'] += 1
+                return connection, True
+            self.counters['failed_health_checks'] += 1
+            self.discard(connection)
+
+    def checkout(self, deadline):
+        """
+        Take an idle connection and the time it was returned, or reserve a
+        slot for a new one, returned as `(None, None)`.
+        """
+        with self.condition:
+            while True:
+                self.evict_idle()
+                if self.idle:
+                    return self.idle.pop()
+                if self.size < self.max_size:
+                    self.size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counters['timeouts'] += 1
+                    raise PoolTimeout(
+                        f'No database connection available within {self.timeout} seconds '
+                        f'({self.max_size} in use)'
+                    )
+                self.counters['waits'] += 1
+                self.condition.wait(remaining)
+
+    def release(self, connection, reusable=True):
+        """
+        Give a connection back, or close it if it is not `reusable`.
+        """
+        if not reusable:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        if connection is not None:
+            self.close_quietly(connection)
+            self.counters['closed'] += 1
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def evict_idle(self):
+        # The oldest idle connections are at the left
+        cutoff = time.monotonic() - self.max_idle
+        while self.idle and self.idle[0][1] < cutoff:
+            connection, _ = self.idle.popleft()
+            self.size -= 1
+            self.counters['evicted'] += 1
+            self.close_quietly(connection)
+
+    def healthy(self, connection):
+        try:
+            self.ping(connection)
+        except Exception:
+            return False
+        return True
+
+    def close_quietly(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Close every idle connection; connections in use are closed when
+        they are returned.
+        """
+        with self.condition:
+            while self.idle:
+                connection, _ = self.idle.popleft()
+                self.size -= 1
+                self.close_quietly(connection)
+
+    def stats(self):
+        with self.condition:
+            self.evict_idle()
+            return {
+                'max_size': self.max_size,
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': self.size - len(self.idle),
+                **{
+                    name: self.counters[name]
+                    for name in ('created', 'reused', 'closed', 'evicted', 'failed_health_checks', 'waits', 'timeouts')
+                },
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, ping, options):
+    """
+    Return this process's pool for the database `alias`. A forked child
+    starts with empty pools rather than sharing its parent's sockets.
+    """
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[alias] = ConnectionPool(ping, **{**DEFAULT_OPTIONS, **options})
+        return pool
+
+
+def close_pools():
+    """
+    Close the idle connections of every pool and forget the pools.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            if pool.pid == os.getpid():
+                pool.close()
+        _pools.clear()
+
+
+def pool_stats():
+    """
+    Return the statistics of every pool in this process, by database alias.
+    """
+    with _pools_lock:
+        pools = dict(_pools)
+    return {alias: pool.stats() for alias, pool in pools.items() if pool.pid == os.getpid()}
@@ -0,0 +1,131 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import SimpleLazyObject
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = ContextVar('replica_routing_state', default=None)
+
+
+def _pin_key(user_id):
+    return f'db:primary-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """
+    Send `user_id`'s reads to the primary for the next REPLICA_PIN_SECONDS,
+    so they see their own writes even if replicas lag.
+    """
+    cache.set(_pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+class RoutingState:
+    """
+    What the router knows about the request being served.
+
+    Reads may use a replica only during a safe-method request, once the
+    user is known (authentication itself reads from the primary), while
+    the user is not pinned, and until the request writes anything.
+    """
+
+    def __init__(self, request, replicas_allowed):
+        self.request = request
+        self.replicas_allowed = replicas_allowed
+        self.pinned = None
+
+    def user(self):
+        # DRF sets the authenticated user on the Django request; until then
+        # `user` is AuthenticationMiddleware's lazy object, or missing
+        user = self.request.__dict__.get('user')
+        return None if user is None or isinstance(user, SimpleLazyObject) else user
+
+    def allows_replica(self):
+        if not self.replicas_allowed:
+            return False
+        if self.pinned is None:
+            user = self.user()
+            if user is None:
+                return False
+            self.pinned = user.is_authenticated and bool(cache.get(_pin_key(user.pk)))
+        return not self.pinned
+
+
+@contextmanager
+def routing(request, replicas_allowed):
+    token = _state.set(RoutingState(request, replicas_allowed))
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Send reads to a random REPLICA_DATABASES alias when the current request
+    allows it (see RoutingState), and everything else to the primary.
+    Outside a request (management commands, tests, the shell) every query
+    uses the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = settings.REPLICA_DATABASES
+        if replicas and state is not None and state.allows_replica():
+            return random.choice(replicas)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            # Whatever the request reads after writing must see the write
+            state.replicas_allowed = False
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.REPLICA_DATABASES}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Mark safe-method requests as replica-eligible for ReplicaRouter, and
+    pin the user to the primary after any other request. Async-capable, so
+    the long-poll view keeps running without a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        safe = request.method in SAFE_METHODS
+        with routing(request, replicas_allowed=safe):
+            response = self.get_response(request)
+        self.pin_writer(request, safe)
+        return response
+
+    async def __acall__(self, request):
+        safe = request.method in SAFE_METHODS
+        with routing(request, replicas_allowed=safe):
+            response = await self.get_response(request)
+        self.pin_writer(request, safe)
+        return response
+
+    def pin_writer(self, request, safe):
+        if safe:
+            return
+        user = request.__dict__.get('user')
+        if user is not None and not isinstance(user, SimpleLazyObject) and user.is_authenticated:
+            pin_to_primary(user.pk)
@@ -13,7 +13,8 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 from pathlib import Path
 from datetime import timedelta
 import os
-from decouple import config
+from copy import deepcopy
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'django_filters',
     'chats',
 ]
@@ -52,12 +54,16 @@ REST_FRAMEWORK = {
         'chats.permissions.IsParticipantOfConversation',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'chats.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'chats.authentication.CachedBasicAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'chats.pagination.MessagePagination',  # Uses PageNumberPagination as base
     'PAGE_SIZE': 20,
+    'DEFAULT_RENDERER_CLASSES': [
+        'chats.streaming.StreamingJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
@@ -65,6 +71,86 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Cache backing the conversation-membership index. Set CACHE_URL to a Redis
+# URL when running several workers so invalidations reach all of them.
+CACHE_URL = config('CACHE_URL', default='')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'messaging-app',
+        }
+    }
+
+# Seconds a user's cached set of conversation IDs stays valid
+MEMBERSHIP_CACHE_TIMEOUT = config('MEMBERSHIP_CACHE_TIMEOUT', default=300, cast=int)
+
+# Rows fetched per query when streaming a conversation export (?stream=ndjson)
+MESSAGE_STREAM_CHUNK_SIZE = config('MESSAGE_STREAM_CHUNK_SIZE', default=2000, cast=int)
+
+# Maximum number of messages accepted by POST /api/messages/bulk_send/
+MESSAGE_BULK_MAX_ITEMS = config('MESSAGE_BULK_MAX_ITEMS', default=500, cast=int)
+
+# Seconds a JWT-authenticated user stays cached (dropped early on any user save)
+AUTH_USER_CACHE_TIMEOUT = config('AUTH_USER_CACHE_TIMEOUT', default=60, cast=int)
+
+# Seconds a verified set of Basic auth credentials skips the password hasher
+BASIC_AUTH_CACHE_TIMEOUT = config('BASIC_AUTH_CACHE_TIMEOUT', default=300, cast=int)
+
+# Authentication classes per endpoint, keyed "<router basename>.<action>" or
+# "updates"; endpoints without an entry use DEFAULT_AUTHENTICATION_CLASSES.
+# Empty by default. A deployment whose clients all use tokens can skip the
+# session and Basic schemes on hot read endpoints, e.g.
+#     {'message.list': ['chats.authentication.CachedJWTAuthentication']}
+API_AUTHENTICATION_CLASSES = {}
+
+# Revoked refresh tokens the in-process Bloom filter is sized for (about
+# 1.2 bytes each); it is rebuilt larger if the blacklist outgrows it
+REVOKED_TOKENS_CAPACITY = config('REVOKED_TOKENS_CAPACITY', default=100000, cast=int)
+
+# Seconds between rebuilds of the revoked-token index that drop expired tokens
+REVOKED_TOKENS_COMPACT_INTERVAL = config('REVOKED_TOKENS_COMPACT_INTERVAL', default=3600, cast=int)
+
+# Seconds between checks of the blacklist table for revocations the cache
+# generation did not announce (another worker's, when CACHE_URL is unset);
+# such a logout can take this long to reach this worker
+REVOKED_TOKENS_CHECK_INTERVAL = config('REVOKED_TOKENS_CHECK_INTERVAL', default=1, cast=float)
+
+# Messages older than MESSAGE_ARCHIVE_AFTER_DAYS are moved to the archive
+# table by `manage.py archive_messages`, MESSAGE_ARCHIVE_BATCH_SIZE per
+# transaction
+MESSAGE_ARCHIVE_AFTER_DAYS = config('MESSAGE_ARCHIVE_AFTER_DAYS', default=90, cast=int)
+MESSAGE_ARCHIVE_BATCH_SIZE = config('MESSAGE_ARCHIVE_BATCH_SIZE', default=1000, cast=int)
+
+# Paginated API responses are encoded incrementally by
+# chats.streaming.StreamingJSONRenderer; bodies reaching API_GZIP_MIN_LENGTH
+# bytes are streamed, gzipped when the client accepts it, and smaller ones
+# are sent whole
+API_GZIP_MIN_LENGTH = config('API_GZIP_MIN_LENGTH', default=1024, cast=int)
+
+# Directory where each worker process keeps its request metrics in a
+# memory-mapped file, so /api/metrics/requests/ reports all workers; empty
+# keeps them per process. Use a tmpfs and empty it when the server starts.
+METRICS_DIR = config('METRICS_DIR', default='')
+
+# Dotted path to the message search backend; empty picks one by database vendor
+CHATS_SEARCH_BACKEND = config('CHATS_SEARCH_BACKEND', default='')
+
+# Long-poll updates feed (/api/updates/): default and maximum wait in
+# seconds, how often each process checks for events from other processes,
+# and the most events returned per response
+UPDATES_TIMEOUT = config('UPDATES_TIMEOUT', default=25, cast=float)
+UPDATES_MAX_TIMEOUT = config('UPDATES_MAX_TIMEOUT', default=60, cast=float)
+UPDATES_POLL_INTERVAL = config('UPDATES_POLL_INTERVAL', default=0.5, cast=float)
+UPDATES_PAGE_SIZE = config('UPDATES_PAGE_SIZE', default=500, cast=int)
+
 # Simple JWT Configuration
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -95,14 +181,19 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_EXP_CLAIM': 'refresh_exp',
     'SLIDING_TOKEN_LIFETIME': timedelta(minutes=60),
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=7),
+
+    'TOKEN_REFRESH_SERIALIZER': 'chats.revocation.IndexedTokenRefreshSerializer',
+    'TOKEN_VERIFY_SERIALIZER': 'chats.revocation.IndexedTokenVerifySerializer',
 }
 
 MIDDLEWARE = [
+    'chats.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'messaging_app.db.replicas.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -131,9 +222,14 @@ WSGI_APPLICATION = 'messaging_app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Each worker keeps up to DB_POOL_MAX_SIZE connections open and reuses them
+# across requests (see messaging_app.db.pool); DB_POOL=False opens one per
+# request as before.
+DB_POOL = config('DB_POOL', default=True, cast=bool)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': 'messaging_app.db.backends.mysql',
         'NAME': config('DB_NAME', default='messaging_app_db'),
         'USER': config('DB_USER', default='messaging_user'),
         'PASSWORD': config('DB_PASSWORD', default='secure_password_123'),
@@ -141,10 +237,55 @@ DATABASES = {
         'PORT': config('DB_PORT', default='3306'),
         'OPTIONS': {
             'charset': 'utf8mb4',
+            'pool': {
+                'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+                'max_idle': config('DB_POOL_MAX_IDLE', default=300, cast=int),
+                'health_check_after': config('DB_POOL_HEALTH_CHECK_AFTER', default=30, cast=int),
+                'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+            } if DB_POOL else None,
         },
     }
 }
 
+# Read replicas of the default database, one alias (replica_1, replica_2, ...)
+# per host in DB_REPLICA_HOSTS. Safe-method API requests read from a random
+# replica; a user who writes reads from the primary for REPLICA_PIN_SECONDS.
+DB_REPLICA_HOSTS = config('DB_REPLICA_HOSTS', default='', cast=Csv())
+for number, host in enumerate(DB_REPLICA_HOSTS, 1):
+    DATABASES[f'replica_{number}'] = dict(
+        deepcopy(DATABASES['default']),
+        HOST=host,
+        TEST={'MIRROR': 'default'}
+    )
+REPLICA_DATABASES = [alias for alias in DATABASES if alias.startswith('replica_')]
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=5, cast=int)
+
+# Optional horizontal sharding of chats.Message: one database (shard_1,
+# shard_2, ...) per host in DB_MESSAGE_SHARD_HOSTS, named after DB_NAME.
+# A conversation's messages live on the shard its ID hashes to (see
+# chats.sharding); everything else stays on the default database. Shards
+# cannot be added to a populated deployment without moving messages.
+DB_MESSAGE_SHARD_HOSTS = config('DB_MESSAGE_SHARD_HOSTS', default='', cast=Csv())
+for number, host in enumerate(DB_MESSAGE_SHARD_HOSTS, 1):
+    DATABASES[f'shard_{number}'] = dict(
+        deepcopy(DATABASES['default']),
+        HOST=host,
+        NAME=f"{DATABASES['default']['NAME']}_shard_{number}"
+    )
+MESSAGE_SHARDS = [alias for alias in DATABASES if alias.startswith('shard_')]
+
+# Whether the foreign keys of chats.Message and chats.ArchivedMessage get
+# database constraints. Shards must run without them, since their rows
+# refer to users and conversations kept on the default database, so they
+# are off by default when DB_MESSAGE_SHARD_HOSTS is set. Applied by
+# migration 0013_message_constraints, so set it before migrating.
+MESSAGE_DB_CONSTRAINTS = config('MESSAGE_DB_CONSTRAINTS', default=not MESSAGE_SHARDS, cast=bool)
+
+DATABASE_ROUTERS = [
+    'chats.sharding.MessageShardRouter',
+    'messaging_app.db.replicas.ReplicaRouter',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -0,0 +1,25 @@
+"""
+Django settings for running the messaging_app test suite.
+
+Used by `manage.py test --settings=messaging_app.test_settings` and by
+pytest (see pytest.ini); everything not overridden here comes from
+messaging_app.settings.
+"""
+
+from copy import deepcopy
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+# Extra databases used by chats.tests: three message shards for
+# MessageShardingTestCase and a replica for ReplicaRouterTestCase. The
+# test runner creates and migrates each one like the default database;
+# the test cases enable sharding and replica routing themselves. Shards
+# need messages without foreign key constraints.
+TEST_DATABASES = ['test_shard_1', 'test_shard_2', 'test_shard_3', 'test_replica_1']
+for alias in TEST_DATABASES:
+    DATABASES[alias] = dict(
+        deepcopy(DATABASES['default']),
+        NAME=f"{DATABASES['default']['NAME']}_{alias}"
+    )
+MESSAGE_DB_CONSTRAINTS = False
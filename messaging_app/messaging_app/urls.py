@@ -40,6 +40,7 @@ def api_root(request):
                 'users': '/api/users/',
                 'conversations': '/api/conversations/',
                 'messages': '/api/messages/',
+                'updates': '/api/updates/',
             },
             'admin': '/admin/',
             'api_auth': '/api-auth/',